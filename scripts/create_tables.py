@@ -9,7 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from sqlmodel import SQLModel
 from sqlalchemy.ext.asyncio import create_async_engine
 from src.core.settings import settings
-from src.core.models import Agent, Client, Thread
+from src.core.models import Agent, Client, Thread, ConversationMessage, ConversationSummary, AssistantRecord
 
 
 async def create_tables():
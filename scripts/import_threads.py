@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Importa el historial de los threads de OpenAI a conversation_messages, para
+pasar clientes al motor "chat" (Chat Completions) sin perder el contexto.
+
+Uso:
+    python scripts/import_threads.py                    # todos los clientes
+    python scripts/import_threads.py --client-id 3      # un cliente
+    python scripts/import_threads.py --client-id 3 --switch
+    python scripts/import_threads.py --force            # reimportar conversaciones ya importadas
+
+--switch cambia el motor del cliente a "chat" al terminar la importación.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, select
+
+from src.core.chat_engine import ENGINE_CHAT
+from src.core.database import db_manager
+from src.core.models import Agent, Client, ConversationMessage, Thread
+from src.core.openai_client import get_openai_client
+
+
+def thread_messages(openai_client, thread_id: str):
+    """Mensajes de texto de un thread, del más antiguo al más reciente"""
+    for message in openai_client.client.beta.threads.messages.list(thread_id=thread_id, order="asc", limit=100):
+        text = "".join(part.text.value for part in message.content if part.type == "text")
+        if text:
+            yield message.role, text, datetime.utcfromtimestamp(message.created_at)
+
+
+def import_threads(client_id=None, switch=False, force=False):
+    openai_client = get_openai_client()
+    openai_client._ensure_client()
+    imported = skipped = failed = 0
+
+    with db_manager.get_session() as session:
+        query = (
+            select(Thread, Client.phone_number_id, Agent.phone_number_id)
+            .outerjoin(Client, Thread.client_id == Client.id)
+            .outerjoin(Agent, Thread.agent_id == Agent.id)
+        )
+        if client_id is not None:
+            query = query.where(Thread.client_id == client_id)
+
+        for thread, client_phone_id, agent_phone_id in session.execute(query).all():
+            phone_number_id = client_phone_id or agent_phone_id
+            if not phone_number_id:
+                continue
+
+            conversation = (
+                ConversationMessage.phone_number_id == phone_number_id,
+                ConversationMessage.wa_id == thread.wa_id
+            )
+            exists = session.execute(select(ConversationMessage.id).where(*conversation).limit(1)).first()
+            if exists and not force:
+                skipped += 1
+                continue
+
+            try:
+                rows = [
+                    ConversationMessage(
+                        phone_number_id=phone_number_id,
+                        wa_id=thread.wa_id,
+                        role=role,
+                        content=text,
+                        created_at=created_at
+                    )
+                    for role, text, created_at in thread_messages(openai_client, thread.thread_id)
+                ]
+            except Exception as e:
+                print(f"❌ Error leyendo {thread.thread_id}: {str(e)}")
+                failed += 1
+                continue
+
+            if exists:
+                session.execute(delete(ConversationMessage).where(*conversation))
+            session.add_all(rows)
+            session.commit()
+            imported += 1
+            print(f"📥 {thread.wa_id} ({phone_number_id}): {len(rows)} mensajes")
+
+        if switch and client_id is not None:
+            client = session.get(Client, client_id)
+            if client:
+                client.engine = ENGINE_CHAT
+                client.updated_at = datetime.utcnow()
+                session.commit()
+                # Las réplicas web lo aplican al expirar su caché de rutas
+                print(f"🔀 Cliente '{client.name}' cambiado al motor '{ENGINE_CHAT}'")
+
+    print(f"✅ Importadas: {imported}, omitidas: {skipped}, con error: {failed}")
+    if switch and client_id is None:
+        print("⚠️ --switch requiere --client-id; no se cambió ningún cliente")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importar threads de OpenAI al historial local")
+    parser.add_argument("--client-id", type=int, default=None)
+    parser.add_argument("--switch", action="store_true", help="Cambiar el cliente al motor chat")
+    parser.add_argument("--force", action="store_true", help="Reimportar conversaciones existentes")
+    args = parser.parse_args()
+
+    import_threads(args.client_id, args.switch, args.force)
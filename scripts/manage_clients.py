@@ -6,19 +6,21 @@ Uso:
     python scripts/manage_clients.py add "Nombre Cliente" "+34123456789" "phone_number_id" "assistant_id"
     python scripts/manage_clients.py list
     python scripts/manage_clients.py deactivate 1
+    python scripts/manage_clients.py reset-thread 1 34600000000
 """
 
 import asyncio
 import sys
-from sqlmodel import select
+from sqlmodel import select, delete
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from datetime import datetime
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.core.models import Client
+from src.core.models import Client, Thread
 from src.core.settings import settings
+from src.core.thread_cache import thread_cache, invalidate_phone_number
 
 
 async def create_client(name: str, phone_number: str, phone_number_id: str, assistant_id: str):
@@ -100,6 +102,8 @@ async def deactivate_client(client_id: int):
         client.updated_at = datetime.utcnow()
         
         await session.commit()
+        # Los workers dejan de usar los threads cacheados de este número
+        await invalidate_phone_number(client.phone_number_id)
         print(f"✅ Cliente '{client.name}' desactivado exitosamente")
 
 
@@ -124,6 +128,31 @@ async def activate_client(client_id: int):
         print(f"✅ Cliente '{client.name}' activado exitosamente")
 
 
+async def reset_thread(client_id: int, wa_id: str):
+    """Resetear la conversación de un usuario: el próximo mensaje abre un thread nuevo"""
+    engine = create_async_engine(settings.database_url, echo=False)
+    
+    async with AsyncSession(engine) as session:
+        client = await session.get(Client, client_id)
+        
+        if not client:
+            print(f"❌ No se encontró cliente con ID: {client_id}")
+            return
+        
+        result = await session.execute(
+            delete(Thread).where(Thread.client_id == client_id, Thread.wa_id == wa_id)
+        )
+        await session.commit()
+        
+        if not result.rowcount:
+            print(f"❌ El cliente '{client.name}' no tiene conversación con {wa_id}")
+            return
+        
+        # Sin esto los workers seguirían usando el thread antiguo desde su caché
+        thread_cache.invalidate(client.phone_number_id, wa_id)
+        print(f"✅ Conversación de {wa_id} con '{client.name}' reseteada")
+
+
 def print_usage():
     print("""
 Uso: python scripts/manage_clients.py [comando] [argumentos]
@@ -133,6 +162,7 @@ Comandos disponibles:
     list                                                       - Listar todos los clientes
     deactivate <id>                                           - Desactivar un cliente
     activate <id>                                             - Activar un cliente
+    reset-thread <id> <wa_id>                                 - Resetear la conversación de un usuario
     
 Ejemplos:
     python scripts/manage_clients.py add "Restaurante La Plaza" "+34666777888" "631261586727899" "asst_abc123"
@@ -181,6 +211,18 @@ async def main():
         except ValueError:
             print("❌ Error: El ID debe ser un número")
     
+    elif command == "reset-thread":
+        if len(sys.argv) != 4:
+            print("❌ Error: El comando 'reset-thread' requiere el ID del cliente y el wa_id")
+            return
+        
+        try:
+            client_id = int(sys.argv[2])
+        except ValueError:
+            print("❌ Error: El ID debe ser un número")
+            return
+        await reset_thread(client_id, sys.argv[3])
+    
     else:
         print(f"❌ Comando desconocido: {command}")
         print_usage()
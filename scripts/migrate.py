@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Aplica a la base de datos los cambios de esquema de los modelos: tablas
+nuevas y columnas e índices añadidos a tablas existentes.
+
+Se ejecuta una vez por despliegue (preDeployCommand en railway.toml), no en
+el arranque de la aplicación.
+
+Uso:
+    python scripts/migrate.py
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.database import migrate_database
+
+
+if __name__ == "__main__":
+    if not migrate_database():
+        print("❌ Error migrando el esquema")
+        sys.exit(1)
+    print("✅ Esquema actualizado")
@@ -2,11 +2,16 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
+import json
+import asyncio
 
-from src.core.models import Client
+from src.core.models import Client, FAQ_EMBEDDED, FAQ_RETRIEVAL
+from src.core.settings import settings
 from src.core.openai_client import create_assistant, create_assistant_with_instructions
+from src.core.routing_cache import invalidate_route
+from src.core.thread_cache import invalidate_phone_number
 from src.api.webhook import get_session
 
 router = APIRouter()
@@ -27,6 +32,14 @@ class CreateClientRequest(BaseModel):
     instructions: Optional[str] = None
     welcome_message: Optional[str] = None
     business_hours: Optional[str] = None
+    rate_limit_per_minute: Optional[int] = None
+    sender_rate_limit_per_minute: Optional[int] = None
+    progressive_delivery: bool = False
+    read_receipts: bool = True
+    engine: Literal["assistants", "chat"] = "assistants"
+    # Solo con FAQs sin instrucciones: FAQs en las instrucciones del assistant
+    # o recuperación por run (None = según FAQ_RETRIEVAL_ENABLED)
+    faq_mode: Optional[Literal["embedded", "retrieval"]] = None
 
 
 class UpdateClientRequest(BaseModel):
@@ -35,6 +48,15 @@ class UpdateClientRequest(BaseModel):
     active: Optional[bool] = None
     welcome_message: Optional[str] = None
     business_hours: Optional[str] = None
+    rate_limit_per_minute: Optional[int] = None
+    sender_rate_limit_per_minute: Optional[int] = None
+    progressive_delivery: Optional[bool] = None
+    read_receipts: Optional[bool] = None
+    engine: Optional[Literal["assistants", "chat"]] = None
+    # Sustituye la lista de FAQs (respuestas locales y recuperación por mensaje)
+    faqs: Optional[List[FAQ]] = None
+    # Cambia el modo de FAQs; el assistant se regenera a partir de las FAQs
+    faq_mode: Optional[Literal["embedded", "retrieval"]] = None
 
 
 class ClientResponse(BaseModel):
@@ -48,6 +70,33 @@ class ClientResponse(BaseModel):
     updated_at: datetime
     welcome_message: Optional[str] = None
     business_hours: Optional[str] = None
+    rate_limit_per_minute: Optional[int] = None
+    sender_rate_limit_per_minute: Optional[int] = None
+    progressive_delivery: bool = False
+    read_receipts: bool = True
+    engine: str = "assistants"
+    faq_mode: Optional[str] = None
+
+
+def _client_response(client: Client) -> ClientResponse:
+    return ClientResponse(
+        id=client.id,
+        name=client.name,
+        phone_number=client.phone_number,
+        phone_number_id=client.phone_number_id,
+        assistant_id=client.assistant_id,
+        active=client.active,
+        created_at=client.created_at,
+        updated_at=client.updated_at,
+        welcome_message=client.welcome_message,
+        business_hours=client.business_hours,
+        rate_limit_per_minute=client.rate_limit_per_minute,
+        sender_rate_limit_per_minute=client.sender_rate_limit_per_minute,
+        progressive_delivery=bool(client.progressive_delivery),
+        read_receipts=client.read_receipts is not False,
+        engine=client.engine or "assistants",
+        faq_mode=client.faq_mode
+    )
 
 
 @router.post("/clients", response_model=ClientResponse)
@@ -87,15 +136,26 @@ async def create_client(
         # Crear assistant en OpenAI
         print(f"📝 Creando assistant para {request.name}...")
         
+        faqs_dict = [{"q": faq.q, "a": faq.a} for faq in request.faqs or []]
+        faq_mode = None
+        
         if request.instructions:
             # Usar instrucciones personalizadas
-            assistant_id = create_assistant_with_instructions(request.instructions)
+            # Registro de assistants (Postgres síncrono) y OpenAI bloquean: en un hilo
+            assistant_id = await asyncio.to_thread(create_assistant_with_instructions, request.instructions)
             print(f"✅ Assistant creado con instrucciones personalizadas: {assistant_id}")
         else:
-            # Usar FAQs tradicionales
-            faqs_dict = [{"q": faq.q, "a": faq.a} for faq in request.faqs]
-            assistant_id = create_assistant(faqs_dict)
-            print(f"✅ Assistant creado con {len(request.faqs)} FAQs: {assistant_id}")
+            # Usar FAQs tradicionales. El modo se guarda en el cliente: con la
+            # recuperación las FAQs no van en las instrucciones y cada run
+            # recibe las relevantes
+            faq_mode = request.faq_mode or (FAQ_RETRIEVAL if settings.faq_retrieval_enabled else FAQ_EMBEDDED)
+            assistant_id = await asyncio.to_thread(
+                create_assistant, faqs_dict, embed_faqs=faq_mode == FAQ_EMBEDDED
+            )
+            print(f"✅ Assistant creado con {len(faqs_dict)} FAQs: {assistant_id}")
+        
+        # Las FAQs se conservan para responder localmente y para la recuperación
+        faqs_json = json.dumps(faqs_dict, ensure_ascii=False) if faqs_dict else None
         
         # Crear cliente en la base de datos
         client = Client(
@@ -105,27 +165,24 @@ async def create_client(
             assistant_id=assistant_id,
             active=True,
             welcome_message=request.welcome_message,
-            business_hours=request.business_hours
+            business_hours=request.business_hours,
+            faqs=faqs_json,
+            faq_mode=faq_mode,
+            rate_limit_per_minute=request.rate_limit_per_minute,
+            sender_rate_limit_per_minute=request.sender_rate_limit_per_minute,
+            progressive_delivery=request.progressive_delivery,
+            read_receipts=request.read_receipts,
+            engine=request.engine
         )
         
         session.add(client)
         await session.commit()
         await session.refresh(client)
+        invalidate_route(client.phone_number_id)
         
         print(f"✅ Cliente '{client.name}' creado exitosamente (ID: {client.id})")
         
-        return ClientResponse(
-            id=client.id,
-            name=client.name,
-            phone_number=client.phone_number,
-            phone_number_id=client.phone_number_id,
-            assistant_id=client.assistant_id,
-            active=client.active,
-            created_at=client.created_at,
-            updated_at=client.updated_at,
-            welcome_message=client.welcome_message,
-            business_hours=client.business_hours
-        )
+        return _client_response(client)
         
     except HTTPException:
         raise
@@ -147,21 +204,7 @@ async def list_clients(
     result = await session.execute(query)
     clients = result.scalars().all()
     
-    return [
-        ClientResponse(
-            id=client.id,
-            name=client.name,
-            phone_number=client.phone_number,
-            phone_number_id=client.phone_number_id,
-            assistant_id=client.assistant_id,
-            active=client.active,
-            created_at=client.created_at,
-            updated_at=client.updated_at,
-            welcome_message=client.welcome_message,
-            business_hours=client.business_hours
-        )
-        for client in clients
-    ]
+    return [_client_response(client) for client in clients]
 
 
 @router.get("/clients/{client_id}", response_model=ClientResponse)
@@ -178,18 +221,7 @@ async def get_client(
     if not client:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
     
-    return ClientResponse(
-        id=client.id,
-        name=client.name,
-        phone_number=client.phone_number,
-        phone_number_id=client.phone_number_id,
-        assistant_id=client.assistant_id,
-        active=client.active,
-        created_at=client.created_at,
-        updated_at=client.updated_at,
-        welcome_message=client.welcome_message,
-        business_hours=client.business_hours
-    )
+    return _client_response(client)
 
 
 @router.patch("/clients/{client_id}", response_model=ClientResponse)
@@ -218,24 +250,50 @@ async def update_client(
         client.welcome_message = request.welcome_message
     if request.business_hours is not None:
         client.business_hours = request.business_hours
+    if request.rate_limit_per_minute is not None:
+        client.rate_limit_per_minute = request.rate_limit_per_minute
+    if request.sender_rate_limit_per_minute is not None:
+        client.sender_rate_limit_per_minute = request.sender_rate_limit_per_minute
+    if request.progressive_delivery is not None:
+        client.progressive_delivery = request.progressive_delivery
+    if request.read_receipts is not None:
+        client.read_receipts = request.read_receipts
+    if request.engine is not None:
+        client.engine = request.engine
+    if request.faqs is not None:
+        faqs_dict = [{"q": faq.q, "a": faq.a} for faq in request.faqs]
+        client.faqs = json.dumps(faqs_dict, ensure_ascii=False) if faqs_dict else None
+    
+    # Un assistant con las FAQs en sus instrucciones se regenera cuando cambian;
+    # cambiar de modo cambia las instrucciones en cualquier caso
+    mode_changed = request.faq_mode is not None and request.faq_mode != client.faq_mode
+    if mode_changed or (request.faqs is not None and client.faq_mode == FAQ_EMBEDDED):
+        if mode_changed:
+            if not client.faqs:
+                raise HTTPException(status_code=400, detail="El cliente no tiene FAQs")
+            client.faq_mode = request.faq_mode
+        faqs_dict = json.loads(client.faqs) if client.faqs else []
+        try:
+            client.assistant_id = await asyncio.to_thread(
+                create_assistant, faqs_dict, embed_faqs=client.faq_mode == FAQ_EMBEDDED
+            )
+        except Exception as e:
+            print(f"❌ Error regenerando el assistant: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+        print(f"✅ Assistant regenerado ({client.faq_mode}): {client.assistant_id}")
     
     client.updated_at = datetime.utcnow()
     
     await session.commit()
     await session.refresh(client)
+    # Los workers recargan las FAQs y su modo al expirar su índice (faq_cache_ttl)
+    # y reutilizan los n-gramas de las preguntas que no han cambiado. Los threads
+    # son del cliente: la conversación sigue con el assistant nuevo
+    invalidate_route(client.phone_number_id)
+    if not client.active:
+        await invalidate_phone_number(client.phone_number_id)
     
-    return ClientResponse(
-        id=client.id,
-        name=client.name,
-        phone_number=client.phone_number,
-        phone_number_id=client.phone_number_id,
-        assistant_id=client.assistant_id,
-        active=client.active,
-        created_at=client.created_at,
-        updated_at=client.updated_at,
-        welcome_message=client.welcome_message,
-        business_hours=client.business_hours
-    )
+    return _client_response(client)
 
 
 @router.delete("/clients/{client_id}")
@@ -262,12 +320,16 @@ async def delete_client(
         # Eliminación completa
         await session.delete(client)
         await session.commit()
+        invalidate_route(client.phone_number_id)
+        await invalidate_phone_number(client.phone_number_id)
         return {"message": f"Cliente '{client.name}' eliminado permanentemente"}
     else:
         # Soft delete (solo desactivar)
         client.active = False
         client.updated_at = datetime.utcnow()
         await session.commit()
+        invalidate_route(client.phone_number_id)
+        await invalidate_phone_number(client.phone_number_id)
         return {"message": f"Cliente '{client.name}' desactivado exitosamente"}
 
 
@@ -297,5 +359,8 @@ async def delete_all_clients(
         await session.delete(client)
     
     await session.commit()
+    invalidate_route()
+    for client in clients:
+        await invalidate_phone_number(client.phone_number_id)
     
     return {"message": f"{count} clientes eliminados permanentemente"} 
\ No newline at end of file
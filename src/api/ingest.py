@@ -6,15 +6,17 @@ from src.core.models import Agent
 from src.core import meta_client
 from src.core.openai_client import create_assistant, OpenAIError
 from src.core.settings import settings
+from src.core.database import get_db_session
 import asyncio
 from typing import Dict
 
 router = APIRouter()
 
 
-async def get_session(request: Request) -> AsyncSession:
-    """Obtiene la sesión de la base de datos del request"""
-    return request.state.db
+async def get_session():
+    """Sesión de base de datos creada bajo demanda para el endpoint"""
+    async for session in get_db_session():
+        yield session
 
 
 @router.post("/agent", response_model=AgentResponse, status_code=201)
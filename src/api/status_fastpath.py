@@ -0,0 +1,86 @@
+"""
+Atajo para callbacks de estado (sent/delivered/read) en POST /webhook.
+
+Es un middleware ASGI puro que se registra por fuera del resto: reconoce el
+payload a nivel de bytes y responde 200 sin abrir sesión de BD, sin parsear
+JSON y sin pasar por webhook_handler. Cualquier otro payload se reenvía
+intacto a la aplicación.
+"""
+
+import re
+
+from src.core.delivery_stats import delivery_stats
+from src.core.meta_client import verify_webhook_signature
+from src.core.settings import settings
+
+_OK_RESPONSE_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", b"2"),
+]
+
+# Clave "messages" (seguida de ':'). Meta también envía "messages" como
+# valor en "field": "messages", así que buscar solo el literal no sirve.
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+
+
+def is_status_only(body: bytes) -> bool:
+    """
+    True si el payload trae estados y ningún mensaje.
+    
+    Dentro de strings JSON las comillas van escapadas, así que `"messages":`
+    solo puede ser la clave; el valor de "field" va seguido de ',' o '}'.
+    """
+    return b'"statuses"' in body and not _MESSAGES_KEY.search(body)
+
+
+class StatusCallbackMiddleware:
+    def __init__(self, app, path: str = "/webhook"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        # Leer el body completo
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Desconexión del cliente
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        if is_status_only(body) and self._signature_ok(scope, body):
+            if settings.status_stats_enabled:
+                delivery_stats.record_payload(body)
+            await send({"type": "http.response.start", "status": 200, "headers": _OK_RESPONSE_HEADERS})
+            await send({"type": "http.response.body", "body": b"{}"})
+            return
+
+        # Reinyectar el body ya leído para el resto de la aplicación
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+    @staticmethod
+    def _signature_ok(scope, body: bytes) -> bool:
+        """Misma política que webhook_handler: solo se verifica si viene la cabecera"""
+        for name, value in scope.get("headers", []):
+            if name == b"x-hub-signature-256":
+                try:
+                    return verify_webhook_signature(body, value.decode())
+                except Exception:
+                    return False
+        return True
@@ -1,22 +1,74 @@
-from fastapi import APIRouter, Request, HTTPException, Header, Depends
+from fastapi import APIRouter, Request, HTTPException, Header
 from fastapi.responses import JSONResponse, PlainTextResponse
-from sqlmodel import select
-from sqlmodel.ext.asyncio.session import AsyncSession
-from src.core.models import Agent, Client
 from src.core.meta_client import verify_webhook_signature
+from src.core.routing_cache import routing_cache
+from src.core.dedup import message_deduplicator
+from src.core.spool import broker_health, message_spool
+from src.core.rate_limit import admit_message
 from src.core.settings import settings
-from src.tasks import handle_message
-from typing import Optional
+from src.core.database import get_db_session
+from src.tasks import enqueue_messages
+from typing import Dict, List, Optional
 import json
+import asyncio
 
 # Force redeploy - Fixed webhook parameter issue - June 1, 2025
 
 router = APIRouter()
 
 
-async def get_session(request: Request) -> AsyncSession:
-    """Obtiene la sesión de la base de datos del request"""
-    return request.state.db
+async def get_session():
+    """Sesión de base de datos creada bajo demanda para el endpoint"""
+    async for session in get_db_session():
+        yield session
+
+
+def _extract_text_messages(data: Dict) -> List[Dict]:
+    """
+    Extrae los mensajes de texto de todas las entries y changes del payload.
+    
+    Returns:
+        Lista de dicts con phone_number_id, wa_id, text y message_id
+    """
+    extracted = []
+    
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            phone_number_id = value.get("metadata", {}).get("phone_number_id")
+            
+            for message in value.get("messages", []):
+                # Solo procesar mensajes de texto
+                if message.get("type") != "text":
+                    continue
+                
+                sender = message.get("from")
+                body_text = message.get("text", {}).get("body", "")
+                
+                if not all([phone_number_id, sender, body_text]):
+                    continue
+                
+                extracted.append({
+                    "phone_number_id": phone_number_id,
+                    "wa_id": sender,
+                    "text": body_text,
+                    "message_id": message.get("id")
+                })
+    
+    return extracted
+
+
+def _dispatch_jobs(jobs: List[Dict]) -> None:
+    """Publica en el broker o, si no está disponible, guarda en el spool local"""
+    if broker_health.is_healthy():
+        try:
+            enqueue_messages(jobs)
+            return
+        except Exception as e:
+            print(f"❌ Broker no disponible, usando spool local: {str(e)}")
+            broker_health.mark_failure()
+    
+    message_spool.append(jobs)
 
 
 @router.get("/webhook")
@@ -43,7 +95,6 @@ async def webhook_verify(
 @router.post("/webhook")
 async def webhook_handler(
     request: Request,
-    session: AsyncSession = Depends(get_session),
     x_hub_signature_256: Optional[str] = Header(None)
 ):
     """
@@ -51,8 +102,8 @@ async def webhook_handler(
     
     Proceso:
     1. Verificar firma
-    2. Extraer datos del mensaje
-    3. Buscar agente
+    2. Extraer datos del mensaje y descartar duplicados
+    3. Buscar agente y aplicar límites de admisión
     4. Encolar tarea en Celery
     5. Responder 200 inmediatamente
     """
@@ -69,88 +120,48 @@ async def webhook_handler(
         data = json.loads(body)
         print(f"📨 Webhook recibido: {json.dumps(data, indent=2)}")
         
-        # Extraer información del mensaje
-        entry = data.get("entry", [])
-        if not entry:
+        # Extraer todos los mensajes (Meta agrupa entries/changes con tráfico alto)
+        incoming = _extract_text_messages(data)
+        if not incoming:
             return JSONResponse(content={}, status_code=200)
         
-        changes = entry[0].get("changes", [])
-        if not changes:
-            return JSONResponse(content={}, status_code=200)
-        
-        value = changes[0].get("value", {})
-        messages = value.get("messages", [])
-        metadata = value.get("metadata", {})
-        
-        if not messages:
-            return JSONResponse(content={}, status_code=200)
-        
-        # Procesar cada mensaje
-        phone_number_id = metadata.get("phone_number_id")
-        
-        for message in messages:
-            # Solo procesar mensajes de texto
-            if message.get("type") != "text":
+        jobs = []
+        for message in incoming:
+            # Descartar reintentos de Meta antes de encolar nada
+            if await message_deduplicator.is_duplicate(message["message_id"]):
+                print(f"♻️  Mensaje duplicado descartado: {message['message_id']}")
                 continue
             
-            sender = message.get("from")
-            text_data = message.get("text", {})
-            body_text = text_data.get("body", "")
+            print(f"💬 Mensaje de {message['wa_id']}: {message['text']}")
             
-            print(f"💬 Mensaje de {sender}: {body_text}")
+            # 3. Resolver el assistant (caché en memoria, BD solo si expira)
+            route = await routing_cache.resolve(message["phone_number_id"])
             
-            if not all([phone_number_id, sender, body_text]):
+            if not route:
+                print(f"⚠️  No se encontró agente para phone_number_id: {message['phone_number_id']}")
                 continue
             
-            # 3. Buscar agente en la base de datos
-            # Primero buscar en la tabla de clientes (nueva)
-            result = await session.execute(
-                select(Client).where(
-                    Client.phone_number_id == phone_number_id,
-                    Client.active == True
-                )
-            )
-            client = result.scalar_one_or_none()
-            
-            if client:
-                print(f"✅ Cliente encontrado: {client.name} (ID: {client.id})")
-                # Encolar con el assistant del cliente
-                handle_message.delay(
-                    client.assistant_id,
-                    client.phone_number_id,
-                    sender,
-                    body_text
-                )
+            # Control de admisión por remitente y por número del cliente
+            if not await admit_message(route, message["wa_id"]):
+                print(f"🚦 Límite de mensajes excedido para {message['wa_id']} en {route.phone_number_id}")
                 continue
             
-            # Si no hay cliente, buscar en agents (compatibilidad hacia atrás)
-            result = await session.execute(
-                select(Agent).where(Agent.phone_number_id == phone_number_id)
-            )
-            agent = result.scalar_one_or_none()
-            
-            if not agent:
-                print(f"⚠️  No se encontró agente para phone_number_id: {phone_number_id}")
-                # Por ahora, usar el assistant ID de las variables de entorno si existe
-                if settings.openai_assistant_id:
-                    print(f"📌 Usando assistant ID por defecto: {settings.openai_assistant_id}")
-                    # Encolar con el assistant por defecto
-                    handle_message.delay(
-                        settings.openai_assistant_id,
-                        phone_number_id,
-                        sender,
-                        body_text
-                    )
-                continue
-            
-            # 4. Encolar tarea en Celery
-            print(f"📤 Encolando mensaje para procesamiento...")
-            handle_message.delay(
-                agent.agent_id,
-                agent.phone_number_id,
-                sender,
-                body_text
-            )
+            jobs.append({
+                "agent_id": route.assistant_id,
+                "phone_number_id": route.phone_number_id,
+                "wa_id": message["wa_id"],
+                "text": message["text"],
+                "message_id": message["message_id"],
+                "progressive_delivery": route.progressive_delivery,
+                "read_receipts": route.read_receipts,
+                "engine": route.engine
+            })
+        
+        # 4. Encolar todas las tareas en una sola publicación
+        if jobs:
+            print(f"📤 Encolando {len(jobs)} mensaje(s) para procesamiento...")
+            # Publicar (o fsync del spool) bloquea: fuera del event loop
+            await asyncio.to_thread(_dispatch_jobs, jobs)
         
         # 5. Responder inmediatamente (< 100ms)
         return JSONResponse(content={}, status_code=200)
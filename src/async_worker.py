@@ -0,0 +1,306 @@
+"""
+Worker asyncio que multiplexa muchos runs de OpenAI en un solo proceso.
+
+Alternativa al worker de Celery (WORKER_MODE=async): en lugar de bloquear un
+proceso o hilo en cada conversación mientras OpenAI responde, cada mensaje
+es una corrutina. Un proceso pequeño mantiene cientos de runs en vuelo,
+limitados por `async_worker_concurrency`.
+
+Consume los jobs que el webhook deja en la lista Redis `async_worker_queue`.
+Las consultas a la base de datos y a Redis (cortas) se delegan a hilos;
+OpenAI y Meta son 100% asíncronos.
+
+Respecto al worker de Celery, este modo:
+- soporta el lease por conversación, los checkpoints y el backoff por tipo
+  de error, la respuesta local de FAQs y las FAQs relevantes por run, las
+  confirmaciones de lectura por cliente, el resumen de conversaciones
+  largas y el motor "chat" (que reutiliza _process_message_chat en un hilo);
+- NO soporta la entrega progresiva (`progressive_delivery`): la respuesta
+  se envía entera al completarse el mensaje del assistant;
+- NO aplica la ventana de agrupación (`coalesce_window_seconds`): el
+  webhook encola cada mensaje directamente en `async_worker_queue`.
+
+Uso:
+    python -m src.async_worker
+"""
+
+import asyncio
+import json
+import logging
+import signal
+import uuid
+from typing import Optional
+
+from src.core.settings import settings
+from src.core.database import db_manager
+from src.core.redis_client import get_async_redis
+from src.core.openai_client import get_async_openai_client, OpenAIError
+from src.core.meta_client import MetaClient, MetaError
+from src.core.conversation_lock import async_conversation_lease, ConversationBusy
+from src.core.thread_cache import thread_cache
+from src.core.thread_touch import thread_touch_buffer
+from src.core.faq_matcher import faq_registry
+from src.core import checkpoints
+from src.core.checkpoints import TaskCheckpoint, get_checkpoint
+from src.core.retry_policy import classify_error, backoff_delay, PERMANENT
+from src.core.whatsapp_text import format_for_whatsapp, split_message
+from src.core.chat_engine import ENGINE_CHAT
+from src.tasks import _get_thread_id, _process_message_chat, _run_options, _compact_context
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+meta_client = MetaClient()
+
+
+def _resolve_thread(agent_id: str, phone_number_id: str, wa_id: str) -> str:
+    with db_manager.get_session() as session:
+        return _get_thread_id(session, wa_id, agent_id, phone_number_id)
+
+
+async def process_message_async(
+    agent_id: str,
+    phone_number_id: str,
+    wa_id: str,
+    text: str,
+    engine: Optional[str] = None,
+    checkpoint: Optional[TaskCheckpoint] = None,
+    **_
+) -> dict:
+    """
+    Equivalente asíncrono de _process_message_sync, con los mismos pasos y
+    checkpoints: un reintento no vuelve a añadir el mensaje al thread ni
+    crea otro run, y no repite las partes ya enviadas. Las confirmaciones de
+    lectura las envía AsyncWorker._handle; `progressive_delivery` se ignora
+    (ver el docstring del módulo).
+    """
+    checkpoint = checkpoint or TaskCheckpoint(None)
+
+    if engine == ENGINE_CHAT:
+        # Motor de chat: una sola llamada a OpenAI; se reutiliza la lógica síncrona en un hilo
+        return await asyncio.to_thread(_process_message_chat, agent_id, phone_number_id, wa_id, text, checkpoint)
+
+    openai_client = get_async_openai_client()
+
+    async def mark(step: str, value: str = "1") -> None:
+        await asyncio.to_thread(checkpoint.mark, step, value)
+
+    # 1. Buscar o crear thread para este usuario (caché LRU antes que la BD)
+    # Un fallo de la LRU local consulta el hash de Redis (síncrono): en un hilo
+    thread_id = await asyncio.to_thread(thread_cache.get, phone_number_id, agent_id, wa_id)
+    if not thread_id:
+        thread_id = await asyncio.to_thread(_resolve_thread, agent_id, phone_number_id, wa_id)
+    if not thread_id:
+        raise Exception("No se pudo obtener o crear thread")
+
+    if checkpoint.done(checkpoints.REPLY_SENT):
+        return {"status": "success", "response": checkpoint.get(checkpoints.REPLY), "thread_id": thread_id}
+
+    async def deliver(reply_text: str) -> None:
+        parts = split_message(reply_text)
+        already_sent = int(checkpoint.get(checkpoints.PARTS_SENT) or 0)
+        await meta_client.send_messages(
+            phone_number_id,
+            wa_id,
+            parts[already_sent:],
+            on_sent=lambda count: mark(checkpoints.PARTS_SENT, str(already_sent + count))
+        )
+        await mark(checkpoints.REPLY_SENT)
+        logger.info(f"📤 Respuesta enviada a {wa_id} ({len(parts)} parte(s)): {reply_text[:50]}...")
+
+    async def send_reply(reply_text: str) -> None:
+        reply_text = format_for_whatsapp(reply_text)
+        await mark(checkpoints.REPLY, reply_text)
+        await deliver(reply_text)
+
+    try:
+        # 2. FAQ de alta confianza: respuesta local sin run
+        if not checkpoint.done(checkpoints.MESSAGE_ADDED):
+            if checkpoint.done(checkpoints.REPLY):
+                await deliver(checkpoint.get(checkpoints.REPLY))
+            else:
+                faq_answer = await asyncio.to_thread(faq_registry.answer, phone_number_id, text)
+                if faq_answer:
+                    await send_reply(faq_answer)
+
+            local_answer = checkpoint.get(checkpoints.REPLY)
+            if local_answer:
+                try:
+                    await openai_client.add_message(thread_id, text)
+                    await openai_client.add_message(thread_id, local_answer, role="assistant")
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo registrar la respuesta local en el thread: {str(e)}")
+                await asyncio.to_thread(thread_touch_buffer.touch, thread_id)
+                return {"status": "success", "response": local_answer, "thread_id": thread_id, "source": "faq"}
+
+        # 3. Añadir mensaje del usuario al thread de OpenAI (una sola vez)
+        if not checkpoint.done(checkpoints.MESSAGE_ADDED):
+            await openai_client.add_message(thread_id, text)
+            await mark(checkpoints.MESSAGE_ADDED)
+
+        usage = {}
+
+        def on_completed(run):
+            if getattr(run, "usage", None):
+                usage["prompt_tokens"] = run.usage.prompt_tokens
+
+        if checkpoint.done(checkpoints.REPLY):
+            # El run ya terminó en un intento anterior: solo falta el envío
+            await deliver(checkpoint.get(checkpoints.REPLY))
+        else:
+            # 4. Ejecutar el assistant (o esperar el run de un intento anterior)
+            #    y enviar la respuesta en cuanto esté completa
+            run_options = await asyncio.to_thread(_run_options, phone_number_id, wa_id, text)
+            try:
+                await openai_client.run_assistant(
+                    thread_id,
+                    agent_id,
+                    on_reply=send_reply,
+                    on_completed=on_completed,
+                    run_id=checkpoint.get(checkpoints.RUN_ID),
+                    on_run_created=lambda run_id: mark(checkpoints.RUN_ID, run_id),
+                    **run_options
+                )
+            except OpenAIError:
+                # El run terminó en error: el siguiente intento crea uno nuevo
+                await asyncio.to_thread(checkpoint.discard, checkpoints.RUN_ID)
+                raise
+
+        # 5. Actualizar timestamp del thread (escritura diferida; un lote lleno se vuelca en un hilo)
+        await asyncio.to_thread(thread_touch_buffer.touch, thread_id)
+
+        # El resumen de los turnos antiguos lo hace _handle tras liberar el lease
+        return {
+            "status": "success",
+            "response": checkpoint.get(checkpoints.REPLY),
+            "thread_id": thread_id,
+            "prompt_tokens": usage.get("prompt_tokens")
+        }
+
+    except OpenAIError as e:
+        logger.error(f"❌ Error OpenAI: {str(e)}")
+        error_msg = "Disculpa, estoy experimentando dificultades técnicas. Por favor, intenta de nuevo en unos minutos."
+        await meta_client.send_message(phone_number_id, wa_id, error_msg)
+        raise e
+    except MetaError as e:
+        logger.error(f"❌ Error Meta: {str(e)}")
+        raise e
+
+
+class AsyncWorker:
+    def __init__(self, concurrency: int, queue: str):
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = set()
+        self.stopping = asyncio.Event()
+
+    def _requeue(self, job: dict, delay: float) -> None:
+        """Devuelve el job a la cola tras `delay` segundos sin ocupar un hueco de concurrencia"""
+        async def push_later():
+            await asyncio.sleep(delay)
+            await get_async_redis().rpush(self.queue, json.dumps(job))
+
+        task = asyncio.create_task(push_later())
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    def _mark_read(self, job: dict) -> None:
+        """Confirmación de lectura e indicador de escritura sin bloquear el mensaje"""
+        async def mark():
+            try:
+                await meta_client.mark_read(job["phone_number_id"], job["message_id"])
+            except MetaError as e:
+                logger.warning(f"⚠️ No se pudo marcar como leído {job['message_id']}: {e}")
+
+        task = asyncio.create_task(mark())
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def _handle(self, job: dict) -> None:
+        attempt = job.get("attempt", 0)
+        if job.get("read_receipts") and job.get("message_id") and not job.get("receipt_sent"):
+            self._mark_read(job)
+            # Los reencolados (reintentos o lease ocupado) no la repiten
+            job["receipt_sent"] = True
+
+        # Los reintentos reencolan el mismo job: los checkpoints se guardan por
+        # wamid (o por un ID propio del job si no lo hay) para reanudar
+        job.setdefault("job_id", job.get("message_id") or uuid.uuid4().hex)
+        checkpoint = await asyncio.to_thread(get_checkpoint, f"async:{job['job_id']}")
+        try:
+            logger.info(f"🤖 Procesando mensaje de {job['wa_id']}: {job['text']}")
+            async with async_conversation_lease(job["phone_number_id"], job["wa_id"]):
+                response = await process_message_async(**job, checkpoint=checkpoint)
+            logger.info(f"✅ Mensaje procesado exitosamente para {job['wa_id']}")
+            await asyncio.to_thread(checkpoint.clear)
+            # Fuera del lease, como en el worker de Celery
+            await asyncio.to_thread(
+                _compact_context, job["phone_number_id"], job["wa_id"], response, job.get("engine")
+            )
+
+        except ConversationBusy as e:
+            # Otro worker tiene la conversación: reencolar sin contar como fallo
+            logger.info(f"⏳ {str(e)}")
+            self._requeue(job, settings.conversation_lease_retry_seconds)
+
+        except Exception as e:
+            logger.error(f"❌ Error procesando mensaje: {str(e)}")
+            kind = classify_error(e)
+            if kind == PERMANENT:
+                logger.error(f"💀 Error permanente, no se reintenta: {str(e)}")
+                await asyncio.to_thread(checkpoint.clear)
+            elif attempt < settings.async_worker_max_retries:
+                delay = backoff_delay(kind, attempt)
+                logger.info(f"🔄 Reintentando en {delay:.1f}s ({kind})... ({attempt + 1}/{settings.async_worker_max_retries})")
+                self._requeue({**job, "attempt": attempt + 1}, delay)
+            else:
+                logger.error(f"💀 Falló después de {settings.async_worker_max_retries} intentos")
+                await asyncio.to_thread(checkpoint.clear)
+
+        finally:
+            self.semaphore.release()
+
+    async def run(self) -> None:
+        redis = get_async_redis()
+        logger.info(f"🚀 Worker asyncio escuchando '{self.queue}' (concurrencia {settings.async_worker_concurrency})")
+
+        while not self.stopping.is_set():
+            await self.semaphore.acquire()
+            try:
+                item = await redis.blpop(self.queue, timeout=1)
+            except Exception as e:
+                self.semaphore.release()
+                logger.error(f"❌ Error leyendo la cola: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            if not item:
+                self.semaphore.release()
+                continue
+
+            job = json.loads(item[1])
+            task = asyncio.create_task(self._handle(job))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+        # Apagado ordenado: terminar lo que está en vuelo
+        if self.in_flight:
+            logger.info(f"⏳ Esperando {len(self.in_flight)} mensaje(s) en vuelo...")
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+        await meta_client.aclose()
+        await asyncio.to_thread(thread_touch_buffer.close)
+
+
+async def main() -> None:
+    worker = AsyncWorker(settings.async_worker_concurrency, settings.async_worker_queue)
+    thread_cache.start_invalidation_listener()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stopping.set)
+
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
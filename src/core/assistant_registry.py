@@ -0,0 +1,181 @@
+"""
+Reutilización de assistants de OpenAI por contenido.
+
+Dar de alta clientes con las mismas instrucciones (create_smart_client.py,
+create_released_sales_bot.py, POST /clients) creaba cada vez un assistant
+nuevo en la cuenta. Ahora cada assistant se registra en assistant_registry
+con el hash de su contenido (modelo, instrucciones, tools). Si ya existe uno
+con el mismo contenido, se devuelve su ID sin crear otro.
+
+El nombre no forma parte del hash: dos clientes con las mismas
+instrucciones comparten assistant aunque se hayan pedido con otro nombre.
+Los clientes no modifican ni borran su assistant, así que compartirlo es
+seguro. Aun así un assistant puede borrarse a mano en la cuenta: la primera
+vez que un proceso lo reutiliza se comprueba con OpenAI (assistants.retrieve)
+que sigue existiendo y, si no, se descarta su registro y se crea otro. Las
+siguientes reutilizaciones en ese proceso no llaman a OpenAI.
+"""
+
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import delete as sql_delete, select, text
+
+from src.core.models import AssistantRecord
+
+logger = logging.getLogger(__name__)
+
+# Solo gana una inserción si dos altas con el mismo contenido llegan a la vez
+_INSERT_ASSISTANT_SQL = text("""
+    INSERT INTO assistant_registry (content_hash, assistant_id, model, name, created_at)
+    VALUES (:content_hash, :assistant_id, :model, :name, :now)
+    ON CONFLICT (content_hash) DO NOTHING
+    RETURNING assistant_id
+""")
+
+
+def content_hash(model: str, instructions: str, tools: Optional[List[Dict]] = None) -> str:
+    """Hash estable del contenido de un assistant"""
+    content = json.dumps(
+        {"model": model, "instructions": instructions, "tools": tools or []},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class AssistantRegistry:
+    def __init__(self):
+        # content_hash -> assistant_id (los registros no cambian una vez creados)
+        self._known: Dict[str, str] = {}
+        # Assistants cuya existencia ya se comprobó en este proceso
+        self._verified: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, digest: str, session=None) -> Optional[str]:
+        """ID del assistant registrado con ese contenido, o None"""
+        with self._lock:
+            assistant_id = self._known.get(digest)
+        if assistant_id:
+            return assistant_id
+        if session is None:
+            from src.core.database import db_manager
+            with db_manager.get_session() as session:
+                return self.lookup(digest, session)
+
+        assistant_id = session.execute(
+            select(AssistantRecord.assistant_id).where(AssistantRecord.content_hash == digest)
+        ).scalar()
+        if assistant_id:
+            with self._lock:
+                self._known[digest] = assistant_id
+        return assistant_id
+
+    def get_or_create(
+        self,
+        model: str,
+        instructions: str,
+        name: str,
+        create: Callable[[], str],
+        tools: Optional[List[Dict]] = None,
+        delete: Optional[Callable[[str], None]] = None,
+        exists: Optional[Callable[[str], bool]] = None
+    ) -> str:
+        """
+        Devuelve el assistant con ese contenido, creándolo con `create` si no
+        existe. Si otra alta simultánea registró el mismo contenido primero,
+        se usa el suyo y el recién creado se borra con `delete`. Con `exists`
+        se comprueba (una vez por proceso) que el assistant registrado sigue
+        en la cuenta.
+
+        Hace E/S bloqueante (Postgres y OpenAI): desde código asíncrono hay
+        que llamarlo en un hilo.
+        """
+        digest = content_hash(model, instructions, tools)
+        try:
+            existing = self.lookup(digest)
+        except Exception as e:
+            # Sin registro se crea igualmente: el alta no depende de él
+            logger.warning(f"⚠️ Registro de assistants no disponible: {e}")
+            return create()
+        if existing and exists and existing not in self._verified:
+            if exists(existing):
+                with self._lock:
+                    self._verified.add(existing)
+            else:
+                logger.warning(f"⚠️ El assistant registrado {existing} ya no existe en OpenAI: se crea otro")
+                self._discard(digest, existing)
+                existing = None
+        if existing:
+            logger.info(f"♻️ Reutilizando assistant {existing} ({digest[:12]})")
+            return existing
+
+        assistant_id = create()
+        try:
+            winner = self._register(digest, assistant_id, model, name)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo registrar el assistant {assistant_id}: {e}")
+            return assistant_id
+
+        if winner != assistant_id:
+            logger.info(f"♻️ Assistant {digest[:12]} registrado por otra alta: {winner}")
+            if delete:
+                try:
+                    delete(assistant_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo borrar el assistant duplicado {assistant_id}: {e}")
+        return winner
+
+    def _register(self, digest: str, assistant_id: str, model: str, name: str) -> str:
+        """Registra el assistant y devuelve el que queda registrado para ese contenido"""
+        from src.core.database import db_manager
+
+        with db_manager.get_session() as session:
+            inserted = session.execute(_INSERT_ASSISTANT_SQL, {
+                "content_hash": digest,
+                "assistant_id": assistant_id,
+                "model": model,
+                "name": name,
+                "now": datetime.utcnow()
+            }).scalar()
+            session.commit()
+            if not inserted:
+                return self.lookup(digest, session) or assistant_id
+
+        with self._lock:
+            self._known[digest] = assistant_id
+        return assistant_id
+
+    def _discard(self, digest: str, assistant_id: str) -> None:
+        """Elimina el registro de un assistant que ya no existe"""
+        self.forget(digest)
+        try:
+            from src.core.database import db_manager
+            with db_manager.get_session() as session:
+                # Solo si sigue apuntando al assistant borrado (otra alta pudo re-registrarlo)
+                session.execute(
+                    sql_delete(AssistantRecord).where(
+                        AssistantRecord.content_hash == digest,
+                        AssistantRecord.assistant_id == assistant_id
+                    )
+                )
+                session.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo descartar el registro de {assistant_id}: {e}")
+
+    def forget(self, digest: Optional[str] = None) -> None:
+        """Olvida la caché local (p. ej. tras borrar registros a mano)"""
+        with self._lock:
+            if digest is None:
+                self._known.clear()
+                self._verified.clear()
+            else:
+                self._verified.discard(self._known.pop(digest, None))
+
+
+# Instancia global (una por proceso)
+assistant_registry = AssistantRegistry()
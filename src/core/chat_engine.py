@@ -0,0 +1,161 @@
+"""
+Motor de respuesta con Chat Completions y el historial en Postgres.
+
+Alternativa al camino de Assistants/threads, seleccionable por cliente
+(`Client.engine = "chat"`). En lugar de messages.create + runs.create +
+N × runs.retrieve + messages.list, cada respuesta es una sola llamada a
+chat.completions con:
+
+- las instrucciones y el modelo del assistant del cliente (se leen una vez
+  de OpenAI y se cachean `assistant_config_ttl` segundos);
+- los últimos `chat_history_messages` mensajes de conversation_messages;
+- las FAQs relevantes, si las hay, como mensaje de sistema adicional;
+- el resumen de los turnos antiguos, si la conversación ya superó el
+  presupuesto de contexto (ver context_memory), en cuyo caso el historial
+  empieza en el primer mensaje no resumido.
+
+El mensaje del usuario y la respuesta se guardan juntos al terminar.
+"""
+
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from src.core.context_memory import context_memory, history_cursor
+from src.core.models import ConversationMessage, ENGINE_CHAT
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class AssistantConfig:
+    """Lo que el motor de chat necesita de un assistant de OpenAI"""
+    model: str
+    instructions: str
+
+
+class ChatEngine:
+    def __init__(self, history_limit: int = 30, config_ttl: float = 3600.0):
+        self.history_limit = history_limit
+        self.config_ttl = config_ttl
+        self._configs: Dict[str, Tuple[float, AssistantConfig]] = {}
+        self._lock = threading.Lock()
+
+    def _openai(self):
+        from src.core.openai_client import get_openai_client
+        client = get_openai_client()
+        client._ensure_client()
+        return client.client
+
+    def assistant_config(self, assistant_id: str) -> AssistantConfig:
+        """Modelo e instrucciones del assistant (cacheados)"""
+        with self._lock:
+            entry = self._configs.get(assistant_id)
+        if entry and entry[0] >= time.monotonic():
+            return entry[1]
+
+        assistant = self._openai().beta.assistants.retrieve(assistant_id)
+        config = AssistantConfig(model=assistant.model, instructions=assistant.instructions or "")
+        with self._lock:
+            self._configs[assistant_id] = (time.monotonic() + self.config_ttl, config)
+        return config
+
+    def load_history(self, session, phone_number_id: str, wa_id: str, after_id: int = 0) -> List[Dict[str, str]]:
+        """
+        Últimos mensajes de la conversación, del más antiguo al más reciente.
+        `after_id` es el último mensaje ya incluido en el resumen.
+        """
+        rows = session.execute(
+            select(ConversationMessage.role, ConversationMessage.content)
+            .where(
+                ConversationMessage.phone_number_id == phone_number_id,
+                ConversationMessage.wa_id == wa_id,
+                ConversationMessage.id > after_id
+            )
+            .order_by(ConversationMessage.id.desc())
+            .limit(self.history_limit)
+        ).all()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def build_messages(
+        self,
+        config: AssistantConfig,
+        history: List[Dict[str, str]],
+        text: str,
+        additional_instructions: Optional[str] = None,
+        summary: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": config.instructions}]
+        if summary:
+            messages.append({"role": "system", "content": context_memory.instructions(summary)})
+        if additional_instructions:
+            messages.append({"role": "system", "content": additional_instructions})
+        return messages + history + [{"role": "user", "content": text}]
+
+    def reply(
+        self,
+        assistant_id: str,
+        phone_number_id: str,
+        wa_id: str,
+        text: str,
+        additional_instructions: Optional[str] = None,
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        Genera la respuesta con una sola llamada a chat.completions. Con
+        `on_delta` la respuesta llega en streaming, fragmento a fragmento.
+        """
+        from src.core.database import db_manager
+        from src.core.openai_client import OpenAIError
+
+        config = self.assistant_config(assistant_id)
+        with db_manager.get_session() as session:
+            summary, until = context_memory.get(phone_number_id, wa_id, ENGINE_CHAT, session) or (None, None)
+            history = self.load_history(session, phone_number_id, wa_id, after_id=history_cursor(until))
+        messages = self.build_messages(config, history, text, additional_instructions, summary)
+
+        try:
+            if on_delta is None:
+                completion = self._openai().chat.completions.create(model=config.model, messages=messages)
+                reply = completion.choices[0].message.content
+            else:
+                fragments = []
+                stream = self._openai().chat.completions.create(model=config.model, messages=messages, stream=True)
+                for chunk in stream:
+                    fragment = chunk.choices[0].delta.content if chunk.choices else None
+                    if fragment:
+                        fragments.append(fragment)
+                        on_delta(fragment)
+                reply = "".join(fragments)
+        except Exception as e:
+            raise OpenAIError(f"Error en chat completion: {str(e)}") from e
+
+        if not reply:
+            raise OpenAIError("No se obtuvo respuesta del modelo")
+        return reply
+
+    def store_exchange(self, phone_number_id: str, wa_id: str, text: str, reply: str) -> None:
+        """Guarda el mensaje del usuario y la respuesta en una sola transacción"""
+        from src.core.database import db_manager
+
+        with db_manager.get_session() as session:
+            session.add_all([
+                ConversationMessage(phone_number_id=phone_number_id, wa_id=wa_id, role="user", content=text),
+                ConversationMessage(phone_number_id=phone_number_id, wa_id=wa_id, role="assistant", content=reply),
+            ])
+            session.commit()
+
+    def compact(self, phone_number_id: str, wa_id: str) -> bool:
+        """Resume los turnos antiguos antes de que salgan del historial enviado"""
+        return context_memory.compact_history(phone_number_id, wa_id, self.history_limit)
+
+
+# Instancia global (una por proceso worker)
+chat_engine = ChatEngine(
+    history_limit=settings.chat_history_messages,
+    config_ttl=settings.assistant_config_ttl
+)
@@ -0,0 +1,102 @@
+"""
+Checkpoints de los pasos de handle_message por ID de tarea de Celery.
+
+Un reintento conserva el ID de la tarea, así que basta con anotar cada paso
+completado en un hash de Redis (`checkpoint:{task_id}`) para que el
+reintento continúe en el primer paso pendiente en lugar de repetir el
+pipeline: no se vuelve a añadir el mensaje al thread ni se paga otro run.
+
+Pasos, en orden:
+    message_added -> run_id -> reply (run completado) -> parts_sent -> reply_sent
+
+`parts_sent` cuenta las partes ya entregadas de una respuesta larga, para
+no repetirlas si falla el envío de una parte intermedia. Con entrega
+progresiva, `progress_offset` guarda los caracteres del texto original que
+ya se enviaron mientras el run generaba.
+"""
+
+import logging
+from typing import Dict, Optional
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ADDED = "message_added"
+RUN_ID = "run_id"
+REPLY = "reply"
+PARTS_SENT = "parts_sent"
+PROGRESS_OFFSET = "progress_offset"
+REPLY_SENT = "reply_sent"
+
+
+class TaskCheckpoint:
+    def __init__(self, task_id: Optional[str], ttl: int = 86400):
+        self.task_id = task_id
+        self.ttl = ttl
+        # Copia local: si Redis no está disponible se sigue sin reanudación
+        self._steps: Dict[str, str] = {}
+        self._use_redis = task_id is not None
+        if self._use_redis:
+            self._load()
+
+    @property
+    def key(self) -> str:
+        return f"checkpoint:{self.task_id}"
+
+    def _load(self) -> None:
+        try:
+            from src.core.redis_client import get_redis
+            raw = get_redis().hgetall(self.key)
+            self._steps = {k.decode(): v.decode() for k, v in raw.items()}
+            if self._steps:
+                logger.info(f"♻️ Reanudando tarea {self.task_id} desde {sorted(self._steps)}")
+        except Exception as e:
+            logger.warning(f"⚠️ Checkpoints no disponibles para {self.task_id}: {e}")
+            self._use_redis = False
+
+    def get(self, step: str) -> Optional[str]:
+        return self._steps.get(step)
+
+    def done(self, step: str) -> bool:
+        return step in self._steps
+
+    def mark(self, step: str, value: str = "1") -> None:
+        """Registra un paso completado"""
+        self._steps[step] = value
+        if not self._use_redis:
+            return
+        try:
+            from src.core.redis_client import get_redis
+            pipe = get_redis().pipeline()
+            pipe.hset(self.key, step, value)
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar el checkpoint {step} de {self.task_id}: {e}")
+
+    def discard(self, step: str) -> None:
+        """Olvida un paso (p. ej. un run que terminó en error y debe recrearse)"""
+        self._steps.pop(step, None)
+        if not self._use_redis:
+            return
+        try:
+            from src.core.redis_client import get_redis
+            get_redis().hdel(self.key, step)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar el checkpoint {step} de {self.task_id}: {e}")
+
+    def clear(self) -> None:
+        """Borra todos los checkpoints al terminar la tarea"""
+        self._steps = {}
+        if not self._use_redis:
+            return
+        try:
+            from src.core.redis_client import get_redis
+            get_redis().delete(self.key)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron borrar los checkpoints de {self.task_id}: {e}")
+
+
+def get_checkpoint(task_id: Optional[str]) -> TaskCheckpoint:
+    return TaskCheckpoint(task_id, ttl=settings.task_checkpoint_ttl)
@@ -0,0 +1,80 @@
+"""
+Ventana de agrupación (debounce) de mensajes por conversación.
+
+Los usuarios suelen enviar varios mensajes cortos seguidos. En lugar de una
+ejecución del assistant por mensaje, los mensajes de un mismo
+(phone_number_id, wa_id) se acumulan en una lista de Redis y se responden
+con una única ejecución cuando la conversación lleva `window` segundos en
+silencio (o cuando se alcanza `max_wait` desde el primer mensaje).
+"""
+
+import json
+import time
+import logging
+from typing import Dict, List
+
+from src.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationCoalescer:
+    def __init__(self, window: float, max_wait: float):
+        self.window = window
+        self.max_wait = max(max_wait, window)
+
+    @staticmethod
+    def _key(phone_number_id: str, wa_id: str) -> str:
+        return f"coalesce:{phone_number_id}:{wa_id}"
+
+    def push(self, job: Dict) -> bool:
+        """
+        Añade un mensaje al buffer de su conversación.
+
+        Returns:
+            True si es el primer mensaje de la ventana y hay que programar el flush
+        """
+        key = self._key(job["phone_number_id"], job["wa_id"])
+        now = time.time()
+        ttl = int(self.max_wait * 4) + 60
+
+        pipe = get_redis().pipeline()
+        pipe.rpush(key, json.dumps(job))
+        pipe.expire(key, ttl)
+        pipe.set(f"{key}:last", now, ex=ttl)
+        pipe.set(f"{key}:first", now, nx=True, ex=ttl)
+        results = pipe.execute()
+
+        # El SET NX de :first solo tiene éxito para el primer mensaje de la ventana
+        return bool(results[3])
+
+    def remaining(self, phone_number_id: str, wa_id: str) -> float:
+        """Segundos que faltan para cerrar la ventana (0 si ya se puede vaciar)"""
+        key = self._key(phone_number_id, wa_id)
+        first, last = get_redis().mget(f"{key}:first", f"{key}:last")
+        if not first or not last:
+            return 0.0
+
+        now = time.time()
+        if now - float(first) >= self.max_wait:
+            return 0.0
+
+        return max(0.0, self.window - (now - float(last)))
+
+    def drain(self, phone_number_id: str, wa_id: str) -> List[Dict]:
+        """Vacía atómicamente el buffer de la conversación"""
+        key = self._key(phone_number_id, wa_id)
+
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key, f"{key}:first", f"{key}:last")
+        raw_jobs, _ = pipe.execute()
+
+        return [json.loads(raw) for raw in raw_jobs]
+
+
+def merge_jobs(jobs: List[Dict]) -> Dict:
+    """Combina los mensajes de una ventana en un único job (conserva el último message_id)"""
+    merged = dict(jobs[-1])
+    merged["text"] = "\n".join(job["text"] for job in jobs)
+    return merged
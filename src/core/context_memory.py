@@ -0,0 +1,337 @@
+"""
+Contexto acotado para conversaciones largas, con resumen incremental.
+
+Un huésped que escribe durante toda su estancia hace crecer el contexto de
+cada run sin límite: más latencia y más tokens en cada mensaje. Cuando una
+conversación supera `context_token_budget`, los turnos antiguos se resumen
+con `summary_model` en una memoria compacta (conversation_summaries) y a
+partir de ahí solo se envían el resumen y los últimos mensajes:
+
+- Threads de OpenAI: truncation_strategy `last_messages` con una ventana de
+  2 × `context_keep_messages` y el resumen como instrucciones adicionales.
+  El run informa de sus prompt_tokens; antes de que un mensaje no resumido
+  salga de la ventana, se pliega en el resumen.
+- Motor "chat": el historial se lee desde el último mensaje resumido y el
+  resumen va como mensaje de sistema.
+
+El resumen se actualiza después de entregar la respuesta y de liberar el
+lease de la conversación, y sus errores solo se registran: nunca retrasan
+ni hacen fallar un mensaje. En los threads, el historial solo se lista
+cuando los prompt_tokens se acercan al presupuesto o cuando, según un
+contador de turnos en Redis, los mensajes no resumidos podrían empezar a
+salir de la ventana.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from src.core.models import ConversationMessage, ConversationSummary, ENGINE_ASSISTANTS, ENGINE_CHAT
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SUMMARY_PROMPT = (
+    "Resume la conversación entre un usuario de WhatsApp y un asistente. "
+    "Conserva los datos que el asistente necesitará después: nombre, fechas, "
+    "reservas, pedidos, preferencias, problemas pendientes y compromisos "
+    "adquiridos. Si hay un resumen anterior, intégralo en uno nuevo. "
+    "Escribe solo el resumen, en frases breves."
+)
+
+_UPSERT_SUMMARY_SQL = text("""
+    INSERT INTO conversation_summaries (phone_number_id, wa_id, summary, engine, summarized_until, updated_at)
+    VALUES (:phone_number_id, :wa_id, :summary, :engine, :summarized_until, :now)
+    ON CONFLICT (phone_number_id, wa_id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        engine = EXCLUDED.engine,
+        summarized_until = EXCLUDED.summarized_until,
+        updated_at = EXCLUDED.updated_at
+""")
+
+# (rol, texto) de un mensaje de la conversación
+Turn = Tuple[str, str]
+
+# Fracción del presupuesto a partir de la cual se lista el thread
+_NEAR_BUDGET = 0.8
+_TURNS_TTL = 7 * 86400
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+
+def history_cursor(summarized_until: Optional[str]) -> int:
+    """
+    ID del último mensaje resumido de conversation_messages. Un cursor
+    ilegible (p. ej. un ID de mensaje de OpenAI) equivale a no tener cursor.
+    """
+    if summarized_until is None:
+        return 0
+    try:
+        return int(summarized_until)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ Cursor de resumen no válido para el historial local: {summarized_until!r}")
+        return 0
+
+
+def _thread_message_text(message) -> str:
+    return "".join(part.text.value for part in message.content if part.type == "text")
+
+
+class ContextMemory:
+    def __init__(self, token_budget: int = 6000, keep_messages: int = 10, model: str = "gpt-4o-mini"):
+        """
+        Args:
+            token_budget: Tokens de contexto a partir de los cuales se resume (0 = desactivado)
+            keep_messages: Mensajes recientes que siempre se envían completos
+            model: Modelo de Chat Completions que escribe los resúmenes
+        """
+        self.token_budget = token_budget
+        self.keep_messages = keep_messages
+        self.model = model
+
+    @property
+    def enabled(self) -> bool:
+        return self.token_budget > 0 and self.keep_messages > 0
+
+    @property
+    def window(self) -> int:
+        """Mensajes que ve un run de un thread resumido"""
+        return 2 * self.keep_messages
+
+    def _openai(self):
+        from src.core.openai_client import get_openai_client
+        client = get_openai_client()
+        client._ensure_client()
+        return client.client
+
+    def get(self, phone_number_id: str, wa_id: str, engine: str, session=None) -> Optional[Tuple[str, str]]:
+        """
+        (resumen, último mensaje resumido) de la conversación, o None. Un
+        resumen escrito por el otro motor (el cliente cambió de motor) se
+        ignora: su cursor no identifica mensajes de este, y el siguiente
+        resumen lo sustituye.
+        """
+        if not self.enabled:
+            return None
+        if session is None:
+            from src.core.database import db_manager
+            with db_manager.get_session() as session:
+                return self.get(phone_number_id, wa_id, engine, session)
+
+        row = session.execute(
+            select(
+                ConversationSummary.summary,
+                ConversationSummary.summarized_until,
+                ConversationSummary.engine
+            ).where(
+                ConversationSummary.phone_number_id == phone_number_id,
+                ConversationSummary.wa_id == wa_id
+            )
+        ).first()
+        if not row:
+            return None
+        summary, until, written_by = row
+        if written_by is None:
+            written_by = ENGINE_CHAT if str(until).isdigit() else ENGINE_ASSISTANTS
+        if written_by != engine:
+            logger.info(f"🔀 Resumen de {wa_id} escrito por el motor '{written_by}', se ignora en '{engine}'")
+            return None
+        return summary, until
+
+    def save(self, phone_number_id: str, wa_id: str, engine: str, summary: str, summarized_until: str) -> None:
+        from src.core.database import db_manager
+
+        with db_manager.get_session() as session:
+            session.execute(_UPSERT_SUMMARY_SQL, {
+                "phone_number_id": phone_number_id,
+                "wa_id": wa_id,
+                "summary": summary,
+                "engine": engine,
+                "summarized_until": summarized_until,
+                "now": datetime.utcnow()
+            })
+            session.commit()
+
+    @staticmethod
+    def instructions(summary: str) -> str:
+        return f"Resumen de la conversación anterior con este usuario:\n\n{summary}"
+
+    def summarize(self, previous: Optional[str], turns: List[Turn]) -> str:
+        """
+        Pliega los turnos (del más antiguo al más reciente) en el resumen. Un
+        historial largo se resume por tramos de `token_budget` tokens.
+        """
+        summary = previous or ""
+        chunk: List[Turn] = []
+        size = 0
+        for turn in turns:
+            tokens = estimate_tokens(turn[1])
+            if chunk and size + tokens > self.token_budget:
+                summary = self._summarize_chunk(summary, chunk)
+                chunk, size = [], 0
+            chunk.append(turn)
+            size += tokens
+        if chunk:
+            summary = self._summarize_chunk(summary, chunk)
+        return summary
+
+    def _summarize_chunk(self, previous: str, turns: List[Turn]) -> str:
+        transcript = "\n".join(
+            f"{'Usuario' if role == 'user' else 'Asistente'}: {content}" for role, content in turns
+        )
+        content = f"Resumen anterior:\n{previous}\n\n" if previous else ""
+        content += f"Conversación:\n{transcript}"
+
+        completion = self._openai().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": _SUMMARY_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            max_tokens=max(self.token_budget // 4, 256)
+        )
+        return (completion.choices[0].message.content or previous).strip()
+
+    def needs_compaction(self, pending: List[Turn], window: int) -> bool:
+        """
+        Hay que resumir si los mensajes no resumidos superan el presupuesto o
+        están a punto de salir de la ventana (un turno sin run, como una FAQ
+        local, añade dos mensajes y el siguiente run uno más).
+        """
+        if len(pending) <= self.keep_messages:
+            return False
+        tokens = sum(estimate_tokens(content) for _, content in pending)
+        return tokens > self.token_budget or len(pending) >= window - 2
+
+    # --- Threads de OpenAI ---
+
+    def thread_run_options(self, phone_number_id: str, wa_id: str) -> Dict:
+        """Opciones del run: ventana de mensajes recientes y el resumen, si lo hay"""
+        memory = self.get(phone_number_id, wa_id, ENGINE_ASSISTANTS)
+        if memory is None:
+            return {}
+        return {
+            "truncation_strategy": {"type": "last_messages", "last_messages": self.window},
+            "additional_instructions": self.instructions(memory[0])
+        }
+
+    @staticmethod
+    def _turns_key(phone_number_id: str, wa_id: str) -> str:
+        return f"ctx-turns:{phone_number_id}:{wa_id}"
+
+    def _count_turn(self, phone_number_id: str, wa_id: str) -> Optional[int]:
+        """Turnos con run desde el último resumen; None si Redis no está disponible"""
+        try:
+            from src.core.redis_client import get_redis
+            key = self._turns_key(phone_number_id, wa_id)
+            pipe = get_redis().pipeline()
+            pipe.incr(key)
+            pipe.expire(key, _TURNS_TTL)
+            return pipe.execute()[0]
+        except Exception as e:
+            logger.warning(f"⚠️ Contador de turnos no disponible: {e}")
+            return None
+
+    def _reset_turns(self, phone_number_id: str, wa_id: str) -> None:
+        try:
+            from src.core.redis_client import get_redis
+            get_redis().delete(self._turns_key(phone_number_id, wa_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Contador de turnos no disponible: {e}")
+
+    def _may_need_compaction(self, phone_number_id: str, wa_id: str, prompt_tokens: Optional[int]) -> bool:
+        """
+        Con resumen previo, si merece la pena listar el thread: el run se
+        acerca al presupuesto o los mensajes no resumidos (los `keep_messages`
+        del último resumen más dos por turno) se acercan al final de la ventana.
+        """
+        turns = self._count_turn(phone_number_id, wa_id)
+        if (prompt_tokens or 0) >= self.token_budget * _NEAR_BUDGET:
+            return True
+        return turns is None or self.keep_messages + 2 * turns >= self.window - 2
+
+    def compact_thread(
+        self,
+        thread_id: str,
+        phone_number_id: str,
+        wa_id: str,
+        prompt_tokens: Optional[int] = None
+    ) -> bool:
+        """
+        Pliega en el resumen los mensajes del thread anteriores a los últimos
+        `keep_messages`. El primer resumen se hace cuando los prompt_tokens
+        del run superan el presupuesto (no hay ventana: el run ve el thread
+        entero). Devuelve True si el resumen cambió.
+        """
+        if not self.enabled:
+            return False
+        memory = self.get(phone_number_id, wa_id, ENGINE_ASSISTANTS)
+        if memory is None and (prompt_tokens or 0) <= self.token_budget:
+            return False
+        if memory is not None and not self._may_need_compaction(phone_number_id, wa_id, prompt_tokens):
+            return False
+        summary, until = memory or (None, None)
+
+        # Mensajes no resumidos, del más reciente al más antiguo
+        pending = []
+        for message in self._openai().beta.threads.messages.list(thread_id=thread_id, order="desc", limit=100):
+            if message.id == until:
+                break
+            pending.append((message.id, message.role, _thread_message_text(message)))
+
+        if memory is None:
+            # El run ya superó el presupuesto: se resume todo salvo lo reciente
+            if len(pending) <= self.keep_messages:
+                return False
+        elif not self.needs_compaction([(role, content) for _, role, content in pending], self.window):
+            return False
+
+        fold = list(reversed(pending[self.keep_messages:]))
+        summary = self.summarize(summary, [(role, content) for _, role, content in fold if content])
+        self.save(phone_number_id, wa_id, ENGINE_ASSISTANTS, summary, fold[-1][0])
+        self._reset_turns(phone_number_id, wa_id)
+        logger.info(f"🧠 {len(fold)} mensaje(s) resumidos en el thread {thread_id}")
+        return True
+
+    # --- Historial local (motor "chat") ---
+
+    def compact_history(self, phone_number_id: str, wa_id: str, window: int) -> bool:
+        """Igual que compact_thread, sobre conversation_messages"""
+        if not self.enabled:
+            return False
+        from src.core.database import db_manager
+
+        with db_manager.get_session() as session:
+            memory = self.get(phone_number_id, wa_id, ENGINE_CHAT, session)
+            summary, until = memory or (None, None)
+            pending = session.execute(
+                select(ConversationMessage.id, ConversationMessage.role, ConversationMessage.content)
+                .where(
+                    ConversationMessage.phone_number_id == phone_number_id,
+                    ConversationMessage.wa_id == wa_id,
+                    ConversationMessage.id > history_cursor(until)
+                )
+                .order_by(ConversationMessage.id.desc())
+            ).all()
+
+        if not self.needs_compaction([(role, content) for _, role, content in pending], window):
+            return False
+
+        fold = list(reversed(pending[self.keep_messages:]))
+        summary = self.summarize(summary, [(role, content) for _, role, content in fold])
+        self.save(phone_number_id, wa_id, ENGINE_CHAT, summary, str(fold[-1][0]))
+        logger.info(f"🧠 {len(fold)} mensaje(s) resumidos para {wa_id} ({phone_number_id})")
+        return True
+
+
+# Instancia global (una por proceso)
+context_memory = ContextMemory(
+    token_budget=settings.context_token_budget,
+    keep_messages=settings.context_keep_messages,
+    model=settings.summary_model
+)
@@ -0,0 +1,91 @@
+"""
+Lease exclusivo por conversación entre workers de Celery.
+
+Dos tareas del mismo (phone_number_id, wa_id) no pueden ejecutarse a la vez:
+OpenAI rechaza añadir mensajes o lanzar un run mientras otro run del mismo
+thread sigue activo. Conversaciones distintas no comparten lease y se
+procesan en paralelo. El lease caduca solo, así que un worker caído no
+bloquea la conversación más de `conversation_lease_seconds`.
+"""
+
+import logging
+from contextlib import contextmanager, asynccontextmanager
+
+from src.core.redis_client import get_redis, get_async_redis
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationBusy(Exception):
+    """Otra tarea tiene el lease de la conversación"""
+    pass
+
+
+def _lease_key(phone_number_id: str, wa_id: str) -> str:
+    return f"conv-lease:{phone_number_id}:{wa_id}"
+
+
+@contextmanager
+def conversation_lease(phone_number_id: str, wa_id: str):
+    """
+    Adquiere el lease de la conversación, esperando hasta
+    `conversation_lease_wait_seconds`. Si Redis no está disponible se
+    continúa sin lease (comportamiento anterior).
+    
+    Raises:
+        ConversationBusy: si no se obtuvo el lease a tiempo
+    """
+    try:
+        lock = get_redis().lock(
+            _lease_key(phone_number_id, wa_id),
+            timeout=settings.conversation_lease_seconds,
+            blocking_timeout=settings.conversation_lease_wait_seconds
+        )
+        acquired = lock.acquire()
+    except Exception as e:
+        logger.warning(f"⚠️ Lease de conversación no disponible: {e}")
+        yield
+        return
+    
+    if not acquired:
+        raise ConversationBusy(f"Conversación {wa_id} ocupada en otro worker")
+    
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except Exception as e:
+            # El lease expiró antes de terminar; otro worker pudo tomarlo
+            logger.warning(f"⚠️ Lease de {wa_id} liberado tras expirar: {e}")
+
+
+@asynccontextmanager
+async def async_conversation_lease(phone_number_id: str, wa_id: str):
+    """
+    Variante asíncrona para el worker asyncio. Usa la misma clave que
+    conversation_lease, así que excluye también a los workers de Celery.
+    """
+    try:
+        lock = get_async_redis().lock(
+            _lease_key(phone_number_id, wa_id),
+            timeout=settings.conversation_lease_seconds,
+            blocking_timeout=settings.conversation_lease_wait_seconds
+        )
+        acquired = await lock.acquire()
+    except Exception as e:
+        logger.warning(f"⚠️ Lease de conversación no disponible: {e}")
+        yield
+        return
+    
+    if not acquired:
+        raise ConversationBusy(f"Conversación {wa_id} ocupada en otro worker")
+    
+    try:
+        yield
+    finally:
+        try:
+            await lock.release()
+        except Exception as e:
+            logger.warning(f"⚠️ Lease de {wa_id} liberado tras expirar: {e}")
@@ -1,6 +1,14 @@
 """
 Módulo de base de datos para WhatsApp Bot
-Configuración optimizada para Railway con PostgreSQL (versión síncrona)
+Configuración optimizada para Railway con PostgreSQL.
+
+- Engine síncrono (psycopg2): workers de Celery y scripts
+- Engine asíncrono (asyncpg): routers de FastAPI, sin bloquear el event loop
+
+Los cambios de esquema sobre tablas existentes (columnas e índices nuevos)
+no se aplican al arrancar: se ejecutan una vez por despliegue con
+`python scripts/migrate.py` (preDeployCommand en railway.toml). Con
+DB_AUTO_MIGRATE=true se aplican también en el arranque, solo para desarrollo.
 """
 
 import os
@@ -9,6 +17,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import text
 from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -17,6 +26,8 @@ class DatabaseManager:
     def __init__(self):
         self.engine = None
         self.SessionLocal = None
+        self.async_engine = None
+        self.AsyncSessionLocal = None
         self._initialized = False
     
     def get_database_url(self) -> str:
@@ -179,6 +190,9 @@ class DatabaseManager:
             
             self._initialized = True
             logger.info("✅ Conexión a la base de datos establecida exitosamente")
+            
+            # Engine asíncrono con la misma URL/SSL que resultó válida para el síncrono
+            self._initialize_async(self.engine.url.render_as_string(hide_password=False))
             return True
             
         except Exception as e:
@@ -189,6 +203,66 @@ class DatabaseManager:
             self.SessionLocal = None
             return False
     
+    def _initialize_async(self, sync_url: str) -> bool:
+        """Crear el engine asíncrono (asyncpg) a partir de la URL síncrona"""
+        try:
+            from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+            
+            async_url, connect_args = self._to_async_url(sync_url)
+            
+            self.async_engine = create_async_engine(
+                async_url,
+                echo=os.getenv('DB_ECHO', 'False').lower() == 'true',
+                pool_pre_ping=True,
+                pool_recycle=300,
+                pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                max_overflow=10,
+                pool_timeout=30,
+                connect_args=connect_args
+            )
+            
+            self.AsyncSessionLocal = async_sessionmaker(
+                bind=self.async_engine,
+                class_=AsyncSession,
+                autoflush=False,
+                expire_on_commit=False
+            )
+            
+            logger.info("✅ Engine asíncrono (asyncpg) configurado")
+            return True
+            
+        except Exception as e:
+            logger.warning(f"⚠️ Engine asíncrono no disponible: {str(e)}")
+            self.async_engine = None
+            self.AsyncSessionLocal = None
+            return False
+    
+    def _to_async_url(self, url: str):
+        """
+        Convertir una URL de psycopg2 al driver asyncpg.
+        
+        asyncpg no entiende los parámetros libpq de la query (sslmode, sslcert...),
+        así que se eliminan y sslmode se traslada a connect_args["ssl"].
+        
+        Returns:
+            Tupla (url_asyncpg, connect_args)
+        """
+        from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+        
+        parsed = urlparse(url)
+        query_params = parse_qs(parsed.query)
+        
+        connect_args = {"server_settings": {"application_name": "whatsapp-bot-async"}}
+        ssl_mode = query_params.pop('sslmode', [None])[0]
+        if ssl_mode:
+            connect_args["ssl"] = ssl_mode
+        for libpq_param in ('sslcert', 'sslkey', 'sslrootcert'):
+            query_params.pop(libpq_param, None)
+        
+        scheme = "postgresql+asyncpg"
+        new_parsed = parsed._replace(scheme=scheme, query=urlencode(query_params, doseq=True))
+        return urlunparse(new_parsed), connect_args
+    
     def _add_ssl_mode(self, url: str, ssl_mode: str) -> str:
         """Agregar o modificar el parámetro sslmode en la URL de forma segura"""
         from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
@@ -225,7 +299,7 @@ class DatabaseManager:
                 return f"{url}?sslmode={ssl_mode}"
     
     def create_tables(self) -> bool:
-        """Crear todas las tablas definidas en los modelos"""
+        """Crear las tablas definidas en los modelos que no existan"""
         if not self._initialized:
             self.initialize()
         
@@ -235,18 +309,89 @@ class DatabaseManager:
             
         try:
             # Importar modelos para que SQLModel los registre
-            from .models import Agent, Client, Thread
+            from .models import Agent, Client, Thread, ConversationMessage, ConversationSummary, AssistantRecord
             
             # Crear todas las tablas
             SQLModel.metadata.create_all(bind=self.engine)
-            
             logger.info("✅ Tablas creadas exitosamente")
+            
+            if os.getenv('DB_AUTO_MIGRATE', 'False').lower() == 'true':
+                return self.migrate()
             return True
             
         except Exception as e:
             logger.error(f"❌ Error al crear las tablas: {str(e)}")
             return False
     
+    def migrate(self) -> bool:
+        """
+        Aplicar a las tablas existentes las columnas e índices nuevos de los
+        modelos (create_all no altera tablas). Es idempotente; se ejecuta
+        desde scripts/migrate.py, no en cada arranque de cada réplica.
+        """
+        if not self._initialized:
+            self.initialize()
+        
+        if not self.engine:
+            logger.error("Engine no inicializado")
+            return False
+        
+        try:
+            from .models import Agent, Client, Thread, ConversationMessage, ConversationSummary, AssistantRecord
+            
+            SQLModel.metadata.create_all(bind=self.engine)
+            self._add_missing_columns()
+            self._add_missing_indexes()
+            
+            logger.info("✅ Esquema migrado")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Error al migrar el esquema: {str(e)}")
+            return False
+    
+    def _add_missing_columns(self) -> None:
+        """
+        Añadir a las tablas existentes las columnas nuevas de los modelos.
+        
+        Solo cubre cambios aditivos; las columnas se crean como NULL para no
+        fallar sobre tablas con datos.
+        """
+        from sqlalchemy import inspect
+        
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        
+        with self.engine.begin() as conn:
+            for table in SQLModel.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                
+                existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                    ))
+                    logger.info(f"➕ Columna añadida: {table.name}.{column.name}")
+    
+    def _add_missing_indexes(self) -> None:
+        """
+        Crear en tablas existentes los índices nuevos de los modelos.
+        
+        Un índice único puede fallar si ya hay filas duplicadas; se registra
+        el error y se continúa para no impedir el arranque.
+        """
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=self.engine, checkfirst=True)
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo crear el índice {index.name}: {str(e)[:120]}")
+    
     def health_check(self) -> bool:
         """Verificar el estado de la conexión"""
         if not self._initialized or not self.SessionLocal:
@@ -271,12 +416,28 @@ class DatabaseManager:
             
         return self.SessionLocal()
     
+    def get_async_session(self) -> AsyncSession:
+        """Obtener una sesión asíncrona de base de datos"""
+        if not self._initialized:
+            self.initialize()
+        
+        if not self.AsyncSessionLocal:
+            raise RuntimeError("Base de datos asíncrona no inicializada")
+            
+        return self.AsyncSessionLocal()
+    
     def close(self):
         """Cerrar la conexión a la base de datos"""
         if self.engine:
             self.engine.dispose()
             self._initialized = False
             logger.info("Conexión a la base de datos cerrada")
+    
+    async def close_async(self):
+        """Cerrar el pool del engine asíncrono"""
+        if self.async_engine:
+            await self.async_engine.dispose()
+            logger.info("Pool asíncrono de base de datos cerrado")
 
 # Instancia global del gestor de base de datos
 db_manager = DatabaseManager()
@@ -290,10 +451,28 @@ def create_tables() -> bool:
     """Crear las tablas"""
     return db_manager.create_tables()
 
+def migrate_database() -> bool:
+    """Aplicar columnas e índices nuevos a las tablas existentes"""
+    return db_manager.migrate()
+
 def get_session() -> Session:
     """Obtener una sesión de base de datos"""
     return db_manager.get_session()
 
+def get_async_session() -> AsyncSession:
+    """Obtener una sesión asíncrona de base de datos"""
+    return db_manager.get_async_session()
+
+async def get_db_session():
+    """
+    Dependency de FastAPI con una sesión asíncrona.
+    
+    La sesión solo se crea si el endpoint la declara y se cierra (devolviendo
+    la conexión al pool) al terminar la petición, aunque haya errores.
+    """
+    async with db_manager.get_async_session() as session:
+        yield session
+
 def health_check() -> bool:
     """Verificar el estado de la base de datos"""
     return db_manager.health_check()
@@ -301,3 +480,7 @@ def health_check() -> bool:
 def close_database():
     """Cerrar la conexión a la base de datos"""
     db_manager.close()
+
+async def close_async_database():
+    """Cerrar el pool asíncrono de la base de datos"""
+    await db_manager.close_async()
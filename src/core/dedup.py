@@ -0,0 +1,75 @@
+"""
+Deduplicación de mensajes de WhatsApp por ID (wamid).
+
+Meta reenvía el webhook cuando respondemos lento; cada duplicado costaría
+otra ejecución completa en OpenAI. Se mantiene un registro acotado con TTL
+en memoria y, opcionalmente, uno compartido en Redis para varias réplicas web.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDeduplicator:
+    def __init__(self, ttl: float = 86400, max_entries: int = 50000, backend: str = "memory"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        # message_id -> instante en que se vio, en orden de llegada
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def _check_local(self, message_id: str) -> bool:
+        """Devuelve True si el ID ya se vio; si no, lo registra"""
+        now = time.monotonic()
+
+        # Purgar los más antiguos (expirados o por encima del límite)
+        while self._seen:
+            _, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.ttl and len(self._seen) < self.max_entries:
+                break
+            self._seen.popitem(last=False)
+
+        if message_id in self._seen:
+            return True
+
+        self._seen[message_id] = now
+        return False
+
+    async def is_duplicate(self, message_id: Optional[str]) -> bool:
+        """
+        Indica si el mensaje ya fue recibido, registrándolo en caso contrario.
+        
+        Los mensajes sin ID nunca se consideran duplicados. Si Redis falla,
+        se confía únicamente en el registro local.
+        """
+        if not message_id:
+            return False
+
+        if self._check_local(message_id):
+            return True
+
+        if self.backend == "redis":
+            try:
+                from src.core.redis_client import get_async_redis
+                added = await get_async_redis().set(
+                    f"wa:msg:{message_id}", 1, nx=True, ex=int(self.ttl)
+                )
+                return not added
+            except Exception as e:
+                logger.warning(f"⚠️ Dedup en Redis no disponible: {e}")
+
+        return False
+
+
+# Instancia global
+message_deduplicator = MessageDeduplicator(
+    ttl=settings.dedup_ttl,
+    max_entries=settings.dedup_max_entries,
+    backend=settings.dedup_backend
+)
@@ -0,0 +1,79 @@
+"""
+Contadores en memoria de callbacks de estado de WhatsApp (sent/delivered/read).
+
+Guarda solo agregados: conteo por estado y latencia sent -> delivered/read
+en un histograma de buckets fijos, usando los timestamps que envía Meta.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de latencia
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 3600)
+
+
+class DeliveryStats:
+    def __init__(self, max_pending: int = 10000):
+        self.max_pending = max_pending
+        self.status_counts: Dict[str, int] = {}
+        # message_id -> timestamp de "sent", pendiente de delivered/read
+        self._sent_at: "OrderedDict[str, int]" = OrderedDict()
+        self._latency: Dict[str, list] = {
+            status: [0] * (len(LATENCY_BUCKETS) + 1) for status in ("delivered", "read")
+        }
+
+    def record(self, message_id: str, status: str, timestamp: int) -> None:
+        """Registra un estado individual"""
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+        if status == "sent":
+            self._sent_at[message_id] = timestamp
+            if len(self._sent_at) > self.max_pending:
+                self._sent_at.popitem(last=False)
+            return
+
+        if status in self._latency and message_id in self._sent_at:
+            latency = timestamp - self._sent_at[message_id]
+            if status == "read":
+                self._sent_at.pop(message_id, None)
+            buckets = self._latency[status]
+            for i, upper in enumerate(LATENCY_BUCKETS):
+                if latency <= upper:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+
+    def record_payload(self, body: bytes) -> None:
+        """Registra todos los estados de un payload de webhook"""
+        try:
+            data = json.loads(body)
+            for entry in data.get("entry", []):
+                for change in entry.get("changes", []):
+                    for status in change.get("value", {}).get("statuses", []):
+                        self.record(
+                            status.get("id", ""),
+                            status.get("status", "unknown"),
+                            int(status.get("timestamp", 0))
+                        )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron registrar estados: {e}")
+
+    def snapshot(self) -> Dict:
+        """Resumen serializable para /health"""
+        labels = [f"le_{upper}s" for upper in LATENCY_BUCKETS] + ["inf"]
+        return {
+            "statuses": dict(self.status_counts),
+            "latency": {
+                status: dict(zip(labels, buckets))
+                for status, buckets in self._latency.items()
+            }
+        }
+
+
+# Instancia global
+delivery_stats = DeliveryStats()
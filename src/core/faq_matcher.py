@@ -0,0 +1,306 @@
+"""
+Respuestas locales a preguntas frecuentes, sin pasar por OpenAI.
+
+Los clientes creados con FAQs guardan los pares pregunta/respuesta en
+`Client.faqs` (JSON). Con ellos se construye, por tenant, un índice TF-IDF
+de n-gramas de caracteres sobre las preguntas normalizadas, en arrays de
+NumPy. Si un mensaje entrante se parece a una pregunta por encima de
+`settings.faq_match_threshold` (similitud coseno), el worker responde con
+la respuesta de la FAQ en milisegundos y se ahorra el run.
+
+Los n-gramas de caracteres toleran erratas, plurales y signos de
+puntuación, que en preguntas cortas de WhatsApp son lo habitual. Las
+palabras que no están en las preguntas restan similitud, y un mensaje
+negado no se responde con la FAQ afirmativa (ni al revés).
+
+El mismo índice sirve para la recuperación (Client.faq_mode "retrieval"): si el
+mensaje no es una FAQ literal, las `faq_retrieval_top_k` más parecidas se
+pasan al run como instrucciones adicionales, en lugar de copiar todas las
+FAQs en las instrucciones del assistant.
+
+Al cambiar las FAQs de un tenant solo se extraen los n-gramas de las
+preguntas nuevas o editadas; el vocabulario, el IDF y la matriz se
+recalculan enteros (son operaciones vectoriales baratas frente a la
+extracción).
+"""
+
+import json
+import re
+import threading
+import time
+import hashlib
+import logging
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes ni puntuación y con espacios simples"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _ngrams(text: str, sizes: Tuple[int, ...]) -> List[str]:
+    padded = f" {text} "
+    return [padded[i:i + n] for n in sizes for i in range(len(padded) - n + 1)]
+
+
+# Palabras que invierten el sentido de una pregunta ("¿no hacen envíos?")
+_NEGATIONS = frozenset({"no", "ni", "nunca", "jamas", "tampoco", "ningun", "ninguna", "ninguno", "nada", "sin"})
+
+
+def is_negated(text: str) -> bool:
+    """El texto contiene una negación"""
+    return not _NEGATIONS.isdisjoint(normalize(text).split())
+
+
+def parse_faqs(raw: Optional[str]) -> List[Dict[str, str]]:
+    """FAQs guardadas en Client.faqs (lista JSON de {"q", "a"})"""
+    if not raw:
+        return []
+    try:
+        faqs = json.loads(raw)
+    except ValueError:
+        logger.warning("⚠️ FAQs con JSON inválido, se ignoran")
+        return []
+    return [faq for faq in faqs if faq.get("q") and faq.get("a")]
+
+
+class FAQMatcher:
+    def __init__(
+        self,
+        faqs: List[Dict[str, str]],
+        ngram_sizes: Tuple[int, ...] = (3, 4, 5),
+        previous: Optional["FAQMatcher"] = None
+    ):
+        """
+        Args:
+            previous: Índice anterior del mismo tenant. Las preguntas que no
+                han cambiado reutilizan sus n-gramas; solo se procesan las
+                nuevas o editadas.
+        """
+        self.faqs = faqs
+        self.ngram_sizes = ngram_sizes
+        self.vocabulary: Dict[str, int] = {}
+
+        known = previous._grams if previous is not None and previous.ngram_sizes == ngram_sizes else {}
+        self._grams: Dict[str, Counter] = {}
+        documents = []
+        for faq in faqs:
+            key = normalize(faq["q"])
+            grams = known.get(key) or self._grams.get(key) or Counter(_ngrams(key, ngram_sizes))
+            self._grams[key] = grams
+            documents.append(grams)
+        self.reused = sum(1 for key in self._grams if key in known)
+
+        for grams in documents:
+            for gram in grams:
+                self.vocabulary.setdefault(gram, len(self.vocabulary))
+
+        counts = np.zeros((len(faqs), len(self.vocabulary)), dtype=np.float32)
+        for row, grams in enumerate(documents):
+            columns = [self.vocabulary[gram] for gram in grams]
+            counts[row, columns] = list(grams.values())
+
+        # IDF suavizado: los n-gramas presentes en todas las preguntas pesan poco
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(faqs)) / (1 + document_frequency)) + 1).astype(np.float32)
+        # IDF de un n-grama que no está en ninguna pregunta
+        self.unknown_idf = float(np.log(1 + len(faqs)) + 1)
+        self.matrix = self._normalize_rows(counts * self.idf)
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def vectorize(self, text: str) -> np.ndarray:
+        """
+        Vector TF-IDF de un texto sobre el vocabulario de las preguntas.
+        
+        Los n-gramas que no aparecen en ninguna pregunta no tienen columna,
+        pero sí cuentan en la norma (con el IDF máximo): las palabras de más
+        ("premium" en lugar de "básico") bajan la similitud en vez de
+        ignorarse.
+        """
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        unknown = Counter()
+        for gram in _ngrams(normalize(text), self.ngram_sizes):
+            index = self.vocabulary.get(gram)
+            if index is not None:
+                vector[index] += 1
+            else:
+                unknown[gram] += 1
+        
+        vector *= self.idf
+        unknown_weight = self.unknown_idf ** 2 * sum(count ** 2 for count in unknown.values())
+        norm = np.sqrt(float(vector @ vector) + unknown_weight)
+        return vector / norm if norm else vector
+
+    def scores(self, text: str) -> np.ndarray:
+        """Similitud coseno del texto con cada pregunta"""
+        if not self.faqs:
+            return np.zeros(0, dtype=np.float32)
+        return self.matrix @ self.vectorize(text)
+
+    def match(self, text: str) -> Optional[Tuple[Dict[str, str], float]]:
+        """Mejor FAQ y su similitud, o None si no hay FAQs"""
+        scores = self.scores(text)
+        if not len(scores):
+            return None
+        best = int(np.argmax(scores))
+        return self.faqs[best], float(scores[best])
+
+    def top_k(self, text: str, k: int, min_score: float = 0.0) -> List[Tuple[Dict[str, str], float]]:
+        """Las k FAQs más parecidas al texto, de mayor a menor similitud"""
+        scores = self.scores(text)
+        if not len(scores) or k <= 0:
+            return []
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.faqs[i], float(scores[i])) for i in best if scores[i] >= min_score]
+
+
+class FAQRegistry:
+    """
+    Matchers por phone_number_id. Se construyen la primera vez que se usan
+    y se recargan de la base de datos pasado `ttl`; si las FAQs no han
+    cambiado se reutiliza el índice.
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        # phone_number_id -> (expira_en, hash de las FAQs, matcher, recuperación por run)
+        self._matchers: Dict[str, Tuple[float, str, Optional[FAQMatcher], bool]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, phone_number_id: str, raw_faqs: Optional[str], retrieval: bool = False) -> Optional[FAQMatcher]:
+        """
+        Construye (o reutiliza) el matcher de un tenant a partir de su JSON de
+        FAQs. `retrieval` indica que su assistant no tiene las FAQs en las
+        instrucciones (Client.faq_mode == "retrieval").
+        """
+        digest = hashlib.sha1((raw_faqs or "").encode()).hexdigest()
+        with self._lock:
+            entry = self._matchers.get(phone_number_id)
+        if entry and entry[1] == digest:
+            matcher = entry[2]
+        else:
+            faqs = parse_faqs(raw_faqs)
+            previous = entry[2] if entry else None
+            matcher = FAQMatcher(faqs, previous=previous) if faqs else None
+            if matcher:
+                logger.info(
+                    f"📚 Índice de {len(faqs)} FAQs construido para {phone_number_id} "
+                    f"({matcher.reused} reutilizadas)"
+                )
+
+        with self._lock:
+            self._matchers[phone_number_id] = (time.monotonic() + self.ttl, digest, matcher, retrieval)
+        return matcher
+
+    def invalidate(self, phone_number_id: Optional[str] = None) -> None:
+        with self._lock:
+            if phone_number_id is None:
+                self._matchers.clear()
+            else:
+                self._matchers.pop(phone_number_id, None)
+
+    def get(self, phone_number_id: str) -> Optional[FAQMatcher]:
+        return self._entry(phone_number_id)[2]
+
+    def _entry(self, phone_number_id: str) -> Tuple[float, str, Optional[FAQMatcher], bool]:
+        with self._lock:
+            entry = self._matchers.get(phone_number_id)
+        if entry and entry[0] >= time.monotonic():
+            return entry
+
+        from src.core.models import FAQ_RETRIEVAL
+
+        raw_faqs, faq_mode = self._load(phone_number_id) or (None, None)
+        self.register(phone_number_id, raw_faqs, retrieval=faq_mode == FAQ_RETRIEVAL)
+        with self._lock:
+            return self._matchers[phone_number_id]
+
+    def _load(self, phone_number_id: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """(faqs, faq_mode) del cliente activo del número, o None"""
+        from sqlmodel import select
+        from src.core.database import db_manager
+        from src.core.models import Client
+
+        with db_manager.get_session() as session:
+            return session.execute(
+                select(Client.faqs, Client.faq_mode).where(
+                    Client.phone_number_id == phone_number_id,
+                    Client.active == True
+                )
+            ).first()
+
+    def answer(self, phone_number_id: str, text: str) -> Optional[str]:
+        """Respuesta de la FAQ si el mensaje la iguala con suficiente confianza"""
+        try:
+            matcher = self.get(phone_number_id)
+        except Exception as e:
+            logger.warning(f"⚠️ FAQs no disponibles para {phone_number_id}: {e}")
+            return None
+        if matcher is None:
+            return None
+
+        result = matcher.match(text)
+        if result is None:
+            return None
+        faq, score = result
+        if score < settings.faq_match_threshold:
+            return None
+        if is_negated(text) != is_negated(faq["q"]):
+            # Una pregunta negada se parece mucho a la afirmativa pero su
+            # respuesta correcta puede ser la contraria: que responda el assistant
+            logger.info(f"↩️ FAQ descartada por negación ({score:.2f}): {faq['q']}")
+            return None
+
+        logger.info(f"⚡ FAQ respondida localmente ({score:.2f}): {faq['q']}")
+        return faq["a"]
+
+    def instructions_for(self, phone_number_id: str, text: str) -> Optional[str]:
+        """
+        Instrucciones adicionales del run con las FAQs relevantes para el
+        mensaje, o None si el assistant del tenant ya tiene las FAQs en sus
+        instrucciones, no tiene FAQs o ninguna se parece.
+        """
+        if settings.faq_retrieval_top_k <= 0:
+            return None
+        try:
+            _, _, matcher, retrieval = self._entry(phone_number_id)
+        except Exception as e:
+            logger.warning(f"⚠️ FAQs no disponibles para {phone_number_id}: {e}")
+            return None
+        if matcher is None or not retrieval:
+            return None
+
+        relevant = matcher.top_k(text, settings.faq_retrieval_top_k, settings.faq_retrieval_min_score)
+        if not relevant:
+            # El assistant no tiene las FAQs en sus instrucciones: nunca dejar
+            # un run sin ninguna, aunque ninguna supere la similitud mínima
+            relevant = matcher.top_k(text, settings.faq_retrieval_top_k)
+        if not relevant:
+            return None
+
+        instructions = "FAQs relevantes para este mensaje:\n\n"
+        for faq, _ in relevant:
+            instructions += f"P: {faq['q']}\nR: {faq['a']}\n\n"
+        return instructions.strip()
+
+
+# Instancia global (una por proceso)
+faq_registry = FAQRegistry(ttl=settings.faq_cache_ttl)
@@ -1,13 +1,34 @@
 import httpx
 import hashlib
 import hmac
-from typing import Optional
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional
 from src.core.settings import settings
 
+logger = logging.getLogger(__name__)
+
+# Sesión HTTP síncrona compartida por el proceso (keep-alive con Graph API)
+_sync_http: Optional[requests.Session] = None
+
+# Envíos en segundo plano (confirmaciones de lectura) fuera del camino crítico
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="meta-background")
+
+
+def _get_sync_http() -> requests.Session:
+    global _sync_http
+    if _sync_http is None:
+        _sync_http = requests.Session()
+    return _sync_http
+
 
 class MetaError(Exception):
     """Excepción personalizada para errores de Meta"""
-    pass
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code  # HTTP de la Graph API, si hubo respuesta
 
 
 class MetaClient:
@@ -16,6 +37,19 @@ class MetaClient:
         self.access_token = settings.meta_access_token
         self.app_secret = settings.meta_app_secret
         self.timeout = httpx.Timeout(10.0, connect=5.0)
+        self._async_http = None
+    
+    def _get_async_http(self) -> httpx.AsyncClient:
+        """Cliente HTTP asíncrono compartido (conexiones keep-alive con Graph API)"""
+        if self._async_http is None or self._async_http.is_closed:
+            self._async_http = httpx.AsyncClient(timeout=self.timeout)
+        return self._async_http
+    
+    async def aclose(self) -> None:
+        """Cerrar el cliente HTTP asíncrono compartido"""
+        if self._async_http is not None:
+            await self._async_http.aclose()
+            self._async_http = None
     
     async def register_phone_number(self, phone_number: str) -> str:
         """Registra un número de teléfono en WhatsApp Business"""
@@ -65,35 +99,47 @@ class MetaClient:
     async def send_message(self, phone_number_id: str, wa_id: str, text: str) -> None:
         """Envía un mensaje de texto a través de WhatsApp"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/{phone_number_id}/messages",
-                    headers={
-                        "Authorization": f"Bearer {self.access_token}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "messaging_product": "whatsapp",
-                        "to": wa_id,
-                        "type": "text",
-                        "text": {"body": text}
-                    }
-                )
+            response = await self._get_async_http().post(
+                f"{self.base_url}/{phone_number_id}/messages",
+                headers={
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "messaging_product": "whatsapp",
+                    "to": wa_id,
+                    "type": "text",
+                    "text": {"body": text}
+                }
+            )
+            
+            if response.status_code != 200:
+                raise MetaError(f"Error enviando mensaje: {response.text}", response.status_code)
                 
-                if response.status_code != 200:
-                    raise MetaError(f"Error enviando mensaje: {response.text}")
-                    
+        except MetaError:
+            raise
         except httpx.TimeoutException:
             raise MetaError("Timeout al enviar mensaje")
         except Exception as e:
             raise MetaError(f"Error en envío: {str(e)}")
     
+    async def send_messages(
+        self,
+        phone_number_id: str,
+        wa_id: str,
+        parts: List[str],
+        on_sent: Optional[Callable[[int], Awaitable[None]]] = None
+    ) -> None:
+        """Envía varias partes en orden por la misma conexión (ver send_messages_sync)"""
+        for index, part in enumerate(parts):
+            await self.send_message(phone_number_id, wa_id, part)
+            if on_sent:
+                await on_sent(index + 1)
+    
     def send_message_sync(self, phone_number_id: str, wa_id: str, text: str) -> None:
         """Envía un mensaje de texto a través de WhatsApp (versión síncrona)"""
-        import requests
-        
         try:
-            response = requests.post(
+            response = _get_sync_http().post(
                 f"{self.base_url}/{phone_number_id}/messages",
                 headers={
                     "Authorization": f"Bearer {self.access_token}",
@@ -109,13 +155,94 @@ class MetaClient:
             )
             
             if response.status_code != 200:
-                raise MetaError(f"Error enviando mensaje: {response.text}")
+                raise MetaError(f"Error enviando mensaje: {response.text}", response.status_code)
                 
         except requests.Timeout:
             raise MetaError("Timeout al enviar mensaje")
         except requests.RequestException as e:
             raise MetaError(f"Error en envío: {str(e)}")
     
+    def _read_receipt_payload(self, message_id: str, typing: bool) -> dict:
+        payload = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        if typing:
+            payload["typing_indicator"] = {"type": "text"}
+        return payload
+    
+    def mark_read_sync(self, phone_number_id: str, message_id: str, typing: bool = True) -> None:
+        """Marca un mensaje recibido como leído y muestra "escribiendo..." al usuario"""
+        try:
+            response = _get_sync_http().post(
+                f"{self.base_url}/{phone_number_id}/messages",
+                headers={
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json"
+                },
+                json=self._read_receipt_payload(message_id, typing),
+                timeout=5.0
+            )
+            
+            if response.status_code != 200:
+                raise MetaError(f"Error marcando como leído: {response.text}", response.status_code)
+                
+        except requests.RequestException as e:
+            raise MetaError(f"Error marcando como leído: {str(e)}")
+    
+    def mark_read_in_background(self, phone_number_id: str, message_id: str, typing: bool = True) -> None:
+        """
+        Versión fire-and-forget de mark_read_sync: no espera la respuesta y
+        los errores solo se registran (la confirmación es cosmética).
+        """
+        def run():
+            try:
+                self.mark_read_sync(phone_number_id, message_id, typing)
+            except MetaError as e:
+                logger.warning(f"⚠️ No se pudo marcar como leído {message_id}: {e}")
+        
+        _background.submit(run)
+    
+    async def mark_read(self, phone_number_id: str, message_id: str, typing: bool = True) -> None:
+        """Versión asíncrona de mark_read_sync sobre el cliente httpx compartido"""
+        try:
+            response = await self._get_async_http().post(
+                f"{self.base_url}/{phone_number_id}/messages",
+                headers={
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json"
+                },
+                json=self._read_receipt_payload(message_id, typing)
+            )
+            
+            if response.status_code != 200:
+                raise MetaError(f"Error marcando como leído: {response.text}", response.status_code)
+                
+        except MetaError:
+            raise
+        except Exception as e:
+            raise MetaError(f"Error marcando como leído: {str(e)}")
+    
+    def send_messages_sync(
+        self,
+        phone_number_id: str,
+        wa_id: str,
+        parts: List[str],
+        on_sent: Optional[Callable[[int], None]] = None
+    ) -> None:
+        """
+        Envía varias partes en orden por la misma conexión keep-alive.
+        
+        Cada parte espera a la anterior: WhatsApp no garantiza el orden de
+        mensajes enviados en paralelo. `on_sent` recibe el número de partes
+        ya entregadas tras cada envío.
+        """
+        for index, part in enumerate(parts):
+            self.send_message_sync(phone_number_id, wa_id, part)
+            if on_sent:
+                on_sent(index + 1)
+    
     def verify_webhook_signature(self, payload: bytes, signature: str) -> bool:
         """Verifica la firma del webhook de Meta"""
         expected_signature = hmac.new(
@@ -1,7 +1,16 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
 from datetime import datetime
 from typing import Optional, List
 
+# Motores de respuesta de un cliente (Client.engine)
+ENGINE_ASSISTANTS = "assistants"  # threads de OpenAI
+ENGINE_CHAT = "chat"  # Chat Completions con el historial en conversation_messages
+
+# Cómo recibe las FAQs el assistant de un cliente (Client.faq_mode)
+FAQ_EMBEDDED = "embedded"  # copiadas en las instrucciones del assistant
+FAQ_RETRIEVAL = "retrieval"  # cada run recibe solo las relevantes
+
 
 class Agent(SQLModel, table=True):
     """Modelo para agentes de WhatsApp"""
@@ -33,6 +42,25 @@ class Client(SQLModel, table=True):
     # Configuración adicional opcional
     welcome_message: Optional[str] = None
     business_hours: Optional[str] = None  # JSON string con horarios
+    faqs: Optional[str] = None  # JSON string con las FAQs [{"q": ..., "a": ...}]
+    
+    # "embedded" o "retrieval" si el assistant se generó a partir de las FAQs;
+    # None si tiene instrucciones propias (o es anterior a este campo)
+    faq_mode: Optional[str] = None
+    
+    # Motor de respuesta: "assistants" (threads de OpenAI, por defecto) o "chat"
+    # (Chat Completions con el historial en conversation_messages)
+    engine: Optional[str] = None
+    
+    # Límites de admisión en el webhook (mensajes/minuto, None = valor por defecto)
+    rate_limit_per_minute: Optional[int] = None  # Total del número de WhatsApp; None = global, 0 = sin límite
+    sender_rate_limit_per_minute: Optional[int] = None  # Por usuario (wa_id); None = global, 0 = sin límite
+    
+    # Entrega progresiva: enviar los primeros párrafos mientras se genera el resto
+    progressive_delivery: bool = Field(default=False)
+    
+    # Confirmación de lectura e indicador "escribiendo..." al recibir un mensaje
+    read_receipts: bool = Field(default=True)
     
     # Relación con threads
     threads: List["Thread"] = Relationship(back_populates="client")
@@ -41,10 +69,15 @@ class Client(SQLModel, table=True):
 class Thread(SQLModel, table=True):
     """Modelo para threads de conversación"""
     __tablename__ = "threads"
+    __table_args__ = (
+        # Una conversación por usuario y cliente/agent
+        Index("uq_threads_wa_client", "wa_id", "client_id", unique=True),
+        Index("uq_threads_wa_agent", "wa_id", "agent_id", unique=True),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     wa_id: str = Field(index=True)  # WhatsApp ID del usuario
-    thread_id: str  # OpenAI thread ID
+    thread_id: str = Field(index=True)  # OpenAI thread ID
     
     # Foreign keys
     agent_id: Optional[int] = Field(default=None, foreign_key="agents.id")
@@ -55,4 +88,51 @@ class Thread(SQLModel, table=True):
     
     # Relaciones
     agent: Optional[Agent] = Relationship(back_populates="threads")
-    client: Optional[Client] = Relationship(back_populates="threads") 
\ No newline at end of file
+    client: Optional[Client] = Relationship(back_populates="threads")
+
+
+class ConversationMessage(SQLModel, table=True):
+    """Historial local de conversación para el motor de Chat Completions"""
+    __tablename__ = "conversation_messages"
+    __table_args__ = (
+        # Últimos N mensajes de una conversación con un solo recorrido del índice
+        Index("ix_conversation_messages_conversation", "phone_number_id", "wa_id", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    phone_number_id: str  # Número de WhatsApp Business (tenant)
+    wa_id: str  # WhatsApp ID del usuario
+    role: str  # user | assistant
+    content: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ConversationSummary(SQLModel, table=True):
+    """Resumen acumulado de los turnos antiguos de una conversación larga"""
+    __tablename__ = "conversation_summaries"
+    __table_args__ = (
+        Index("ix_conversation_summaries_conversation", "phone_number_id", "wa_id", unique=True),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    phone_number_id: str  # Número de WhatsApp Business (tenant)
+    wa_id: str  # WhatsApp ID del usuario
+    summary: str
+    # Motor que escribió el resumen: el formato de summarized_until depende de él
+    engine: Optional[str] = None
+    # Último mensaje incluido en el resumen: ID de mensaje de OpenAI (threads)
+    # o de conversation_messages (motor "chat")
+    summarized_until: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class AssistantRecord(SQLModel, table=True):
+    """Assistants de OpenAI ya creados, por hash de su contenido (modelo, instrucciones, tools)"""
+    __tablename__ = "assistant_registry"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True, unique=True)  # sha256 hex
+    assistant_id: str  # ID del assistant de OpenAI
+    model: str
+    name: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
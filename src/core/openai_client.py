@@ -1,7 +1,17 @@
 import openai
-from typing import List, Dict
+from typing import List, Dict, Callable, Awaitable, Optional
 import json
+import time
+import asyncio
+import logging
 from src.core.settings import settings
+from src.core.run_latency import run_latency_model
+from src.core.assistant_registry import assistant_registry
+
+logger = logging.getLogger(__name__)
+
+# Estados de un run que todavía no han terminado
+RUN_PENDING_STATUSES = ("queued", "in_progress", "cancelling")
 
 
 class OpenAIError(Exception):
@@ -9,6 +19,25 @@ class OpenAIError(Exception):
     pass
 
 
+def build_faq_instructions(faqs: Optional[List[Dict[str, str]]] = None) -> str:
+    """
+    Instrucciones de un assistant de FAQs. Sin `faqs`, el assistant espera
+    las FAQs relevantes en las instrucciones adicionales de cada run.
+    """
+    if faqs:
+        instructions = "Eres un asistente virtual que responde preguntas basándote en las siguientes FAQs:\n\n"
+        for faq in faqs:
+            instructions += f"P: {faq['q']}\nR: {faq['a']}\n\n"
+    else:
+        instructions = (
+            "Eres un asistente virtual que responde preguntas basándote en las FAQs del negocio. "
+            "Con cada mensaje recibirás las FAQs más relevantes para esa pregunta.\n\n"
+        )
+    
+    instructions += "Responde de manera clara y concisa. Si la pregunta no está relacionada con las FAQs, indica amablemente que solo puedes responder sobre los temas incluidos."
+    return instructions
+
+
 class OpenAIClient:
     def __init__(self):
         self.client = None
@@ -23,42 +52,227 @@ class OpenAIClient:
                 default_headers={"OpenAI-Beta": "assistants=v2"}
             )
     
-    def create_assistant(self, faqs: List[Dict[str, str]]) -> str:
-        """Crea un assistant de OpenAI con las FAQs proporcionadas"""
+    def create_assistant(self, faqs: List[Dict[str, str]], embed_faqs: bool = True) -> str:
+        """
+        Crea un assistant de OpenAI con las FAQs proporcionadas.
+        
+        Con embed_faqs=False las FAQs no se copian en las instrucciones: cada
+        run recibe solo las relevantes como instrucciones adicionales.
+        """
+        # Crear contenido para el assistant
+        instructions = build_faq_instructions(faqs if embed_faqs else None)
+        return self._get_or_create_assistant(instructions, "WhatsApp Business Assistant")
+    
+    def create_assistant_with_instructions(self, instructions: str, name: str = "WhatsApp Business Assistant") -> str:
+        """Crea un assistant de OpenAI con instrucciones personalizadas"""
+        return self._get_or_create_assistant(instructions, name)
+    
+    def _get_or_create_assistant(self, instructions: str, name: str) -> str:
+        """
+        Devuelve un assistant con ese modelo e instrucciones: el ya registrado
+        en assistant_registry si existe o uno nuevo en OpenAI.
+        """
         self._ensure_client()
-        try:
-            # Crear contenido para el assistant
-            instructions = "Eres un asistente virtual que responde preguntas basándote en las siguientes FAQs:\n\n"
-            for faq in faqs:
-                instructions += f"P: {faq['q']}\nR: {faq['a']}\n\n"
-            
-            instructions += "Responde de manera clara y concisa. Si la pregunta no está relacionada con las FAQs, indica amablemente que solo puedes responder sobre los temas incluidos."
-            
-            # Crear assistant
+        model = settings.assistant_model
+        
+        def create() -> str:
             assistant = self.client.beta.assistants.create(
-                model="gpt-4o-mini",
+                model=model,
                 instructions=instructions,
-                name="WhatsApp Business Assistant"
+                name=name
             )
-            
             return assistant.id
+        
+        def exists(assistant_id: str) -> bool:
+            try:
+                self.client.beta.assistants.retrieve(assistant_id)
+                return True
+            except openai.NotFoundError:
+                return False
+        
+        try:
+            if not settings.assistant_reuse:
+                return create()
+            return assistant_registry.get_or_create(
+                model,
+                instructions,
+                name,
+                create,
+                delete=lambda assistant_id: self.client.beta.assistants.delete(assistant_id),
+                exists=exists
+            )
         except Exception as e:
             raise OpenAIError(f"Error creando assistant: {str(e)}")
     
-    def create_assistant_with_instructions(self, instructions: str, name: str = "WhatsApp Business Assistant") -> str:
-        """Crea un assistant de OpenAI con instrucciones personalizadas"""
+    def run_assistant(
+        self,
+        thread_id: str,
+        assistant_id: str,
+        on_reply: Optional[Callable[[str], None]] = None,
+        run_id: Optional[str] = None,
+        on_run_created: Optional[Callable[[str], None]] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        on_completed: Optional[Callable[[object], None]] = None,
+        **run_options
+    ) -> str:
+        """
+        Ejecuta el assistant sobre un thread y devuelve el texto de la respuesta.
+        
+        Usa streaming si está habilitado: la respuesta está disponible en cuanto
+        llega el evento de mensaje completado, sin esperar al siguiente sondeo.
+        Si el streaming falla se recurre al polling (sobre el mismo run si ya
+        se había creado).
+        
+        Args:
+            on_reply: Callback opcional que recibe el texto en cuanto el mensaje
+                del assistant está completo, antes de que el run termine de cerrarse
+            run_id: Run ya creado (p. ej. por un intento anterior) que se espera
+                en lugar de crear uno nuevo
+            on_run_created: Callback opcional con el ID del run en cuanto existe
+            on_delta: Callback opcional con cada fragmento de texto que genera el
+                assistant (solo con streaming)
+            on_completed: Callback opcional con el run completado (uso de tokens...)
+            run_options: Parámetros extra para runs.create (additional_instructions...)
+        """
         self._ensure_client()
+        started_at = time.monotonic()
+        
+        if run_id is None and settings.openai_streaming:
+            try:
+                reply = self._run_streaming(
+                    thread_id, assistant_id, on_reply, on_run_created, on_delta, on_completed, **run_options
+                )
+                run_latency_model.observe(assistant_id, time.monotonic() - started_at)
+                return reply
+            except _StreamInterrupted as e:
+                logger.warning(f"⚠️ Streaming interrumpido, continuando por polling: {e}")
+                run_id = e.run_id
+                if e.reply_delivered:
+                    # La respuesta ya se entregó; solo falta esperar al cierre del run
+                    if run_id:
+                        run = self._wait_for_run(thread_id, run_id, assistant_id, started_at)
+                        _notify_completed(on_completed, run)
+                    return e.reply
+        
+        if run_id is None:
+            run = self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                **run_options
+            )
+            run_id = run.id
+            if on_run_created:
+                on_run_created(run_id)
+        
+        run = self._wait_for_run(thread_id, run_id, assistant_id, started_at)
+        if run.status != "completed":
+            raise OpenAIError(f"Run falló con estado: {run.status}")
+        run_latency_model.observe(assistant_id, time.monotonic() - started_at)
+        
+        reply = self._latest_reply(thread_id)
+        if on_reply:
+            on_reply(reply)
+        _notify_completed(on_completed, run)
+        return reply
+    
+    def _run_streaming(
+        self,
+        thread_id: str,
+        assistant_id: str,
+        on_reply: Optional[Callable[[str], None]],
+        on_run_created: Optional[Callable[[str], None]] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        on_completed: Optional[Callable[[object], None]] = None,
+        **run_options
+    ) -> str:
+        """Ejecuta el run consumiendo sus eventos a medida que llegan"""
+        run_id = None
+        reply = None
+        callback_error = None
+        
         try:
-            # Crear assistant con instrucciones personalizadas
-            assistant = self.client.beta.assistants.create(
-                model="gpt-4o-mini",
-                instructions=instructions,
-                name=name
+            stream = self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True,
+                **run_options
             )
-            
-            return assistant.id
         except Exception as e:
-            raise OpenAIError(f"Error creando assistant: {str(e)}")
+            # No se llegó a crear el run: el polling puede empezar de cero
+            raise _StreamInterrupted(None, str(e))
+        
+        try:
+            for event in stream:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                    if on_run_created:
+                        on_run_created(run_id)
+                elif event.event == "thread.message.delta" and on_delta:
+                    fragment = _delta_text(event.data.delta)
+                    if fragment:
+                        try:
+                            on_delta(fragment)
+                        except Exception as e:
+                            callback_error = e
+                            break
+                elif event.event == "thread.message.completed" and event.data.role == "assistant":
+                    reply = event.data.content[0].text.value
+                    if on_reply:
+                        try:
+                            on_reply(reply)
+                        except Exception as e:
+                            # Un fallo al entregar no es un corte del stream
+                            callback_error = e
+                            break
+                elif event.event == "thread.run.completed":
+                    _notify_completed(on_completed, event.data)
+                    break
+                elif event.event in ("thread.run.failed", "thread.run.cancelled",
+                                     "thread.run.expired", "thread.run.incomplete",
+                                     "thread.run.requires_action"):
+                    raise OpenAIError(f"Run falló con estado: {event.data.status}")
+                elif event.event == "error":
+                    raise OpenAIError(f"Error en el stream del run: {event.data}")
+        except OpenAIError:
+            raise
+        except Exception as e:
+            if reply is not None or run_id is not None:
+                raise _StreamInterrupted(run_id, str(e), reply)
+            raise _StreamInterrupted(None, str(e))
+        finally:
+            stream.close()
+        
+        if callback_error is not None:
+            raise callback_error
+        if reply is None:
+            raise OpenAIError("No se obtuvo respuesta del assistant")
+        return reply
+    
+    def _wait_for_run(self, thread_id: str, run_id: str, assistant_id: str, started_at: float):
+        """
+        Sondea el run hasta que deja de estar pendiente.
+        
+        El intervalo entre sondeos lo decide el modelo de latencia del
+        assistant: pocos runs.retrieve al principio y densos cerca de la
+        duración habitual.
+        """
+        while True:
+            elapsed = time.monotonic() - started_at
+            time.sleep(run_latency_model.next_interval(assistant_id, elapsed))
+            run_latency_model.count_poll(assistant_id)
+            run = self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+            if run.status not in RUN_PENDING_STATUSES:
+                return run
+    
+    def _latest_reply(self, thread_id: str) -> str:
+        """Texto del mensaje más reciente del thread"""
+        messages = self.client.beta.threads.messages.list(
+            thread_id=thread_id,
+            limit=1
+        )
+        if not messages.data:
+            raise OpenAIError("No se obtuvo respuesta del assistant")
+        return messages.data[0].content[0].text.value
     
     def get_answer_with_thread(self, agent_id: str, thread_id: str, text: str) -> str:
         """Obtiene respuesta del assistant usando un thread específico"""
@@ -71,31 +285,8 @@ class OpenAIClient:
                 content=text
             )
             
-            # Ejecutar assistant
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=agent_id
-            )
-            
-            # Esperar a que termine
-            import time
-            while run.status in ["queued", "in_progress"]:
-                time.sleep(0.5)
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-            
-            if run.status == "completed":
-                # Obtener mensajes
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread_id,
-                    limit=1
-                )
-                # El primer mensaje es la respuesta más reciente
-                return messages.data[0].content[0].text.value
-            else:
-                raise OpenAIError(f"Run falló con estado: {run.status}")
+            # Ejecutar assistant y esperar la respuesta
+            return self.run_assistant(thread_id, agent_id)
                 
         except Exception as e:
             raise OpenAIError(f"Error obteniendo respuesta: {str(e)}")
@@ -123,37 +314,208 @@ class OpenAIClient:
                 content=text
             )
             
-            # Ejecutar assistant
-            run = self.client.beta.threads.runs.create(
-                thread_id=thread.id,
-                assistant_id=agent_id
-            )
-            
-            # Esperar a que termine
-            import time
-            while run.status in ["queued", "in_progress"]:
-                time.sleep(0.5)
-                run = self.client.beta.threads.runs.retrieve(
-                    thread_id=thread.id,
-                    run_id=run.id
-                )
-            
-            if run.status == "completed":
-                # Obtener mensajes
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread.id
-                )
-                # El primer mensaje es la respuesta más reciente
-                return messages.data[0].content[0].text.value
-            else:
-                raise OpenAIError(f"Run falló con estado: {run.status}")
+            # Ejecutar assistant y esperar la respuesta
+            return self.run_assistant(thread.id, agent_id)
                 
         except Exception as e:
             raise OpenAIError(f"Error obteniendo respuesta: {str(e)}")
 
 
+def _delta_text(delta) -> str:
+    """Texto de un evento thread.message.delta"""
+    return "".join(
+        part.text.value
+        for part in (delta.content or [])
+        if part.type == "text" and part.text and part.text.value
+    )
+
+
+def _notify_completed(on_completed: Optional[Callable[[object], None]], run) -> None:
+    """Pasa el run completado al callback; es informativo y nunca hace fallar la respuesta"""
+    if on_completed is None:
+        return
+    try:
+        on_completed(run)
+    except Exception as e:
+        logger.warning(f"⚠️ Error en el callback de run completado: {e}")
+
+
+class _StreamInterrupted(Exception):
+    """El stream de un run se cortó; indica qué se alcanzó a completar"""
+    
+    def __init__(self, run_id: Optional[str], message: str, reply: Optional[str] = None):
+        super().__init__(message)
+        self.run_id = run_id
+        self.reply = reply
+        self.reply_delivered = reply is not None
+
+
+class AsyncOpenAIClient:
+    """
+    Versión asíncrona del flujo de runs (AsyncOpenAI) para el worker asyncio.
+    
+    Mismo comportamiento que OpenAIClient.run_assistant: streaming con
+    respaldo por polling adaptativo, pero sin bloquear el event loop.
+    """
+    
+    def __init__(self):
+        self.client = None
+    
+    def _ensure_client(self):
+        """Inicializar el cliente de OpenAI de forma lazy"""
+        if self.client is None:
+            if not settings.openai_api_key:
+                raise OpenAIError("OPENAI_API_KEY no está configurada")
+            self.client = openai.AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                default_headers={"OpenAI-Beta": "assistants=v2"}
+            )
+    
+    async def create_thread(self) -> str:
+        """Crea un nuevo thread de conversación"""
+        self._ensure_client()
+        thread = await self.client.beta.threads.create()
+        return thread.id
+    
+    async def add_message(self, thread_id: str, text: str, role: str = "user") -> None:
+        """Añade un mensaje (del usuario por defecto) al thread"""
+        self._ensure_client()
+        await self.client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role=role,
+            content=text
+        )
+    
+    async def run_assistant(
+        self,
+        thread_id: str,
+        assistant_id: str,
+        on_reply: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_completed: Optional[Callable[[object], None]] = None,
+        run_id: Optional[str] = None,
+        on_run_created: Optional[Callable[[str], Awaitable[None]]] = None,
+        **run_options
+    ) -> str:
+        """Ejecuta el assistant y devuelve la respuesta (ver OpenAIClient.run_assistant)"""
+        self._ensure_client()
+        started_at = time.monotonic()
+        
+        if run_id is None and settings.openai_streaming:
+            try:
+                reply = await self._run_streaming(
+                    thread_id, assistant_id, on_reply, on_completed, on_run_created, **run_options
+                )
+                # observe publica en Redis (síncrono) de vez en cuando: en un hilo
+                await asyncio.to_thread(run_latency_model.observe, assistant_id, time.monotonic() - started_at)
+                return reply
+            except _StreamInterrupted as e:
+                logger.warning(f"⚠️ Streaming interrumpido, continuando por polling: {e}")
+                run_id = e.run_id
+                if e.reply_delivered:
+                    if run_id:
+                        run = await self._wait_for_run(thread_id, run_id, assistant_id, started_at)
+                        _notify_completed(on_completed, run)
+                    return e.reply
+        
+        if run_id is None:
+            run = await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                **run_options
+            )
+            run_id = run.id
+            if on_run_created:
+                await on_run_created(run_id)
+        
+        run = await self._wait_for_run(thread_id, run_id, assistant_id, started_at)
+        if run.status != "completed":
+            raise OpenAIError(f"Run falló con estado: {run.status}")
+        await asyncio.to_thread(run_latency_model.observe, assistant_id, time.monotonic() - started_at)
+        
+        messages = await self.client.beta.threads.messages.list(thread_id=thread_id, limit=1)
+        if not messages.data:
+            raise OpenAIError("No se obtuvo respuesta del assistant")
+        reply = messages.data[0].content[0].text.value
+        if on_reply:
+            await on_reply(reply)
+        _notify_completed(on_completed, run)
+        return reply
+    
+    async def _run_streaming(
+        self,
+        thread_id: str,
+        assistant_id: str,
+        on_reply: Optional[Callable[[str], Awaitable[None]]],
+        on_completed: Optional[Callable[[object], None]] = None,
+        on_run_created: Optional[Callable[[str], Awaitable[None]]] = None,
+        **run_options
+    ) -> str:
+        run_id = None
+        reply = None
+        callback_error = None
+        
+        try:
+            stream = await self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True,
+                **run_options
+            )
+        except Exception as e:
+            raise _StreamInterrupted(None, str(e))
+        
+        try:
+            async for event in stream:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                    if on_run_created:
+                        await on_run_created(run_id)
+                elif event.event == "thread.message.completed" and event.data.role == "assistant":
+                    reply = event.data.content[0].text.value
+                    if on_reply:
+                        try:
+                            await on_reply(reply)
+                        except Exception as e:
+                            callback_error = e
+                            break
+                elif event.event == "thread.run.completed":
+                    _notify_completed(on_completed, event.data)
+                    break
+                elif event.event in ("thread.run.failed", "thread.run.cancelled",
+                                     "thread.run.expired", "thread.run.incomplete",
+                                     "thread.run.requires_action"):
+                    raise OpenAIError(f"Run falló con estado: {event.data.status}")
+                elif event.event == "error":
+                    raise OpenAIError(f"Error en el stream del run: {event.data}")
+        except OpenAIError:
+            raise
+        except Exception as e:
+            if reply is not None or run_id is not None:
+                raise _StreamInterrupted(run_id, str(e), reply)
+            raise _StreamInterrupted(None, str(e))
+        finally:
+            await stream.close()
+        
+        if callback_error is not None:
+            raise callback_error
+        if reply is None:
+            raise OpenAIError("No se obtuvo respuesta del assistant")
+        return reply
+    
+    async def _wait_for_run(self, thread_id: str, run_id: str, assistant_id: str, started_at: float):
+        """Sondea el run con los intervalos del modelo de latencia"""
+        while True:
+            elapsed = time.monotonic() - started_at
+            await asyncio.sleep(run_latency_model.next_interval(assistant_id, elapsed))
+            run_latency_model.count_poll(assistant_id)
+            run = await self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+            if run.status not in RUN_PENDING_STATUSES:
+                return run
+
+
 # Instancia global (lazy initialization)
 _openai_client = None
+_async_openai_client = None
 
 def get_openai_client() -> OpenAIClient:
     """Obtener la instancia global del cliente OpenAI (lazy initialization)"""
@@ -163,9 +525,17 @@ def get_openai_client() -> OpenAIClient:
     return _openai_client
 
 
+def get_async_openai_client() -> AsyncOpenAIClient:
+    """Obtener la instancia global del cliente asíncrono de OpenAI"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = AsyncOpenAIClient()
+    return _async_openai_client
+
+
 # Funciones de conveniencia
-def create_assistant(faqs: List[Dict[str, str]]) -> str:
-    return get_openai_client().create_assistant(faqs)
+def create_assistant(faqs: List[Dict[str, str]], embed_faqs: bool = True) -> str:
+    return get_openai_client().create_assistant(faqs, embed_faqs)
 
 
 def create_assistant_with_instructions(instructions: str, name: str = "WhatsApp Business Assistant") -> str:
@@ -0,0 +1,103 @@
+"""
+Entrega progresiva de respuestas en streaming.
+
+Con un run en streaming, el primer párrafo completo puede enviarse a
+WhatsApp mientras el modelo sigue escribiendo el resto. ProgressiveReply
+acumula los fragmentos (deltas) y envía un trozo cada vez que encuentra un
+corte natural (párrafo o, si el texto se alarga, final de frase) que:
+
+- deja al menos `min_chars` caracteres, para no saturar al usuario con
+  mensajes diminutos;
+- no parte un formato (negrita, cursiva, bloque de código) ni una cita
+  `【...】` que format_for_whatsapp todavía tiene que limpiar.
+
+Cada trozo pasa por format_for_whatsapp por separado. Al completarse el
+mensaje, `finish` envía lo que quede.
+"""
+
+import re
+from typing import Callable, List, Optional
+
+from src.core.whatsapp_text import MAX_PART_LENGTH, format_for_whatsapp, split_message, open_markers
+
+_PARAGRAPH_END = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _is_safe_cut(segment: str) -> bool:
+    """El trozo puede formatearse y enviarse por separado"""
+    if segment.count("**") % 2 or segment.count("【") != segment.count("】"):
+        return False
+    return not open_markers(format_for_whatsapp(segment))
+
+
+class ProgressiveReply:
+    def __init__(
+        self,
+        send: Callable[[str], None],
+        min_chars: int = 280,
+        offset: int = 0,
+        on_progress: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Args:
+            send: Envía un mensaje ya formateado a WhatsApp
+            min_chars: Tamaño mínimo de un trozo enviado antes del final
+            offset: Caracteres del texto original ya entregados (reanudación)
+            on_progress: Recibe el nuevo offset tras cada envío
+        """
+        self.send = send
+        self.min_chars = min_chars
+        self.offset = offset
+        self.on_progress = on_progress
+        self.sent: List[str] = []
+        self._text = ""
+
+    def feed(self, fragment: str) -> None:
+        """Añade un delta y envía el trozo pendiente si ya hay un buen corte"""
+        self._text += fragment
+        cut = self._find_cut()
+        if cut is not None:
+            self._emit(self._text[self.offset:cut], cut)
+
+    def finish(self, full_text: str) -> str:
+        """
+        Envía lo que falta del mensaje completo y devuelve la respuesta
+        formateada entera (lo que vería el usuario).
+        """
+        self._text = full_text
+        rest = full_text[self.offset:]
+        if rest.strip():
+            self._emit(rest, len(full_text))
+        return format_for_whatsapp(full_text)
+
+    def _find_cut(self) -> Optional[int]:
+        pending = self._text[self.offset:]
+        if len(pending) < self.min_chars:
+            return None
+
+        # Preferir el último final de párrafo; con mucho texto sin párrafos,
+        # conformarse con un final de frase
+        patterns = [_PARAGRAPH_END]
+        if len(pending) >= MAX_PART_LENGTH // 2:
+            patterns.append(_SENTENCE_END)
+
+        for pattern in patterns:
+            ends = [m.end() for m in pattern.finditer(pending)]
+            for end in reversed(ends):
+                segment = pending[:end]
+                if len(segment.strip()) < self.min_chars:
+                    break
+                if _is_safe_cut(segment):
+                    return self.offset + end
+        return None
+
+    def _emit(self, segment: str, new_offset: int) -> None:
+        text = format_for_whatsapp(segment)
+        for part in split_message(text):
+            if part:
+                self.send(part)
+                self.sent.append(part)
+        self.offset = new_offset
+        if self.on_progress:
+            self.on_progress(new_offset)
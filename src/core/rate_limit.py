@@ -0,0 +1,107 @@
+"""
+Control de admisión con token buckets en el webhook.
+
+Cada mensaje cuesta una ejecución en OpenAI, así que un remitente en bucle o
+un número desbocado no debe poder llenar la cola del resto de tenants. Se
+aplican dos buckets antes de encolar: uno por phone_number_id del cliente y
+otro por wa_id. La capacidad es el límite por minuto y se rellena de forma
+continua. Con `rate_limit_backend = "redis"` los contadores se comparten
+entre réplicas; si Redis falla se usan los locales.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = bucket, ARGV = capacidad, tokens/segundo, ahora (s)
+_REDIS_TOKEN_BUCKET = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+
+class TokenBucketLimiter:
+    def __init__(self, backend: str = "memory", max_buckets: int = 100000):
+        self.backend = backend
+        self.max_buckets = max_buckets
+        # clave -> (tokens, actualizado_en)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def _allow_local(self, key: str, limit_per_minute: int) -> bool:
+        now = time.monotonic()
+        rate = limit_per_minute / 60.0
+
+        tokens, updated = self._buckets.pop(key, (float(limit_per_minute), now))
+        tokens = min(float(limit_per_minute), tokens + (now - updated) * rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        # Reinsertar al final (LRU) y acotar el número de buckets
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+
+        return allowed
+
+    async def allow(self, key: str, limit_per_minute: Optional[int]) -> bool:
+        """Consume un token del bucket; un límite vacío o 0 desactiva el control"""
+        if not limit_per_minute or limit_per_minute <= 0:
+            return True
+
+        if self.backend == "redis":
+            try:
+                from src.core.redis_client import get_async_redis
+                allowed = await get_async_redis().eval(
+                    _REDIS_TOKEN_BUCKET, 1, f"ratelimit:{key}",
+                    limit_per_minute, limit_per_minute / 60.0, time.time()
+                )
+                return bool(allowed)
+            except Exception as e:
+                logger.warning(f"⚠️ Rate limit en Redis no disponible: {e}")
+
+        return self._allow_local(key, limit_per_minute)
+
+
+# Instancia global
+rate_limiter = TokenBucketLimiter(backend=settings.rate_limit_backend)
+
+
+async def admit_message(route, wa_id: str) -> bool:
+    """
+    Aplica los límites por remitente y por número del tenant.
+
+    El bucket del remitente se consulta primero para que un usuario
+    bloqueado no consuma capacidad del tenant.
+    """
+    # None hereda el límite global; 0 en el cliente es "sin límite", no "por defecto"
+    sender_limit = route.sender_rate_limit_per_minute
+    if sender_limit is None:
+        sender_limit = settings.sender_rate_limit_per_minute
+    tenant_limit = route.rate_limit_per_minute
+    if tenant_limit is None:
+        tenant_limit = settings.tenant_rate_limit_per_minute
+
+    if not await rate_limiter.allow(f"sender:{route.phone_number_id}:{wa_id}", sender_limit):
+        return False
+
+    return await rate_limiter.allow(f"tenant:{route.phone_number_id}", tenant_limit)
@@ -0,0 +1,44 @@
+"""
+Clientes Redis compartidos (inicialización lazy).
+
+Redis es opcional: los módulos que lo usan deben degradar a memoria local
+si no está configurado o no responde.
+"""
+
+import logging
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+_async_redis = None
+
+
+def get_redis():
+    """Cliente Redis síncrono (workers de Celery)"""
+    global _redis
+    if _redis is None:
+        if not settings.redis_url:
+            raise RuntimeError("REDIS_URL no está configurada")
+        import redis
+        _redis = redis.Redis.from_url(
+            settings.redis_url,
+            socket_timeout=2.0,
+            socket_connect_timeout=2.0
+        )
+    return _redis
+
+
+def get_async_redis():
+    """Cliente Redis asíncrono (endpoints de FastAPI)"""
+    global _async_redis
+    if _async_redis is None:
+        if not settings.redis_url:
+            raise RuntimeError("REDIS_URL no está configurada")
+        import redis.asyncio as aioredis
+        _async_redis = aioredis.Redis.from_url(
+            settings.redis_url,
+            socket_timeout=2.0,
+            socket_connect_timeout=2.0
+        )
+    return _async_redis
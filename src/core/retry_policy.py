@@ -0,0 +1,85 @@
+"""
+Clasificación de errores y backoff exponencial con jitter para reintentos.
+
+- permanent: reintentar no cambia el resultado (credenciales, petición
+  inválida, recurso inexistente). No se reintenta.
+- rate_limit: OpenAI o Meta piden bajar el ritmo. Base de espera mayor.
+- transient: timeouts, errores de conexión y 5xx. Base de espera corta.
+  También los conflictos de estado de OpenAI (409, o 400 "Can't add messages
+  to thread ... while a run ... is active"): se resuelven solos cuando
+  termina el run en curso.
+"""
+
+import random
+from typing import Optional
+
+import openai
+
+from src.core.meta_client import MetaError
+from src.core.settings import settings
+
+PERMANENT = "permanent"
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+
+_OPENAI_PERMANENT = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+    openai.BadRequestError,
+    openai.UnprocessableEntityError,
+)
+
+# Mensajes de los 400 que indican un run activo en el thread, no una petición inválida
+_ACTIVE_RUN_MARKERS = ("while a run", "is active", "already has an active run")
+
+
+def _is_state_conflict(error: BaseException) -> bool:
+    if isinstance(error, openai.ConflictError):
+        return True
+    if isinstance(error, openai.BadRequestError):
+        message = str(getattr(error, "message", "") or error).lower()
+        return any(marker in message for marker in _ACTIVE_RUN_MARKERS)
+    return False
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    if isinstance(error, MetaError):
+        return error.status_code
+    return getattr(error, "status_code", None)
+
+
+def classify_error(error: BaseException) -> str:
+    """Clasifica un error (o el primero clasificable de su cadena de causas)"""
+    current = error
+    while current is not None:
+        if isinstance(current, openai.RateLimitError):
+            return RATE_LIMIT
+        if _is_state_conflict(current):
+            return TRANSIENT
+        if isinstance(current, _OPENAI_PERMANENT):
+            return PERMANENT
+
+        status = _status_code(current)
+        if status == 429:
+            return RATE_LIMIT
+        if status is not None and 400 <= status < 500:
+            return PERMANENT
+        if status is not None:
+            return TRANSIENT
+
+        current = current.__cause__ or current.__context__
+    return TRANSIENT
+
+
+def backoff_delay(kind: str, attempt: int) -> float:
+    """
+    Segundos hasta el reintento `attempt` (0 = primer reintento).
+
+    Exponencial sobre la base de cada tipo, con tope y "equal jitter": la
+    mitad de la espera es fija y la otra mitad aleatoria, para que los
+    reintentos de muchos mensajes fallidos a la vez no lleguen juntos.
+    """
+    base = settings.retry_rate_limit_base_seconds if kind == RATE_LIMIT else settings.retry_base_seconds
+    delay = min(settings.retry_max_backoff_seconds, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
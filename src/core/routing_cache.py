@@ -0,0 +1,153 @@
+"""
+Caché en memoria de rutas de tenant: phone_number_id -> assistant de OpenAI.
+
+Evita consultar Postgres en cada POST a /webhook. Las entradas expiran tras
+`settings.routing_cache_ttl` segundos y se invalidan explícitamente cuando
+la API de clientes crea, modifica o elimina un cliente. Con varias réplicas
+web, la invalidación es local a cada proceso y el TTL acota la inconsistencia.
+"""
+
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from sqlmodel import select
+
+from src.core.models import Agent, Client
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TenantRoute:
+    """Destino de los mensajes de un phone_number_id"""
+    assistant_id: str
+    phone_number_id: str
+    client_id: Optional[int] = None
+    source: str = "client"  # client | agent | default
+    rate_limit_per_minute: Optional[int] = None
+    sender_rate_limit_per_minute: Optional[int] = None
+    progressive_delivery: bool = False
+    read_receipts: bool = True
+    engine: Optional[str] = None  # None = assistants (threads)
+
+
+class TenantRoutingCache:
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # phone_number_id -> (expira_en, ruta). Una ruta None es un negativo cacheado.
+        self._routes: Dict[str, Tuple[float, Optional[TenantRoute]]] = {}
+
+    def get(self, phone_number_id: str) -> Tuple[bool, Optional[TenantRoute]]:
+        """Devuelve (hit, ruta) sin tocar la base de datos"""
+        entry = self._routes.get(phone_number_id)
+        if entry is None:
+            return False, None
+
+        expires_at, route = entry
+        if expires_at < time.monotonic():
+            self._routes.pop(phone_number_id, None)
+            return False, None
+
+        return True, route
+
+    def set(self, phone_number_id: str, route: Optional[TenantRoute]) -> None:
+        """Guarda una ruta (o un negativo) con el TTL configurado"""
+        if len(self._routes) >= self.max_entries:
+            self._evict_expired()
+            if len(self._routes) >= self.max_entries:
+                self._routes.clear()
+
+        self._routes[phone_number_id] = (time.monotonic() + self.ttl, route)
+
+    def invalidate(self, phone_number_id: Optional[str] = None) -> None:
+        """Invalida una ruta concreta o toda la caché"""
+        if phone_number_id is None:
+            self._routes.clear()
+        else:
+            self._routes.pop(phone_number_id, None)
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._routes.items() if expires_at < now]:
+            self._routes.pop(key, None)
+
+    async def resolve(self, phone_number_id: str, session=None) -> Optional[TenantRoute]:
+        """
+        Resuelve la ruta de un phone_number_id.
+
+        Solo en un fallo de caché se abre una sesión de base de datos (o se
+        usa la recibida). Orden de búsqueda (igual que el webhook original):
+        1. Cliente activo en la tabla clients
+        2. Agent (compatibilidad hacia atrás)
+        3. Assistant por defecto de las variables de entorno
+        """
+        hit, route = self.get(phone_number_id)
+        if hit:
+            return route
+
+        if session is None:
+            from src.core.database import get_async_session
+            async with get_async_session() as session:
+                return await self._load(session, phone_number_id)
+
+        return await self._load(session, phone_number_id)
+
+    async def _load(self, session, phone_number_id: str) -> Optional[TenantRoute]:
+        """Consulta la ruta en la base de datos y la guarda en caché"""
+        route = None
+
+        result = await session.execute(
+            select(Client).where(
+                Client.phone_number_id == phone_number_id,
+                Client.active == True
+            )
+        )
+        client = result.scalar_one_or_none()
+
+        if client:
+            route = TenantRoute(
+                assistant_id=client.assistant_id,
+                phone_number_id=client.phone_number_id,
+                client_id=client.id,
+                source="client",
+                rate_limit_per_minute=client.rate_limit_per_minute,
+                sender_rate_limit_per_minute=client.sender_rate_limit_per_minute,
+                progressive_delivery=bool(client.progressive_delivery),
+                # Las filas anteriores a la columna (NULL) mantienen el valor por defecto
+                read_receipts=client.read_receipts is not False,
+                engine=client.engine
+            )
+        else:
+            result = await session.execute(
+                select(Agent).where(Agent.phone_number_id == phone_number_id)
+            )
+            agent = result.scalar_one_or_none()
+
+            if agent:
+                route = TenantRoute(
+                    assistant_id=agent.agent_id,
+                    phone_number_id=agent.phone_number_id,
+                    source="agent"
+                )
+            elif settings.openai_assistant_id:
+                route = TenantRoute(
+                    assistant_id=settings.openai_assistant_id,
+                    phone_number_id=phone_number_id,
+                    source="default"
+                )
+
+        self.set(phone_number_id, route)
+        logger.info(f"🗺️  Ruta cacheada para {phone_number_id}: {route.source if route else 'sin destino'}")
+        return route
+
+
+# Instancia global
+routing_cache = TenantRoutingCache(ttl=settings.routing_cache_ttl)
+
+
+def invalidate_route(phone_number_id: Optional[str] = None) -> None:
+    routing_cache.invalidate(phone_number_id)
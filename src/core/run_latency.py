@@ -0,0 +1,174 @@
+"""
+Modelo de latencia de runs por assistant para el polling adaptativo.
+
+Guarda una ventana móvil con la duración de los últimos runs de cada
+assistant_id y decide cuánto esperar antes del siguiente runs.retrieve:
+poco sondeo al principio del run, sondeo denso alrededor de la duración
+esperada y espaciado progresivo si el run se alarga más de lo habitual.
+
+Cada proceso worker publica su histograma en el hash de Redis
+`metrics:run_latency` (un campo por proceso, como mucho cada
+`publish_interval` segundos); la API lo sirve en GET /metrics/run-latency.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets del histograma exportado
+LATENCY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 60)
+
+METRICS_KEY = "metrics:run_latency"
+# Un proceso que deja de publicar desaparece de las métricas pasado este tiempo
+METRICS_TTL = 3600
+
+
+class RunLatencyModel:
+    def __init__(
+        self,
+        window: int = 200,
+        min_samples: int = 5,
+        min_interval: float = 0.25,
+        max_interval: float = 2.0,
+        default_interval: float = 0.5,
+        log_every: int = 100,
+        publish_interval: float = 60.0
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self._samples: Dict[str, Deque[float]] = {}
+        self._polls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.log_every = log_every
+        self.publish_interval = publish_interval
+        # Runs observados desde el arranque (las ventanas se llenan y dejan de crecer)
+        self._runs = 0
+        self._published_at = 0.0
+
+    def observe(self, assistant_id: str, duration: float) -> None:
+        """Registra la duración de un run terminado"""
+        with self._lock:
+            samples = self._samples.setdefault(assistant_id, deque(maxlen=self.window))
+            samples.append(duration)
+            self._runs += 1
+            runs = self._runs
+            publish = time.monotonic() - self._published_at >= self.publish_interval
+            if publish:
+                self._published_at = time.monotonic()
+
+        if runs % self.log_every == 0:
+            logger.info(f"⏱️ Latencia de runs: {self.snapshot()}")
+        if publish:
+            self.publish()
+
+    def publish(self) -> None:
+        """Publica el histograma de este proceso en Redis para la API de métricas"""
+        try:
+            from src.core.redis_client import get_redis
+            pipe = get_redis().pipeline()
+            pipe.hset(METRICS_KEY, f"{socket.gethostname()}:{os.getpid()}", json.dumps({
+                "updated_at": time.time(),
+                "assistants": self.snapshot()
+            }))
+            pipe.expire(METRICS_KEY, METRICS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron publicar las métricas de latencia: {e}")
+
+    def count_poll(self, assistant_id: str) -> None:
+        with self._lock:
+            self._polls[assistant_id] = self._polls.get(assistant_id, 0) + 1
+
+    def quantile(self, assistant_id: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(assistant_id, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+    def next_interval(self, assistant_id: str, elapsed: float) -> float:
+        """Segundos a esperar antes del siguiente sondeo de un run en curso"""
+        with self._lock:
+            has_model = len(self._samples.get(assistant_id, ())) >= self.min_samples
+        if not has_model:
+            return self.default_interval
+
+        p10 = self.quantile(assistant_id, 0.10)
+        p90 = self.quantile(assistant_id, 0.90)
+
+        if elapsed < p10:
+            # Demasiado pronto: dormir hasta el inicio de la zona probable
+            interval = p10 - elapsed
+        elif elapsed < p90:
+            # Zona de finalización esperada: sondeo denso
+            interval = self.min_interval
+        else:
+            # Run más lento de lo normal: espaciar según el retraso acumulado
+            interval = (elapsed - p90) / 2
+
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def snapshot(self) -> Dict:
+        """Histograma y cuantiles por assistant, serializable como métricas"""
+        labels = [f"le_{upper}s" for upper in LATENCY_BUCKETS] + ["inf"]
+        with self._lock:
+            items = {aid: list(samples) for aid, samples in self._samples.items()}
+            polls = dict(self._polls)
+
+        metrics = {}
+        for assistant_id, samples in items.items():
+            buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            for duration in samples:
+                for i, upper in enumerate(LATENCY_BUCKETS):
+                    if duration <= upper:
+                        buckets[i] += 1
+                        break
+                else:
+                    buckets[-1] += 1
+
+            metrics[assistant_id] = {
+                "runs": len(samples),
+                "polls": polls.get(assistant_id, 0),
+                "p50": self.quantile(assistant_id, 0.50),
+                "p90": self.quantile(assistant_id, 0.90),
+                "histogram": dict(zip(labels, buckets))
+            }
+        return metrics
+
+
+def merge_published(raw: Dict) -> Dict:
+    """
+    Agrega los histogramas publicados por los workers (hash de Redis) por
+    assistant. Los cuantiles no se pueden sumar: se mantienen por worker.
+    """
+    now = time.time()
+    workers = {}
+    assistants: Dict[str, Dict] = {}
+    for worker, payload in raw.items():
+        worker = worker.decode() if isinstance(worker, bytes) else worker
+        data = json.loads(payload)
+        if now - data.get("updated_at", 0) > METRICS_TTL:
+            continue
+        workers[worker] = data
+        for assistant_id, metrics in data["assistants"].items():
+            total = assistants.setdefault(assistant_id, {"runs": 0, "polls": 0, "histogram": {}})
+            total["runs"] += metrics["runs"]
+            total["polls"] += metrics["polls"]
+            for bucket, count in metrics["histogram"].items():
+                total["histogram"][bucket] = total["histogram"].get(bucket, 0) + count
+    return {"assistants": assistants, "workers": workers}
+
+
+# Instancia global (una por proceso worker)
+run_latency_model = RunLatencyModel()
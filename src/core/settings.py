@@ -18,6 +18,7 @@ class Settings(BaseSettings):
     # OpenAI settings
     openai_api_key: Optional[str] = None
     openai_assistant_id: Optional[str] = None
+    openai_streaming: bool = True  # Runs en streaming; polling solo como respaldo
     
     # Database settings (Railway proporciona DATABASE_URL)
     database_url: Optional[str] = None
@@ -44,6 +45,56 @@ class Settings(BaseSettings):
     celery_broker_url: Optional[str] = None
     celery_result_backend: Optional[str] = None
     
+    # Webhook settings
+    routing_cache_ttl: int = 300  # Segundos que se cachea phone_number_id -> assistant
+    dedup_backend: str = "memory"  # memory | redis (compartido entre réplicas)
+    dedup_ttl: int = 86400  # Segundos que se recuerda un message_id
+    dedup_max_entries: int = 50000
+    status_stats_enabled: bool = False  # Contar callbacks sent/delivered/read en memoria
+    rate_limit_backend: str = "memory"  # memory | redis (compartido entre réplicas)
+    tenant_rate_limit_per_minute: int = 600  # Por phone_number_id; 0 = sin límite
+    sender_rate_limit_per_minute: int = 20  # Por wa_id; 0 = sin límite
+    spool_path: str = "data/spool/webhook.jsonl"  # Spool en disco si el broker cae
+    spool_drain_interval: float = 5.0
+    spool_broker_cooldown_seconds: float = 10.0  # Tiempo sin intentar publicar tras un fallo
+    
+    # Worker settings
+    worker_mode: str = "celery"  # celery | async (python -m src.async_worker)
+    async_worker_queue: str = "whatsapp:async-jobs"
+    async_worker_concurrency: int = 200  # Runs simultáneos por proceso en modo async
+    async_worker_max_retries: int = 3
+    thread_cache_size: int = 10000  # Entradas LRU conversación -> thread por worker
+    thread_cache_redis: bool = True  # Compartir la caché de threads en un hash de Redis
+    thread_cache_redis_ttl: int = 604800  # Vida del hash de Redis de un número desde su última escritura
+    thread_cache_redis_max_fields: int = 50000  # Conversaciones por número antes de vaciar el hash
+    thread_touch_flush_seconds: float = 5.0  # Volcado periódico de last_message_at
+    thread_touch_max_batch: int = 500  # Threads por UPDATE antes de volcar anticipadamente
+    coalesce_window_seconds: float = 0  # 0 = sin agrupación; requiere Redis
+    coalesce_max_wait_seconds: float = 10  # Espera máxima desde el primer mensaje
+    conversation_lease_seconds: int = 180  # Duración máxima del lease por conversación
+    conversation_lease_wait_seconds: float = 30  # Espera por el lease antes de reencolar
+    conversation_lease_retry_seconds: int = 2
+    task_checkpoint_ttl: int = 86400  # Vida de los checkpoints de una tarea en Redis
+    retry_base_seconds: float = 5  # Base del backoff para errores transitorios
+    retry_rate_limit_base_seconds: float = 20  # Base del backoff ante rate limits (429)
+    retry_max_backoff_seconds: float = 300
+    progressive_min_chars: int = 280  # Tamaño mínimo de cada envío en la entrega progresiva
+    faq_match_threshold: float = 0.85  # Similitud mínima para responder una FAQ sin OpenAI
+    faq_cache_ttl: int = 300  # Segundos antes de recargar las FAQs de un tenant
+    # Modo de FAQs por defecto de los clientes nuevos (Client.faq_mode): con la
+    # recuperación, el assistant se crea sin las FAQs en las instrucciones y cada
+    # run recibe solo las relevantes. Desactivada, las FAQs van en las instrucciones
+    faq_retrieval_enabled: bool = False
+    faq_retrieval_top_k: int = 5  # FAQs relevantes por run
+    faq_retrieval_min_score: float = 0.1  # Similitud mínima para incluir una FAQ en el run
+    chat_history_messages: int = 30  # Mensajes de historial por llamada (motor "chat")
+    assistant_config_ttl: int = 3600  # Caché de modelo e instrucciones del assistant
+    context_token_budget: int = 6000  # Tokens de contexto antes de resumir los turnos antiguos (0 = desactivado)
+    context_keep_messages: int = 10  # Mensajes recientes que se envían siempre completos
+    summary_model: str = "gpt-4o-mini"  # Modelo que resume los turnos antiguos
+    assistant_model: str = "gpt-4o-mini"  # Modelo de los assistants creados al dar de alta clientes
+    assistant_reuse: bool = True  # Reutilizar assistants con el mismo contenido (assistant_registry)
+    
     # Resend settings
     resend_api_key: Optional[str] = None
     
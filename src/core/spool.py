@@ -0,0 +1,158 @@
+"""
+Spool local en disco para cuando el broker de Celery no está disponible.
+
+Si publicar en Redis falla, el webhook escribe los jobs en un fichero JSONL
+de solo-añadir (con fsync) y responde a Meta sin esperar. Un drenador en
+segundo plano los republica cuando el broker se recupera. Mientras el broker
+está marcado como caído, el webhook va directo al spool sin intentar
+publicar, para que la latencia de entrada no dependa de timeouts de Redis.
+
+Varios procesos (workers de uvicorn, réplicas con el mismo volumen)
+comparten el fichero, así que la exclusión es con flock y no con un lock
+de hilo:
+- `{path}.lock` serializa las escrituras y el renombrado a `.draining`
+  (una escritura nunca acaba en un fichero que ya se está drenando);
+- `{path}.drain.lock` garantiza un solo drenador: los demás procesos se
+  saltan la vuelta en lugar de republicar los mismos jobs.
+"""
+
+import os
+import json
+import time
+import fcntl
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerHealth:
+    """Circuit breaker sencillo para la publicación en el broker"""
+
+    def __init__(self, cooldown: float = 10.0):
+        self.cooldown = cooldown
+        self._unhealthy_until = 0.0
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self._unhealthy_until
+
+    def mark_failure(self) -> None:
+        self._unhealthy_until = time.monotonic() + self.cooldown
+
+    def mark_success(self) -> None:
+        self._unhealthy_until = 0.0
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """
+    Lock exclusivo entre procesos (flock). Sin bloqueo, devuelve False si
+    otro proceso lo tiene.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class MessageSpool:
+    def __init__(self, path: str):
+        self.path = path
+        self.draining_path = f"{path}.draining"
+        self.lock_path = f"{path}.lock"
+        self.drain_lock_path = f"{path}.drain.lock"
+
+    def append(self, jobs: List[Dict]) -> None:
+        """Añade jobs al spool de forma durable (bloqueante: llamar fuera del event loop)"""
+        if not jobs:
+            return
+
+        lines = "".join(json.dumps(job, ensure_ascii=False) + "\n" for job in jobs)
+        with _file_lock(self.lock_path):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+        logger.warning(f"💾 {len(jobs)} mensaje(s) guardados en el spool local")
+
+    def has_pending(self) -> bool:
+        return os.path.exists(self.draining_path) or (
+            os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        )
+
+    def drain(self, publish: Callable[[List[Dict]], None], batch_size: int = 100) -> int:
+        """
+        Republica el contenido del spool.
+
+        El fichero se renombra antes de leerlo, así los webhooks concurrentes
+        siguen escribiendo en uno nuevo. Si la publicación falla, lo no
+        publicado se devuelve al spool y la excepción se propaga. Si otro
+        proceso está drenando, no hace nada.
+
+        Returns:
+            Número de jobs republicados
+        """
+        with _file_lock(self.drain_lock_path, blocking=False) as acquired:
+            if not acquired:
+                return 0
+            return self._drain(publish, batch_size)
+
+    def _drain(self, publish: Callable[[List[Dict]], None], batch_size: int) -> int:
+        with _file_lock(self.lock_path):
+            # Un .draining previo indica un drenado interrumpido: se retoma primero
+            if not os.path.exists(self.draining_path):
+                if not os.path.exists(self.path):
+                    return 0
+                os.replace(self.path, self.draining_path)
+
+        with open(self.draining_path, encoding="utf-8") as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+
+        published = 0
+        try:
+            for start in range(0, len(jobs), batch_size):
+                publish(jobs[start:start + batch_size])
+                published = start + len(jobs[start:start + batch_size])
+        except Exception:
+            self.append(jobs[published:])
+            os.remove(self.draining_path)
+            raise
+
+        os.remove(self.draining_path)
+        return published
+
+
+# Instancias globales
+broker_health = BrokerHealth(cooldown=settings.spool_broker_cooldown_seconds)
+message_spool = MessageSpool(settings.spool_path)
+
+
+async def run_spool_drainer(publish: Callable[[List[Dict]], None], interval: float) -> None:
+    """Bucle en segundo plano que vacía el spool cuando el broker responde"""
+    while True:
+        await asyncio.sleep(interval)
+
+        if not message_spool.has_pending():
+            continue
+
+        try:
+            count = await asyncio.to_thread(message_spool.drain, publish)
+            broker_health.mark_success()
+            if count:
+                logger.info(f"📤 {count} mensaje(s) del spool republicados")
+        except Exception as e:
+            broker_health.mark_failure()
+            logger.warning(f"⚠️ Broker aún no disponible para drenar el spool: {e}")
@@ -0,0 +1,175 @@
+"""
+Caché LRU en el worker: (phone_number_id, assistant_id, wa_id) -> thread_id.
+
+Tras el primer mensaje la relación conversación -> thread de OpenAI no
+cambia, así que las conversaciones repetidas no necesitan consultar
+Postgres. Cada proceso worker tiene su LRU acotado y, si Redis está
+disponible, un hash compartido por número (`thread_cache:{phone_number_id}`)
+para que un worker nuevo no empiece en frío.
+
+Solo se invalida al resetear un thread (scripts/manage_clients.py
+reset-thread) o desactivar/eliminar un cliente (API y manage_clients.py):
+se publica el phone_number_id en el canal `thread_cache:invalidate` y cada
+worker limpia sus entradas locales.
+
+El hash de Redis caduca a los `thread_cache_redis_ttl` segundos de su última
+escritura y se vacía si supera `thread_cache_redis_max_fields` conversaciones:
+es solo una caché y Postgres sigue siendo la fuente de verdad.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "thread_cache:invalidate"
+
+
+def _redis_key(phone_number_id: str) -> str:
+    return f"thread_cache:{phone_number_id}"
+
+
+def _redis_field(assistant_id: str, wa_id: str) -> str:
+    return f"{assistant_id}:{wa_id}"
+
+
+class ThreadCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        use_redis: bool = True,
+        redis_ttl: int = 604800,
+        redis_max_fields: int = 50000
+    ):
+        self.max_entries = max_entries
+        self.use_redis = use_redis
+        self.redis_ttl = redis_ttl
+        self.redis_max_fields = redis_max_fields
+        self._entries: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, phone_number_id: str, assistant_id: str, wa_id: str) -> Optional[str]:
+        key = (phone_number_id, assistant_id, wa_id)
+        with self._lock:
+            thread_id = self._entries.get(key)
+            if thread_id:
+                self._entries.move_to_end(key)
+                return thread_id
+
+        if not self.use_redis:
+            return None
+
+        try:
+            from src.core.redis_client import get_redis
+            raw = get_redis().hget(_redis_key(phone_number_id), _redis_field(assistant_id, wa_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Caché de threads en Redis no disponible: {e}")
+            return None
+
+        if raw:
+            thread_id = raw.decode()
+            self._set_local(key, thread_id)
+            return thread_id
+        return None
+
+    def set(self, phone_number_id: str, assistant_id: str, wa_id: str, thread_id: str) -> None:
+        self._set_local((phone_number_id, assistant_id, wa_id), thread_id)
+
+        if self.use_redis:
+            try:
+                from src.core.redis_client import get_redis
+                key = _redis_key(phone_number_id)
+                pipe = get_redis().pipeline()
+                pipe.hset(key, _redis_field(assistant_id, wa_id), thread_id)
+                pipe.expire(key, self.redis_ttl)
+                pipe.hlen(key)
+                size = pipe.execute()[-1]
+                if size > self.redis_max_fields:
+                    # Los campos de un hash no caducan por separado: se vacía entero
+                    get_redis().delete(key)
+                    logger.info(f"🧹 Caché de threads de {phone_number_id} vaciada ({size} conversaciones)")
+            except Exception as e:
+                logger.warning(f"⚠️ Caché de threads en Redis no disponible: {e}")
+
+    def _set_local(self, key: Tuple[str, str, str], thread_id: str) -> None:
+        with self._lock:
+            self._entries[key] = thread_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_local(self, phone_number_id: str, wa_id: Optional[str] = None) -> None:
+        """Elimina las entradas locales de un número (o de una conversación)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == phone_number_id and (wa_id is None or k[2] == wa_id)]:
+                del self._entries[key]
+
+    def invalidate(self, phone_number_id: str, wa_id: Optional[str] = None) -> None:
+        """
+        Invalida un número completo (cliente desactivado) o una conversación
+        (thread reseteado) en este proceso, en Redis y en el resto de workers.
+        """
+        self.invalidate_local(phone_number_id, wa_id)
+
+        try:
+            from src.core.redis_client import get_redis
+            redis = get_redis()
+            if wa_id is None:
+                redis.delete(_redis_key(phone_number_id))
+            else:
+                # HDEL necesita el campo exacto: borrar los de ese wa_id
+                fields = [f for f in redis.hkeys(_redis_key(phone_number_id)) if f.decode().endswith(f":{wa_id}")]
+                if fields:
+                    redis.hdel(_redis_key(phone_number_id), *fields)
+            redis.publish(INVALIDATION_CHANNEL, f"{phone_number_id}|{wa_id or ''}")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo propagar la invalidación de threads: {e}")
+
+    def start_invalidation_listener(self) -> None:
+        """Escucha invalidaciones publicadas por otros procesos (hilo daemon)"""
+        if self._listener is not None or not self.use_redis:
+            return
+
+        def listen():
+            from src.core.redis_client import get_redis
+            while True:
+                try:
+                    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(INVALIDATION_CHANNEL)
+                    while True:
+                        message = pubsub.get_message(timeout=1.0)
+                        if message:
+                            phone_number_id, _, wa_id = message["data"].decode().partition("|")
+                            self.invalidate_local(phone_number_id, wa_id or None)
+                except Exception as e:
+                    logger.warning(f"⚠️ Listener de invalidación reconectando: {e}")
+                    time.sleep(5)
+
+        self._listener = threading.Thread(target=listen, name="thread-cache-invalidation", daemon=True)
+        self._listener.start()
+
+
+# Instancia global (una por proceso worker)
+thread_cache = ThreadCache(
+    max_entries=settings.thread_cache_size,
+    use_redis=settings.thread_cache_redis,
+    redis_ttl=settings.thread_cache_redis_ttl,
+    redis_max_fields=settings.thread_cache_redis_max_fields
+)
+
+
+async def invalidate_phone_number(phone_number_id: str) -> None:
+    """Invalidación desde la API (asíncrona): cliente desactivado o eliminado"""
+    try:
+        from src.core.redis_client import get_async_redis
+        redis = get_async_redis()
+        await redis.delete(_redis_key(phone_number_id))
+        await redis.publish(INVALIDATION_CHANNEL, f"{phone_number_id}|")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo propagar la invalidación de threads: {e}")
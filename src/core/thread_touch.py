@@ -0,0 +1,123 @@
+"""
+Escritura diferida (write-behind) de Thread.last_message_at.
+
+En lugar de una transacción por respuesta solo para mover un timestamp,
+cada worker acumula el último instante por thread_id y lo vuelca en un
+único `UPDATE ... FROM (VALUES ...)`. El volcado ocurre cuando pasan
+`thread_touch_flush_seconds`, cuando el buffer llega a
+`thread_touch_max_batch` threads o al apagar el proceso.
+"""
+
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _build_update(count: int):
+    """UPDATE con `count` filas en VALUES; nunca retrocede un timestamp"""
+    rows = ", ".join(f"(:thread_id_{i}, CAST(:ts_{i} AS TIMESTAMP))" for i in range(count))
+    return text(f"""
+        UPDATE threads
+           SET last_message_at = v.ts
+          FROM (VALUES {rows}) AS v(thread_id, ts)
+         WHERE threads.thread_id = v.thread_id
+           AND (threads.last_message_at IS NULL OR threads.last_message_at < v.ts)
+    """)
+
+
+class ThreadTouchBuffer:
+    def __init__(self, flush_interval: float = 5.0, max_batch: int = 500, session_factory=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._session_factory = session_factory
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def touch(self, thread_id: str, at: Optional[datetime] = None) -> None:
+        """Marca actividad en un thread; escribe al llenar el lote"""
+        at = at or datetime.utcnow()
+        with self._lock:
+            previous = self._pending.get(thread_id)
+            if previous is None or previous < at:
+                self._pending[thread_id] = at
+            full = len(self._pending) >= self.max_batch
+
+        self._ensure_timer()
+        if full:
+            self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Vuelca el buffer en una sola sentencia. Devuelve los threads escritos."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            params = {}
+            for i, (thread_id, at) in enumerate(batch.items()):
+                params[f"thread_id_{i}"] = thread_id
+                params[f"ts_{i}"] = at
+
+            try:
+                with self._get_session() as session:
+                    session.execute(_build_update(len(batch)), params)
+                    session.commit()
+                logger.debug(f"🕒 {len(batch)} timestamps de thread actualizados")
+                return len(batch)
+            except Exception as e:
+                logger.error(f"❌ Error actualizando timestamps: {str(e)}")
+                # Devolver al buffer sin pisar valores más recientes
+                with self._lock:
+                    for thread_id, at in batch.items():
+                        if thread_id not in self._pending or self._pending[thread_id] < at:
+                            self._pending[thread_id] = at
+                return 0
+
+    def _get_session(self):
+        if self._session_factory is not None:
+            return self._session_factory()
+        from src.core.database import db_manager
+        return db_manager.get_session()
+
+    def _ensure_timer(self) -> None:
+        if self._timer is not None:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Thread(target=self._run, name="thread-touch-flush", daemon=True)
+            self._timer.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Detiene el volcado periódico y escribe lo pendiente"""
+        self._stopped.set()
+        self.flush()
+
+
+# Instancia global (una por proceso worker)
+thread_touch_buffer = ThreadTouchBuffer(
+    flush_interval=settings.thread_touch_flush_seconds,
+    max_batch=settings.thread_touch_max_batch
+)
+
+atexit.register(thread_touch_buffer.flush)
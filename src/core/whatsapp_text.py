@@ -0,0 +1,131 @@
+"""
+Formato y troceado de respuestas para WhatsApp.
+
+WhatsApp rechaza textos de más de 4096 caracteres. En lugar de truncar, las
+respuestas largas se dividen en varias partes que se envían en orden:
+primero por párrafos, luego por frases y, solo si una frase no cabe, por
+palabras. Si un corte cae dentro de un formato (*negrita*, _cursiva_,
+~tachado~ o ```monoespaciado```), se cierra al final de la parte y se
+vuelve a abrir al principio de la siguiente.
+"""
+
+import re
+from typing import List
+
+# Margen bajo el límite de 4096 para los marcadores que se añaden al cortar
+MAX_PART_LENGTH = 4000
+
+_CODE_FENCE = "```"
+_INLINE_MARKERS = "*_~"
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def format_for_whatsapp(text: str) -> str:
+    """
+    Procesa el texto de respuesta para que sea compatible con WhatsApp.
+    """
+    # Remover referencias de archivos/documentos
+    text = re.sub(r"\【.*?\】", "", text).strip()
+
+    # Convertir markdown bold (**texto**) a WhatsApp bold (*texto*)
+    text = re.sub(r"\*\*(.*?)\*\*", r"*\1*", text)
+
+    # Limpiar espacios extra
+    text = re.sub(r"\n{3,}", "\n\n", text)
+
+    return text.strip()
+
+
+def open_markers(text: str) -> List[str]:
+    """Marcadores de formato que quedan abiertos al final del texto"""
+    stack: List[str] = []
+    in_code = False
+    i = 0
+    while i < len(text):
+        if text.startswith(_CODE_FENCE, i):
+            in_code = not in_code
+            i += len(_CODE_FENCE)
+            continue
+
+        char = text[i]
+        if not in_code and char in _INLINE_MARKERS:
+            prev = text[i - 1] if i > 0 else " "
+            nxt = text[i + 1] if i + 1 < len(text) else " "
+            if char in stack and not prev.isspace() and not nxt.isalnum():
+                # Cierra el marcador abierto más reciente de ese tipo
+                index = len(stack) - 1 - stack[::-1].index(char)
+                del stack[index]
+            elif not prev.isalnum() and not nxt.isspace():
+                stack.append(char)
+        i += 1
+
+    if in_code:
+        stack.append(_CODE_FENCE)
+    return stack
+
+
+def split_message(text: str, limit: int = MAX_PART_LENGTH) -> List[str]:
+    """
+    Divide una respuesta ya formateada en partes de como mucho `limit`
+    caracteres, respetando párrafos, frases y formato.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    # Reservar sitio para cerrar y reabrir formatos en cada corte
+    budget = limit - 16
+    parts: List[str] = []
+    current = ""
+
+    for piece, separator in _split_units(text, budget):
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) <= budget:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+        current = piece
+    if current:
+        parts.append(current)
+
+    return _balance(parts)
+
+
+def _split_units(text: str, limit: int):
+    """
+    Genera (fragmento, separador previo) en el orden del texto. Cada nivel
+    (párrafo, línea, frase, palabra) solo se usa si el anterior no cabe.
+    """
+    levels = ("\n\n", "\n", _SENTENCE_END, " ")
+
+    def walk(chunk: str, level: int, separator: str):
+        if len(chunk) <= limit or level == len(levels):
+            if len(chunk) <= limit:
+                yield chunk, separator
+            else:
+                # Una sola palabra más larga que el límite: corte duro
+                for i in range(0, len(chunk), limit):
+                    yield chunk[i:i + limit], separator if i == 0 else ""
+            return
+
+        pattern = levels[level]
+        if isinstance(pattern, str):
+            pieces, joiner = chunk.split(pattern), pattern
+        else:
+            pieces, joiner = pattern.split(chunk), " "
+
+        for index, piece in enumerate(pieces):
+            yield from walk(piece, level + 1, separator if index == 0 else joiner)
+
+    yield from walk(text, 0, "")
+
+
+def _balance(parts: List[str]) -> List[str]:
+    """Cierra los formatos abiertos al final de cada parte y los reabre en la siguiente"""
+    balanced = []
+    carried: List[str] = []
+    for part in parts:
+        text = "".join(carried) + part
+        carried = open_markers(text)
+        balanced.append(text + "".join(reversed(carried)))
+    return balanced
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 import os
 
@@ -10,7 +11,7 @@ logger = logging.getLogger(__name__)
 
 # Intentar importar la configuración de base de datos
 try:
-    from src.core.database import init_database, create_tables, health_check, close_database
+    from src.core.database import init_database, create_tables, health_check, close_database, close_async_database
     DATABASE_AVAILABLE = True
     logger.info("✅ Módulo de base de datos importado correctamente")
 except ImportError as e:
@@ -76,12 +77,28 @@ async def lifespan(app: FastAPI):
     else:
         logger.info("🔄 Ejecutando sin base de datos")
     
+    # Drenador del spool local (mensajes recibidos con el broker caído)
+    spool_drainer = None
+    if HAS_WEBHOOK:
+        try:
+            from src.core.spool import run_spool_drainer
+            from src.tasks import enqueue_messages
+            spool_drainer = asyncio.create_task(
+                run_spool_drainer(enqueue_messages, settings.spool_drain_interval)
+            )
+            logger.info("✅ Drenador de spool iniciado")
+        except Exception as e:
+            logger.error(f"❌ Error iniciando drenador de spool: {e}")
+    
     yield
     
     # Shutdown
     logger.info("Cerrando aplicación...")
+    if spool_drainer:
+        spool_drainer.cancel()
     if DATABASE_AVAILABLE:
         try:
+            await close_async_database()
             close_database()
             logger.info("✅ Conexiones de BD cerradas")
         except Exception as e:
@@ -115,26 +132,14 @@ def create_app() -> FastAPI:
     except Exception as e:
         logger.error(f"❌ Error configurando CORS: {e}")
     
-    # Middleware para inyectar sesión de base de datos (solo si está disponible)
-    if DATABASE_AVAILABLE:
+    # Atajo para callbacks de estado: responde antes de llegar a los routers
+    if HAS_WEBHOOK:
         try:
-            from src.core.database import get_session
-            
-            @app.middleware("http")
-            async def db_session_middleware(request: Request, call_next):
-                try:
-                    db_session = get_session()
-                    request.state.db = db_session
-                    response = await call_next(request)
-                    db_session.close()
-                    return response
-                except Exception as e:
-                    logger.error(f"Error en middleware de BD: {e}")
-                    # Continuar sin BD si hay error
-                    request.state.db = None
-                    return await call_next(request)
+            from src.api.status_fastpath import StatusCallbackMiddleware
+            app.add_middleware(StatusCallbackMiddleware)
+            logger.info("✅ Atajo de callbacks de estado configurado")
         except Exception as e:
-            logger.error(f"Error configurando middleware de BD: {e}")
+            logger.error(f"❌ Error configurando atajo de estados: {e}")
     
     # Incluir routers solo si están disponibles
     if HAS_INGEST:
@@ -171,8 +176,23 @@ def create_app() -> FastAPI:
             except Exception as e:
                 health_status["database"] = f"error: {str(e)}"
         
+        if settings and settings.status_stats_enabled:
+            from src.core.delivery_stats import delivery_stats
+            health_status["delivery"] = delivery_stats.snapshot()
+        
         return health_status
     
+    # Histograma de latencia de runs publicado por los workers (polling adaptativo)
+    @app.get("/metrics/run-latency")
+    async def run_latency_metrics():
+        from src.core.redis_client import get_async_redis
+        from src.core.run_latency import METRICS_KEY, merge_published
+        try:
+            raw = await get_async_redis().hgetall(METRICS_KEY)
+        except Exception as e:
+            return {"error": f"Redis no disponible: {str(e)}"}
+        return merge_published(raw)
+    
     # Endpoint de información básica
     @app.get("/")
     async def root():
@@ -190,13 +210,6 @@ def create_app() -> FastAPI:
 app = create_app()
 
 # Dependency para obtener la sesión de BD (solo si está disponible)
-def get_db_dependency():
-    """Dependency para inyectar sesión de base de datos en endpoints"""
-    if not DATABASE_AVAILABLE:
-        return None
-    
-    db = get_session()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+# Las sesiones se crean bajo demanda con src.core.database.get_db_session
+if DATABASE_AVAILABLE:
+    from src.core.database import get_db_session as get_db_dependency
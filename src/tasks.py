@@ -1,10 +1,27 @@
-from celery import Celery
-from sqlmodel import Session, select
+from celery import Celery, group
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlmodel import Session
+from sqlalchemy import text
+from datetime import datetime
 from src.core.settings import settings
 from src.core.database import db_manager
-from src.core.models import Thread, Client, Agent
 from src.core.openai_client import get_openai_client, OpenAIError
 from src.core.meta_client import MetaClient, MetaError
+from src.core.coalescing import ConversationCoalescer, merge_jobs
+from src.core.conversation_lock import conversation_lease, ConversationBusy
+from src.core.redis_client import get_redis
+from src.core import checkpoints
+from src.core.checkpoints import TaskCheckpoint, get_checkpoint
+from src.core.whatsapp_text import format_for_whatsapp, split_message
+from src.core.progressive import ProgressiveReply
+from src.core.faq_matcher import faq_registry
+from src.core.chat_engine import chat_engine, ENGINE_CHAT
+from src.core.context_memory import context_memory
+from src.core.retry_policy import classify_error, backoff_delay, PERMANENT
+from src.core.thread_cache import thread_cache
+from src.core.thread_touch import thread_touch_buffer
+from typing import Dict, List, Optional
+import json
 import logging
 
 # Configurar logging
@@ -29,8 +46,31 @@ celery_app.conf.update(
 )
 
 
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    """Cada proceso worker escucha las invalidaciones de la caché de threads"""
+    thread_cache.start_invalidation_listener()
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    """Vuelca los timestamps de thread pendientes antes de salir"""
+    thread_touch_buffer.close()
+
+
 @celery_app.task(bind=True, max_retries=3)
-def handle_message(self, agent_id: str, phone_number_id: str, wa_id: str, text: str):
+def handle_message(
+    self,
+    agent_id: str,
+    phone_number_id: str,
+    wa_id: str,
+    text: str,
+    message_id: Optional[str] = None,
+    progressive_delivery: bool = False,
+    read_receipts: bool = False,
+    engine: Optional[str] = None,
+    receipt_sent: bool = False
+):
     """
     Procesa un mensaje de WhatsApp y genera una respuesta usando OpenAI.
     
@@ -39,95 +79,293 @@ def handle_message(self, agent_id: str, phone_number_id: str, wa_id: str, text:
         phone_number_id: ID del número de WhatsApp Business
         wa_id: ID de WhatsApp del usuario
         text: Texto del mensaje recibido
+        message_id: ID del mensaje de WhatsApp (wamid), si se conoce
+        progressive_delivery: Enviar la respuesta por párrafos mientras se genera
+        read_receipts: Marcar el mensaje como leído y mostrar "escribiendo..."
+        engine: "chat" para Chat Completions con historial local; por defecto threads
+        receipt_sent: La confirmación de lectura ya se envió (reencolado por lease ocupado)
     """
+    # Los reintentos conservan el ID de la tarea: se reanuda desde el último paso
+    checkpoint = get_checkpoint(self.request.id)
+    
+    # Confirmación de lectura antes del run (en segundo plano, sin esperar a Meta)
+    # El reencolado por ConversationBusy reinicia `retries`: se marca explícitamente
+    if read_receipts and message_id and not receipt_sent and self.request.retries == 0:
+        MetaClient().mark_read_in_background(phone_number_id, message_id)
+    
     try:
         logger.info(f"🤖 Procesando mensaje de {wa_id}: {text}")
         
-        # Procesar mensaje de forma síncrona
-        response = _process_message_sync(agent_id, phone_number_id, wa_id, text)
+        # Procesar mensaje de forma síncrona, en exclusiva para esta conversación
+        with conversation_lease(phone_number_id, wa_id):
+            process = _process_message_chat if engine == ENGINE_CHAT else _process_message_sync
+            response = process(
+                agent_id, phone_number_id, wa_id, text, checkpoint,
+                progressive_delivery=progressive_delivery
+            )
         logger.info(f"✅ Mensaje procesado exitosamente para {wa_id}")
+        checkpoint.clear()
+        
+        # Fuera del lease: el siguiente mensaje de la conversación no espera al resumen
+        _compact_context(phone_number_id, wa_id, response, engine)
         return response
+    
+    except ConversationBusy as e:
+        # No es un fallo: reencolar sin consumir los reintentos por error
+        # (con el mismo ID para no perder los checkpoints)
+        logger.info(f"⏳ {str(e)}, reencolando en {settings.conversation_lease_retry_seconds}s")
+        handle_message.apply_async(
+            args=self.request.args,
+            kwargs={**self.request.kwargs, "receipt_sent": True},
+            task_id=self.request.id,
+            countdown=settings.conversation_lease_retry_seconds
+        )
+        return {"status": "requeued"}
             
     except Exception as e:
         logger.error(f"❌ Error procesando mensaje: {str(e)}")
-        # Reintentar hasta 3 veces
+        kind = classify_error(e)
+        if kind == PERMANENT:
+            logger.error(f"💀 Error permanente, no se reintenta: {str(e)}")
+            checkpoint.clear()
+            return {"status": "failed", "error": str(e)}
+        
+        # Reintentar hasta 3 veces con backoff exponencial según el tipo de error
         if self.request.retries < self.max_retries:
-            logger.info(f"🔄 Reintentando... ({self.request.retries + 1}/{self.max_retries})")
-            raise self.retry(countdown=60, exc=e)
+            countdown = backoff_delay(kind, self.request.retries)
+            logger.info(f"🔄 Reintentando en {countdown:.1f}s ({kind})... ({self.request.retries + 1}/{self.max_retries})")
+            raise self.retry(countdown=countdown, exc=e)
         else:
             logger.error(f"💀 Falló después de {self.max_retries} intentos")
+            checkpoint.clear()
             return {"status": "failed", "error": str(e)}
 
 
-def _process_message_sync(agent_id: str, phone_number_id: str, wa_id: str, text: str):
+def enqueue_messages(jobs: List[Dict]) -> None:
+    """
+    Encola varios mensajes de una sola vez: una sola publicación en el broker
+    por POST del webhook.
+    
+    Un mensaje se publica directamente como handle_message. Varios van en una
+    única tarea dispatch_messages que los reparte ya en el worker (un group
+    publica un mensaje de broker por firma, N viajes desde el webhook).
+    
+    Args:
+        jobs: Lista de dicts con los argumentos de handle_message
+    """
+    if not jobs:
+        return
+    
+    # Modo asyncio: los jobs van a la cola Redis del worker asíncrono (un solo RPUSH)
+    if settings.worker_mode == "async":
+        get_redis().rpush(settings.async_worker_queue, *[json.dumps(job) for job in jobs])
+        return
+    
+    # Con ventana de agrupación, los mensajes esperan en Redis al flush
+    if settings.coalesce_window_seconds > 0:
+        jobs = _coalesce_jobs(jobs)
+        if not jobs:
+            return
+    
+    # retry=False: si el broker no responde, fallar rápido (el webhook usa el spool)
+    if len(jobs) == 1:
+        handle_message.si(**jobs[0]).apply_async(retry=False)
+    else:
+        dispatch_messages.apply_async(args=(jobs,), retry=False)
+
+
+@celery_app.task
+def dispatch_messages(jobs: List[Dict]):
+    """
+    Reparte un lote del webhook en una tarea handle_message por mensaje, para
+    que cada uno conserve sus reintentos, checkpoints y lease de conversación.
+    """
+    group(handle_message.si(**job) for job in jobs).apply_async()
+    return {"status": "dispatched", "messages": len(jobs)}
+
+
+def _get_coalescer() -> ConversationCoalescer:
+    return ConversationCoalescer(
+        window=settings.coalesce_window_seconds,
+        max_wait=settings.coalesce_max_wait_seconds
+    )
+
+
+def _coalesce_jobs(jobs: List[Dict]) -> List[Dict]:
+    """
+    Envía los mensajes al buffer de su conversación y programa un flush por
+    ventana. Devuelve los jobs que deben encolarse directamente (si Redis falla).
+    """
+    coalescer = _get_coalescer()
+    direct_jobs = []
+    
+    for job in jobs:
+        try:
+            if coalescer.push(job):
+                flush_conversation.apply_async(
+                    args=(job["phone_number_id"], job["wa_id"]),
+                    countdown=coalescer.window,
+                    retry=False
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ Agrupación no disponible, encolando directamente: {e}")
+            direct_jobs.append(job)
+    
+    return direct_jobs
+
+
+@celery_app.task
+def flush_conversation(phone_number_id: str, wa_id: str):
+    """
+    Cierra la ventana de agrupación de una conversación y encola una única
+    tarea handle_message con todos los mensajes acumulados.
+    """
+    coalescer = _get_coalescer()
+    
+    # Si siguen llegando mensajes, esperar a que la conversación quede en silencio
+    remaining = coalescer.remaining(phone_number_id, wa_id)
+    if remaining > 0:
+        flush_conversation.apply_async(args=(phone_number_id, wa_id), countdown=remaining)
+        return {"status": "rescheduled", "countdown": remaining}
+    
+    jobs = coalescer.drain(phone_number_id, wa_id)
+    if not jobs:
+        return {"status": "empty"}
+    
+    logger.info(f"🧺 {len(jobs)} mensaje(s) agrupados para {wa_id}")
+    handle_message.apply_async(kwargs=merge_jobs(jobs))
+    return {"status": "flushed", "messages": len(jobs)}
+
+
+def _process_message_sync(
+    agent_id: str,
+    phone_number_id: str,
+    wa_id: str,
+    text: str,
+    checkpoint: Optional[TaskCheckpoint] = None,
+    progressive_delivery: bool = False
+):
     """
     Lógica síncrona para procesar mensajes.
+    
+    Cada paso completado se anota en `checkpoint`; en un reintento se
+    continúa desde el primer paso pendiente.
     """
     # Obtener managers
     openai_client = get_openai_client()
     meta_client = MetaClient()
+    checkpoint = checkpoint or TaskCheckpoint(None)
     
     with db_manager.get_session() as session:
         # 1. Buscar o crear thread para este usuario
-        thread_id = _get_or_create_thread(session, wa_id, agent_id, phone_number_id)
+        thread_id = _get_thread_id(session, wa_id, agent_id, phone_number_id)
         
         if not thread_id:
             raise Exception("No se pudo obtener o crear thread")
         
-        # 2. Añadir mensaje del usuario al thread de OpenAI
+        if checkpoint.done(checkpoints.REPLY_SENT):
+            return {
+                "status": "success",
+                "response": checkpoint.get(checkpoints.REPLY),
+                "thread_id": thread_id
+            }
+        
         try:
-            openai_client._ensure_client()
-            openai_client.client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=text
-            )
+            def deliver(reply_text: str):
+                _deliver_reply(meta_client, checkpoint, phone_number_id, wa_id, reply_text)
             
-            # 3. Ejecutar el assistant
-            run = openai_client.client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=agent_id
-            )
-            
-            # 4. Esperar respuesta
-            import time
-            while run.status in ["queued", "in_progress"]:
-                time.sleep(0.5)
-                run = openai_client.client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
+            def send_reply(reply_text: str):
+                # Procesar texto para WhatsApp (limpiar formato)
+                reply_text = format_for_whatsapp(reply_text)
+                checkpoint.mark(checkpoints.REPLY, reply_text)
+                deliver(reply_text)
             
-            if run.status == "completed":
-                # 5. Obtener la respuesta
-                messages = openai_client.client.beta.threads.messages.list(
-                    thread_id=thread_id,
-                    limit=1
-                )
+            # 2. FAQ de alta confianza: se responde localmente, sin run. Una
+            #    respuesta guardada sin mensaje añadido solo puede venir de aquí.
+            if not checkpoint.done(checkpoints.MESSAGE_ADDED):
+                if checkpoint.done(checkpoints.REPLY):
+                    deliver(checkpoint.get(checkpoints.REPLY))
+                else:
+                    faq_answer = faq_registry.answer(phone_number_id, text)
+                    if faq_answer:
+                        send_reply(faq_answer)
                 
-                if messages.data:
-                    response_text = messages.data[0].content[0].text.value
-                    
-                    # 6. Procesar texto para WhatsApp (limpiar formato)
-                    response_text = _process_text_for_whatsapp(response_text)
-                    
-                    # 7. Enviar respuesta a WhatsApp (usando método síncrono)
-                    meta_client.send_message_sync(phone_number_id, wa_id, response_text)
-                    
-                    # 8. Actualizar timestamp del thread
-                    _update_thread_timestamp(session, wa_id, agent_id)
-                    
-                    logger.info(f"📤 Respuesta enviada a {wa_id}: {response_text[:50]}...")
-                    
+                local_answer = checkpoint.get(checkpoints.REPLY)
+                if local_answer:
+                    _record_local_answer(openai_client, thread_id, text, local_answer)
+                    thread_touch_buffer.touch(thread_id)
                     return {
                         "status": "success",
-                        "response": response_text,
-                        "thread_id": thread_id
+                        "response": local_answer,
+                        "thread_id": thread_id,
+                        "source": "faq"
                     }
-                else:
-                    raise Exception("No se obtuvo respuesta del assistant")
+            
+            # 3. Añadir mensaje del usuario al thread de OpenAI (una sola vez)
+            if not checkpoint.done(checkpoints.MESSAGE_ADDED):
+                openai_client._ensure_client()
+                openai_client.client.beta.threads.messages.create(
+                    thread_id=thread_id,
+                    role="user",
+                    content=text
+                )
+                checkpoint.mark(checkpoints.MESSAGE_ADDED)
+            
+            on_delta = None
+            if progressive_delivery:
+                # Entrega progresiva: los párrafos salen según se generan y al
+                # completarse el mensaje solo se envía el resto
+                progressive = _progressive_reply(meta_client, checkpoint, phone_number_id, wa_id)
+                on_delta = progressive.feed
+                
+                def send_reply(reply_text: str):
+                    reply_text = progressive.finish(reply_text)
+                    checkpoint.mark(checkpoints.REPLY, reply_text)
+                    checkpoint.mark(checkpoints.REPLY_SENT)
+                    logger.info(f"📤 Respuesta progresiva enviada a {wa_id} ({len(progressive.sent)} parte(s))")
+            
+            usage = {}
+            
+            def on_completed(run):
+                if getattr(run, "usage", None):
+                    usage["prompt_tokens"] = run.usage.prompt_tokens
+            
+            if checkpoint.done(checkpoints.REPLY):
+                # El run ya terminó en un intento anterior: solo falta el envío
+                deliver(checkpoint.get(checkpoints.REPLY))
             else:
-                raise Exception(f"Run falló con estado: {run.status}")
+                # 4. Ejecutar el assistant (streaming) y enviar la respuesta a WhatsApp
+                #    en cuanto el mensaje está completo, sin esperar al cierre del run.
+                #    Si un intento anterior ya creó el run, se espera ese mismo run.
+                try:
+                    openai_client.run_assistant(
+                        thread_id,
+                        agent_id,
+                        on_reply=send_reply,
+                        run_id=checkpoint.get(checkpoints.RUN_ID),
+                        on_run_created=lambda run_id: checkpoint.mark(checkpoints.RUN_ID, run_id),
+                        on_delta=on_delta,
+                        on_completed=on_completed,
+                        **_run_options(phone_number_id, wa_id, text)
+                    )
+                except OpenAIError:
+                    # El run terminó en error: el siguiente intento crea uno nuevo y
+                    # su entrega progresiva empieza desde el principio del texto nuevo
+                    checkpoint.discard(checkpoints.RUN_ID)
+                    checkpoint.discard(checkpoints.PROGRESS_OFFSET)
+                    raise
+            response_text = checkpoint.get(checkpoints.REPLY)
+            
+            # 5. Actualizar timestamp del thread (escritura diferida por lotes)
+            thread_touch_buffer.touch(thread_id)
+            
+            # El resumen de los turnos antiguos se hace tras liberar el lease (_compact_context)
+            return {
+                "status": "success",
+                "response": response_text,
+                "thread_id": thread_id,
+                "prompt_tokens": usage.get("prompt_tokens")
+            }
                 
         except OpenAIError as e:
             logger.error(f"❌ Error OpenAI: {str(e)}")
@@ -140,152 +378,270 @@ def _process_message_sync(agent_id: str, phone_number_id: str, wa_id: str, text:
             raise e
 
 
-def _get_or_create_thread(session: Session, wa_id: str, agent_id: str, phone_number_id: str) -> str:
+def _process_message_chat(
+    agent_id: str,
+    phone_number_id: str,
+    wa_id: str,
+    text: str,
+    checkpoint: Optional[TaskCheckpoint] = None,
+    progressive_delivery: bool = False
+):
     """
-    Busca un thread existente para el usuario o crea uno nuevo.
+    Motor de Chat Completions: una sola llamada a OpenAI por respuesta, con
+    el historial de la conversación en conversation_messages.
     """
-    # Buscar thread existente por wa_id y assistant
-    # Primero intentar buscar por cliente
-    result = session.execute(
-        select(Thread, Client).join(Client).where(
-            Thread.wa_id == wa_id,
-            Client.assistant_id == agent_id,
-            Client.phone_number_id == phone_number_id,
-            Client.active == True
-        )
-    )
-    row = result.first()
-    
-    if row:
-        thread, client = row
-        logger.info(f"📱 Thread existente encontrado para {wa_id}: {thread.thread_id}")
-        return thread.thread_id
-    
-    # Si no se encuentra por cliente, buscar por agent (compatibilidad)
-    result = session.execute(
-        select(Thread, Agent).join(Agent).where(
-            Thread.wa_id == wa_id,
-            Agent.agent_id == agent_id,
-            Agent.phone_number_id == phone_number_id
-        )
-    )
-    row = result.first()
+    meta_client = MetaClient()
+    checkpoint = checkpoint or TaskCheckpoint(None)
     
-    if row:
-        thread, agent = row
-        logger.info(f"📱 Thread existente encontrado para {wa_id}: {thread.thread_id}")
-        return thread.thread_id
+    if checkpoint.done(checkpoints.REPLY_SENT) and checkpoint.done(checkpoints.MESSAGE_ADDED):
+        return {"status": "success", "response": checkpoint.get(checkpoints.REPLY), "engine": ENGINE_CHAT}
     
-    # Crear nuevo thread
     try:
-        openai_client = get_openai_client()
-        openai_client._ensure_client()
-        
-        new_thread = openai_client.client.beta.threads.create()
-        
-        # Buscar el cliente o agent para asociar el thread
-        client_result = session.execute(
-            select(Client).where(
-                Client.assistant_id == agent_id,
-                Client.phone_number_id == phone_number_id,
-                Client.active == True
-            )
-        )
-        client = client_result.scalar_one_or_none()
-        
-        if client:
-            # Crear thread asociado al cliente
-            db_thread = Thread(
-                wa_id=wa_id,
-                thread_id=new_thread.id,
-                client_id=client.id
-            )
-        else:
-            # Buscar agent para compatibilidad
-            agent_result = session.execute(
-                select(Agent).where(
-                    Agent.agent_id == agent_id,
-                    Agent.phone_number_id == phone_number_id
-                )
-            )
-            agent = agent_result.scalar_one_or_none()
-            
-            if agent:
-                db_thread = Thread(
-                    wa_id=wa_id,
-                    thread_id=new_thread.id,
-                    agent_id=agent.id
-                )
+        # 1. Generar la respuesta: FAQ de alta confianza o una chat completion
+        if not checkpoint.done(checkpoints.REPLY):
+            faq_answer = faq_registry.answer(phone_number_id, text)
+            if faq_answer:
+                checkpoint.mark(checkpoints.REPLY, format_for_whatsapp(faq_answer))
             else:
-                # Crear thread sin asociación (fallback)
-                db_thread = Thread(
-                    wa_id=wa_id,
-                    thread_id=new_thread.id
+                # La respuesta se regenera en cada intento: la entrega progresiva
+                # empieza siempre desde el principio del texto nuevo
+                progressive = None
+                if progressive_delivery:
+                    checkpoint.discard(checkpoints.PROGRESS_OFFSET)
+                    progressive = _progressive_reply(meta_client, checkpoint, phone_number_id, wa_id)
+                
+                reply_text = chat_engine.reply(
+                    agent_id,
+                    phone_number_id,
+                    wa_id,
+                    text,
+                    additional_instructions=faq_registry.instructions_for(phone_number_id, text),
+                    on_delta=progressive.feed if progressive else None
                 )
+                if progressive:
+                    checkpoint.mark(checkpoints.REPLY, progressive.finish(reply_text))
+                    checkpoint.mark(checkpoints.REPLY_SENT)
+                else:
+                    checkpoint.mark(checkpoints.REPLY, format_for_whatsapp(reply_text))
+        response_text = checkpoint.get(checkpoints.REPLY)
         
-        session.add(db_thread)
-        session.commit()
+        # 2. Enviar respuesta a WhatsApp
+        if not checkpoint.done(checkpoints.REPLY_SENT):
+            _deliver_reply(meta_client, checkpoint, phone_number_id, wa_id, response_text)
         
-        logger.info(f"🆕 Nuevo thread creado para {wa_id}: {new_thread.id}")
-        return new_thread.id
+        # 3. Guardar pregunta y respuesta en el historial (una sola vez)
+        if not checkpoint.done(checkpoints.MESSAGE_ADDED):
+            chat_engine.store_exchange(phone_number_id, wa_id, text, response_text)
+            checkpoint.mark(checkpoints.MESSAGE_ADDED)
         
-    except Exception as e:
-        logger.error(f"❌ Error creando thread: {str(e)}")
+        # Los turnos antiguos se resumen tras liberar el lease (_compact_context)
+        return {"status": "success", "response": response_text, "engine": ENGINE_CHAT}
+    
+    except OpenAIError as e:
+        logger.error(f"❌ Error OpenAI: {str(e)}")
+        error_msg = "Disculpa, estoy experimentando dificultades técnicas. Por favor, intenta de nuevo en unos minutos."
+        meta_client.send_message_sync(phone_number_id, wa_id, error_msg)
+        raise e
+    except MetaError as e:
+        logger.error(f"❌ Error Meta: {str(e)}")
         raise e
 
 
-def _update_thread_timestamp(session: Session, wa_id: str, agent_id: str):
+def _deliver_reply(meta_client: MetaClient, checkpoint: TaskCheckpoint, phone_number_id: str, wa_id: str, reply_text: str):
     """
-    Actualiza el timestamp del último mensaje del thread.
+    Envía la respuesta a WhatsApp en orden, en varias partes si es larga,
+    saltando las que ya se entregaron en otro intento.
+    """
+    parts = split_message(reply_text)
+    already_sent = int(checkpoint.get(checkpoints.PARTS_SENT) or 0)
+    meta_client.send_messages_sync(
+        phone_number_id,
+        wa_id,
+        parts[already_sent:],
+        on_sent=lambda count: checkpoint.mark(checkpoints.PARTS_SENT, str(already_sent + count))
+    )
+    checkpoint.mark(checkpoints.REPLY_SENT)
+    logger.info(f"📤 Respuesta enviada a {wa_id} ({len(parts)} parte(s)): {reply_text[:50]}...")
+
+
+def _progressive_reply(meta_client: MetaClient, checkpoint: TaskCheckpoint, phone_number_id: str, wa_id: str) -> ProgressiveReply:
+    """Entrega progresiva que reanuda desde el offset guardado en el checkpoint"""
+    return ProgressiveReply(
+        send=lambda part: meta_client.send_message_sync(phone_number_id, wa_id, part),
+        min_chars=settings.progressive_min_chars,
+        offset=int(checkpoint.get(checkpoints.PROGRESS_OFFSET) or 0),
+        on_progress=lambda offset: checkpoint.mark(checkpoints.PROGRESS_OFFSET, str(offset))
+    )
+
+
+def _run_options(phone_number_id: str, wa_id: str, text: str) -> dict:
+    """
+    Opciones del run: el resumen de la conversación (con su ventana de
+    mensajes recientes) y solo las FAQs relevantes para el mensaje, como
+    instrucciones adicionales.
     """
     try:
-        from datetime import datetime
-        
-        # Buscar thread por cliente
-        result = session.execute(
-            select(Thread).join(Client).where(
-                Thread.wa_id == wa_id,
-                Client.assistant_id == agent_id,
-                Client.active == True
-            )
-        )
-        thread = result.scalar_one_or_none()
-        
-        if not thread:
-            # Buscar por agent (compatibilidad)
-            result = session.execute(
-                select(Thread).join(Agent).where(
-                    Thread.wa_id == wa_id,
-                    Agent.agent_id == agent_id
-                )
-            )
-            thread = result.scalar_one_or_none()
-        
-        if thread:
-            thread.last_message_at = datetime.utcnow()
-            session.commit()
-            
+        options = context_memory.thread_run_options(phone_number_id, wa_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Resumen de la conversación no disponible: {str(e)}")
+        options = {}
+    
+    instructions = [options.pop("additional_instructions", None), faq_registry.instructions_for(phone_number_id, text)]
+    instructions = "\n\n".join(part for part in instructions if part)
+    if instructions:
+        options["additional_instructions"] = instructions
+    return options
+
+
+def _compact_context(phone_number_id: str, wa_id: str, response: Dict, engine: Optional[str] = None) -> None:
+    """
+    Resume los turnos antiguos de la conversación una vez entregada la
+    respuesta y liberado el lease: ni retrasa esta respuesta ni bloquea el
+    siguiente mensaje de la misma conversación.
+    """
+    if not context_memory.enabled or response.get("status") != "success":
+        return
+    if engine == ENGINE_CHAT:
+        try:
+            chat_engine.compact(phone_number_id, wa_id)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo resumir la conversación de {wa_id}: {str(e)}")
+    elif response.get("thread_id") and response.get("source") != "faq":
+        _compact_thread_context(response["thread_id"], phone_number_id, wa_id, response.get("prompt_tokens"))
+
+
+def _compact_thread_context(thread_id: str, phone_number_id: str, wa_id: str, prompt_tokens: Optional[int]) -> None:
+    """Resume los turnos antiguos del thread; un fallo no afecta a la respuesta ya enviada"""
+    try:
+        context_memory.compact_thread(thread_id, phone_number_id, wa_id, prompt_tokens)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo resumir el thread {thread_id}: {str(e)}")
+
+
+def _record_local_answer(openai_client, thread_id: str, text: str, answer: str) -> None:
+    """
+    Añade al thread la pregunta y la respuesta dada localmente, para que el
+    assistant tenga el contexto en los siguientes mensajes. No bloquea la
+    respuesta: si falla, solo se registra.
+    """
+    try:
+        openai_client._ensure_client()
+        openai_client.client.beta.threads.messages.create(thread_id=thread_id, role="user", content=text)
+        openai_client.client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=answer)
     except Exception as e:
-        logger.error(f"❌ Error actualizando timestamp: {str(e)}")
+        logger.warning(f"⚠️ No se pudo registrar la respuesta local en el thread: {str(e)}")
 
 
-def _process_text_for_whatsapp(text: str) -> str:
+def _get_thread_id(session: Session, wa_id: str, agent_id: str, phone_number_id: str) -> str:
     """
-    Procesa el texto de respuesta para que sea compatible con WhatsApp.
+    Thread de OpenAI de la conversación: primero la caché LRU del worker y,
+    solo si no está, la base de datos (creándolo si hace falta).
     """
-    import re
+    thread_id = thread_cache.get(phone_number_id, agent_id, wa_id)
+    if thread_id:
+        return thread_id
     
-    # Remover referencias de archivos/documentos
-    text = re.sub(r"\【.*?\】", "", text).strip()
+    thread_id = _get_or_create_thread(session, wa_id, agent_id, phone_number_id)
+    if thread_id:
+        thread_cache.set(phone_number_id, agent_id, wa_id, thread_id)
+    return thread_id
+
+
+# Resuelve en una sola consulta el dueño de la conversación (cliente activo o,
+# por compatibilidad, agent) y el thread existente del usuario, si lo hay
+_RESOLVE_THREAD_SQL = text("""
+    WITH owner AS (
+        SELECT id AS client_id, NULL::integer AS agent_id, 0 AS priority
+        FROM clients
+        WHERE assistant_id = :assistant_id
+          AND phone_number_id = :phone_number_id
+          AND active = true
+        UNION ALL
+        SELECT NULL::integer, id, 1
+        FROM agents
+        WHERE agent_id = :assistant_id
+          AND phone_number_id = :phone_number_id
+        ORDER BY priority
+        LIMIT 1
+    )
+    SELECT owner.client_id, owner.agent_id, t.thread_id
+    FROM owner
+    LEFT JOIN threads t
+      ON t.wa_id = :wa_id
+     AND (t.client_id = owner.client_id OR t.agent_id = owner.agent_id)
+    LIMIT 1
+""")
+
+# Los índices únicos (wa_id, client_id) y (wa_id, agent_id) hacen que solo
+# gane una inserción si llegan a la vez los primeros mensajes de un usuario
+_INSERT_THREAD_SQL = text("""
+    INSERT INTO threads (wa_id, thread_id, client_id, agent_id, created_at, last_message_at)
+    VALUES (:wa_id, :thread_id, :client_id, :agent_id, :now, :now)
+    ON CONFLICT DO NOTHING
+    RETURNING thread_id
+""")
+
+_SELECT_OWNED_THREAD_SQL = text("""
+    SELECT thread_id FROM threads
+    WHERE wa_id = :wa_id
+      AND (client_id = :client_id OR agent_id = :agent_id)
+    LIMIT 1
+""")
+
+
+def _get_or_create_thread(session: Session, wa_id: str, agent_id: str, phone_number_id: str) -> str:
+    """
+    Busca un thread existente para el usuario o crea uno nuevo.
     
-    # Convertir markdown bold (**texto**) a WhatsApp bold (*texto*)
-    text = re.sub(r"\*\*(.*?)\*\*", r"*\1*", text)
+    El caso habitual (thread ya existente) es una única consulta indexada.
+    """
+    row = session.execute(_RESOLVE_THREAD_SQL, {
+        "assistant_id": agent_id,
+        "phone_number_id": phone_number_id,
+        "wa_id": wa_id
+    }).first()
     
-    # Limpiar espacios extra
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    client_id, owner_agent_id, thread_id = row if row else (None, None, None)
     
-    # Limitar longitud (WhatsApp tiene límite de 4096 caracteres)
-    if len(text) > 4000:
-        text = text[:3980] + "\n\n..." + "\n\n(Mensaje truncado por longitud)"
+    if thread_id:
+        logger.info(f"📱 Thread existente encontrado para {wa_id}: {thread_id}")
+        return thread_id
     
-    return text.strip()
\ No newline at end of file
+    # Crear nuevo thread
+    try:
+        openai_client = get_openai_client()
+        openai_client._ensure_client()
+        
+        new_thread = openai_client.client.beta.threads.create()
+        
+        inserted = session.execute(_INSERT_THREAD_SQL, {
+            "wa_id": wa_id,
+            "thread_id": new_thread.id,
+            "client_id": client_id,
+            "agent_id": owner_agent_id,
+            "now": datetime.utcnow()
+        }).scalar()
+        session.commit()
+        
+        if inserted:
+            logger.info(f"🆕 Nuevo thread creado para {wa_id}: {new_thread.id}")
+            return new_thread.id
+        
+        # Otro worker creó el thread a la vez: usar el suyo y descartar el nuestro
+        thread_id = session.execute(_SELECT_OWNED_THREAD_SQL, {
+            "wa_id": wa_id,
+            "client_id": client_id,
+            "agent_id": owner_agent_id
+        }).scalar()
+        
+        try:
+            openai_client.client.beta.threads.delete(new_thread.id)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar el thread duplicado {new_thread.id}: {e}")
+        
+        logger.info(f"📱 Thread concurrente reutilizado para {wa_id}: {thread_id}")
+        return thread_id
+        
+    except Exception as e:
+        logger.error(f"❌ Error creando thread: {str(e)}")
+        raise e
@@ -0,0 +1,62 @@
+from unittest.mock import MagicMock, patch
+from src.core.assistant_registry import AssistantRegistry, content_hash
+
+
+def test_content_hash_ignores_tool_key_order():
+    """Test de que el hash depende del contenido y no del orden de las claves"""
+    first = content_hash("gpt-4o-mini", "Eres un asistente", [{"type": "file_search", "x": 1}])
+    second = content_hash("gpt-4o-mini", "Eres un asistente", [{"x": 1, "type": "file_search"}])
+
+    assert first == second
+    assert first != content_hash("gpt-4o", "Eres un asistente", [{"type": "file_search", "x": 1}])
+
+
+def test_registered_content_reuses_assistant_without_creating():
+    """Test de que un contenido ya registrado no crea otro assistant"""
+    registry = AssistantRegistry()
+    create = MagicMock(return_value="asst_new")
+
+    with patch.object(registry, "lookup", return_value="asst_existing"):
+        assert registry.get_or_create("gpt-4o-mini", "Hola", "Bot", create) == "asst_existing"
+
+    create.assert_not_called()
+
+
+def test_concurrent_registration_keeps_winner_and_deletes_duplicate():
+    """Test de que si otra alta registró el contenido antes se usa su assistant"""
+    registry = AssistantRegistry()
+    delete = MagicMock()
+
+    with patch.object(registry, "lookup", return_value=None), \
+            patch.object(registry, "_register", return_value="asst_winner"):
+        assistant_id = registry.get_or_create("gpt-4o-mini", "Hola", "Bot", lambda: "asst_mine", delete=delete)
+
+    assert assistant_id == "asst_winner"
+    delete.assert_called_once_with("asst_mine")
+
+
+def test_deleted_assistant_is_discarded_and_recreated():
+    """Test de que un assistant registrado que ya no existe en OpenAI se vuelve a crear"""
+    registry = AssistantRegistry()
+
+    with patch.object(registry, "lookup", return_value="asst_deleted"), \
+            patch.object(registry, "_discard") as discard, \
+            patch.object(registry, "_register", side_effect=lambda digest, assistant_id, model, name: assistant_id):
+        assistant_id = registry.get_or_create(
+            "gpt-4o-mini", "Hola", "Bot", lambda: "asst_new", exists=lambda assistant_id: False
+        )
+
+    assert assistant_id == "asst_new"
+    discard.assert_called_once_with(content_hash("gpt-4o-mini", "Hola"), "asst_deleted")
+
+
+def test_existence_is_checked_once_per_process():
+    """Test de que la comprobación con OpenAI no se repite en cada reutilización"""
+    registry = AssistantRegistry()
+    exists = MagicMock(return_value=True)
+
+    with patch.object(registry, "lookup", return_value="asst_existing"):
+        for _ in range(3):
+            assert registry.get_or_create("gpt-4o-mini", "Hola", "Bot", lambda: "asst_new", exists=exists) == "asst_existing"
+
+    exists.assert_called_once_with("asst_existing")
@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.async_worker import process_message_async
+from src.core import checkpoints
+from src.core.checkpoints import TaskCheckpoint
+from src.core.openai_client import AsyncOpenAIClient
+
+
+def _openai_client(reply="¡Hola! ¿En qué puedo ayudarte?"):
+    """AsyncOpenAIClient sobre un AsyncOpenAI simulado (polling)"""
+    client = AsyncOpenAIClient()
+    client.client = MagicMock()
+    threads = client.client.beta.threads
+    threads.messages.create = AsyncMock()
+    threads.runs.create = AsyncMock(return_value=SimpleNamespace(id="run_1"))
+    threads.runs.retrieve = AsyncMock(return_value=SimpleNamespace(id="run_1", status="completed", usage=None))
+    message = SimpleNamespace(content=[SimpleNamespace(text=SimpleNamespace(value=reply))])
+    threads.messages.list = AsyncMock(return_value=SimpleNamespace(data=[message]))
+    return client
+
+
+def _patched(stack, openai_client):
+    send = AsyncMock()
+    for target, value in [
+        ("src.async_worker.get_async_openai_client", MagicMock(return_value=openai_client)),
+        ("src.async_worker.thread_cache.get", MagicMock(return_value="thread_1")),
+        ("src.async_worker.faq_registry.answer", MagicMock(return_value=None)),
+        ("src.async_worker._run_options", MagicMock(return_value={})),
+        ("src.async_worker.thread_touch_buffer.touch", MagicMock()),
+        ("src.async_worker.meta_client.send_message", send),
+        ("src.core.openai_client.settings.openai_streaming", False),
+        ("src.core.openai_client.run_latency_model.next_interval", MagicMock(return_value=0)),
+    ]:
+        stack.enter_context(patch(target, value))
+    return send
+
+
+def test_retry_resumes_existing_run_without_adding_the_message_again():
+    """Test de reanudación en modo async: ni se repite el mensaje ni se crea otro run"""
+    openai_client = _openai_client()
+    checkpoint = TaskCheckpoint(None)
+    checkpoint.mark(checkpoints.MESSAGE_ADDED)
+    checkpoint.mark(checkpoints.RUN_ID, "run_1")
+
+    with ExitStack() as stack:
+        send = _patched(stack, openai_client)
+        result = asyncio.run(process_message_async("asst_1", "pn_1", "34600", "hola", checkpoint=checkpoint))
+
+    threads = openai_client.client.beta.threads
+    threads.messages.create.assert_not_called()
+    threads.runs.create.assert_not_called()
+    threads.runs.retrieve.assert_awaited_with(thread_id="thread_1", run_id="run_1")
+    send.assert_awaited_once_with("pn_1", "34600", "¡Hola! ¿En qué puedo ayudarte?")
+    assert result["status"] == "success"
+    assert checkpoint.done(checkpoints.REPLY_SENT)
+
+
+def test_new_message_is_added_run_and_reply_sent():
+    """Test del flujo completo en modo async con AsyncOpenAI simulado"""
+    openai_client = _openai_client()
+    checkpoint = TaskCheckpoint(None)
+
+    with ExitStack() as stack:
+        send = _patched(stack, openai_client)
+        result = asyncio.run(process_message_async("asst_1", "pn_1", "34600", "hola", checkpoint=checkpoint))
+
+    threads = openai_client.client.beta.threads
+    threads.messages.create.assert_awaited_once_with(thread_id="thread_1", role="user", content="hola")
+    threads.runs.create.assert_awaited_once_with(thread_id="thread_1", assistant_id="asst_1")
+    send.assert_awaited_once_with("pn_1", "34600", "¡Hola! ¿En qué puedo ayudarte?")
+    assert result == {
+        "status": "success",
+        "response": "¡Hola! ¿En qué puedo ayudarte?",
+        "thread_id": "thread_1",
+        "prompt_tokens": None
+    }
+    assert checkpoint.get(checkpoints.RUN_ID) == "run_1"
+
+
+def test_faq_match_answers_without_a_run():
+    """Test de la respuesta local de FAQs en modo async"""
+    openai_client = _openai_client()
+
+    with ExitStack() as stack:
+        send = _patched(stack, openai_client)
+        stack.enter_context(patch("src.async_worker.faq_registry.answer", MagicMock(return_value="De 9 a 18 h.")))
+        result = asyncio.run(process_message_async("asst_1", "pn_1", "34600", "¿horario?"))
+
+    openai_client.client.beta.threads.runs.create.assert_not_called()
+    send.assert_awaited_once_with("pn_1", "34600", "De 9 a 18 h.")
+    assert result["source"] == "faq"
@@ -0,0 +1,36 @@
+from unittest.mock import MagicMock, patch
+from src.core.chat_engine import AssistantConfig, ChatEngine
+
+
+def test_history_is_sent_oldest_first_after_system_prompts():
+    """Test del orden de los mensajes enviados a chat.completions"""
+    engine = ChatEngine(history_limit=2)
+    session = MagicMock()
+    # La consulta devuelve del más reciente al más antiguo
+    session.execute.return_value.all.return_value = [("assistant", "¡Hola!"), ("user", "hola")]
+
+    history = engine.load_history(session, "pn_1", "34600")
+    messages = engine.build_messages(
+        AssistantConfig(model="gpt-4o-mini", instructions="Eres un asistente"),
+        history,
+        "¿abrís hoy?",
+        additional_instructions="FAQs relevantes"
+    )
+
+    assert [m["role"] for m in messages] == ["system", "system", "user", "assistant", "user"]
+    assert messages[2]["content"] == "hola"
+    assert messages[-1]["content"] == "¿abrís hoy?"
+
+
+def test_assistant_config_is_cached():
+    """Test de que las instrucciones del assistant se piden una sola vez"""
+    engine = ChatEngine(config_ttl=60)
+    openai = MagicMock()
+    openai.beta.assistants.retrieve.return_value = MagicMock(model="gpt-4o-mini", instructions="Hola")
+
+    with patch.object(engine, "_openai", return_value=openai):
+        first = engine.assistant_config("asst_1")
+        second = engine.assistant_config("asst_1")
+
+    assert first == second == AssistantConfig(model="gpt-4o-mini", instructions="Hola")
+    assert openai.beta.assistants.retrieve.call_count == 1
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy.orm import Session
+from src.api.clients import CreateClientRequest, UpdateClientRequest, create_client, update_client
+from src.core.faq_matcher import FAQRegistry
+from src.core.models import Client
+
+
+def _async_session():
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=MagicMock(scalar_one_or_none=MagicMock(return_value=None)))
+    session.commit = AsyncMock()
+    session.refresh = AsyncMock(side_effect=lambda client: setattr(client, "id", 1))
+    return session
+
+
+def test_create_client_with_instructions_and_faqs():
+    """Test de alta con instrucciones y FAQs a la vez (antes fallaba con UnboundLocalError)"""
+    request = CreateClientRequest(
+        name="Hotel",
+        phone_number="+34600000000",
+        phone_number_id="pn_1",
+        instructions="Eres el asistente del hotel",
+        faqs=[{"q": "¿Hay parking?", "a": "Sí, gratuito."}]
+    )
+    session = _async_session()
+    creating_threads = []
+
+    def create(instructions):
+        creating_threads.append(threading.current_thread())
+        return "asst_1"
+
+    with patch("src.api.clients.create_assistant_with_instructions", side_effect=create), \
+            patch("src.api.clients.invalidate_route"):
+        response = asyncio.run(create_client(request, session))
+
+    assert response.assistant_id == "asst_1"
+    # El registro y OpenAI bloquean: no deben ejecutarse en el event loop
+    assert creating_threads[0] is not threading.main_thread()
+    stored = session.add.call_args[0][0]
+    assert json.loads(stored.faqs) == [{"q": "¿Hay parking?", "a": "Sí, gratuito."}]
+
+
+def test_faq_loader_works_with_plain_sqlalchemy_session():
+    """Test de que la carga de FAQs no usa Session.exec (solo existe en sqlmodel)"""
+    session = MagicMock(spec=Session)
+    session.execute.return_value.first.return_value = ('[{"q": "a", "a": "b"}]', "retrieval")
+    manager = MagicMock()
+    manager.get_session.return_value.__enter__.return_value = session
+
+    with patch("src.core.database.db_manager", manager):
+        assert FAQRegistry()._load("pn_1") == ('[{"q": "a", "a": "b"}]', "retrieval")
+
+
+def _faq_client(faq_mode):
+    return Client(
+        id=1, name="Hotel", phone_number="+34600000000", phone_number_id="pn_1",
+        assistant_id="asst_old", faqs='[{"q": "¿Hay parking?", "a": "Sí."}]', faq_mode=faq_mode
+    )
+
+
+def _patch(client, request):
+    session = _async_session()
+    session.execute = AsyncMock(return_value=MagicMock(scalar_one_or_none=MagicMock(return_value=client)))
+    create = MagicMock(return_value="asst_new")
+
+    with patch("src.api.clients.create_assistant", create), \
+            patch("src.api.clients.invalidate_route"):
+        response = asyncio.run(update_client(1, request, session))
+    return response, create
+
+
+def test_faq_mode_is_stored_per_client_at_creation():
+    """Test de que el modo de FAQs queda en el cliente y no depende del flag global después"""
+    request = CreateClientRequest(
+        name="Hotel", phone_number="+34600000000", phone_number_id="pn_1",
+        faqs=[{"q": "¿Hay parking?", "a": "Sí."}]
+    )
+    session = _async_session()
+    create = MagicMock(return_value="asst_1")
+
+    with patch("src.api.clients.create_assistant", create), \
+            patch("src.api.clients.invalidate_route"), \
+            patch("src.api.clients.settings.faq_retrieval_enabled", True):
+        response = asyncio.run(create_client(request, session))
+
+    assert response.faq_mode == "retrieval"
+    assert create.call_args.kwargs["embed_faqs"] is False
+    assert session.add.call_args[0][0].faq_mode == "retrieval"
+
+
+def test_patch_faqs_rebuilds_an_assistant_with_embedded_faqs():
+    """Test de que cambiar las FAQs regenera el assistant que las lleva en sus instrucciones"""
+    request = UpdateClientRequest(faqs=[{"q": "¿Hay wifi?", "a": "Sí, gratis."}])
+
+    response, create = _patch(_faq_client("embedded"), request)
+
+    create.assert_called_once_with([{"q": "¿Hay wifi?", "a": "Sí, gratis."}], embed_faqs=True)
+    assert response.assistant_id == "asst_new"
+
+
+def test_patch_faqs_keeps_the_assistant_with_retrieval():
+    """Test de que con recuperación las FAQs nuevas llegan por run sin tocar el assistant"""
+    request = UpdateClientRequest(faqs=[{"q": "¿Hay wifi?", "a": "Sí, gratis."}])
+
+    response, create = _patch(_faq_client("retrieval"), request)
+
+    create.assert_not_called()
+    assert response.assistant_id == "asst_old"
+
+
+def test_patch_faq_mode_swaps_the_assistant():
+    """Test de que cambiar el modo crea el assistant con o sin las FAQs en las instrucciones"""
+    response, create = _patch(_faq_client("retrieval"), UpdateClientRequest(faq_mode="embedded"))
+
+    create.assert_called_once_with([{"q": "¿Hay parking?", "a": "Sí."}], embed_faqs=True)
+    assert (response.assistant_id, response.faq_mode) == ("asst_new", "embedded")
@@ -0,0 +1,139 @@
+from contextlib import ExitStack
+from unittest.mock import patch
+from src.core.coalescing import ConversationCoalescer, merge_jobs
+from src.tasks import _coalesce_jobs, flush_conversation
+
+
+class FakeRedis:
+    """Redis en memoria con los comandos que usa la agrupación (sin caducidad)"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        data = self.redis.data
+        results = []
+        for name, args, kwargs in self.commands:
+            if name == "rpush":
+                data.setdefault(args[0], []).append(args[1].encode())
+                results.append(len(data[args[0]]))
+            elif name == "set":
+                if kwargs.get("nx") and args[0] in data:
+                    results.append(None)
+                else:
+                    data[args[0]] = str(args[1]).encode()
+                    results.append(True)
+            elif name == "lrange":
+                results.append(list(data.get(args[0], [])))
+            elif name == "delete":
+                results.append(sum(1 for key in args if data.pop(key, None) is not None))
+            else:
+                results.append(True)
+        return results
+
+
+def _job(text, message_id):
+    return {"agent_id": "asst_1", "phone_number_id": "pn_1", "wa_id": "34600", "text": text, "message_id": message_id}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _patched(stack, redis, clock):
+    stack.enter_context(patch("src.core.coalescing.get_redis", return_value=redis))
+    stack.enter_context(patch("src.core.coalescing.time.time", clock))
+    stack.enter_context(patch("src.tasks.settings.coalesce_window_seconds", 2))
+    stack.enter_context(patch("src.tasks.settings.coalesce_max_wait_seconds", 10))
+    schedule = stack.enter_context(patch.object(flush_conversation, "apply_async"))
+    handle = stack.enter_context(patch("src.tasks.handle_message.apply_async"))
+    return schedule, handle
+
+
+def test_messages_within_the_window_produce_a_single_run():
+    """Test de que varios mensajes seguidos se responden con una sola tarea"""
+    redis, clock = FakeRedis(), Clock()
+
+    with ExitStack() as stack:
+        schedule, handle = _patched(stack, redis, clock)
+        assert _coalesce_jobs([_job("hola", "wamid.1")]) == []
+        clock.now += 1
+        assert _coalesce_jobs([_job("quería reservar", "wamid.2")]) == []
+        clock.now += 1
+        assert _coalesce_jobs([_job("para mañana", "wamid.3")]) == []
+
+        # Solo el primer mensaje programa el flush
+        schedule.assert_called_once()
+
+        # Al vencer la primera cuenta atrás la conversación no lleva 2 s en silencio
+        assert flush_conversation("pn_1", "34600")["status"] == "rescheduled"
+        clock.now += 2
+        assert flush_conversation("pn_1", "34600") == {"status": "flushed", "messages": 3}
+
+    handle.assert_called_once()
+    merged = handle.call_args.kwargs["kwargs"]
+    assert merged["text"] == "hola\nquería reservar\npara mañana"
+    assert merged["message_id"] == "wamid.3"
+
+
+def test_message_after_the_window_starts_a_new_one():
+    """Test de que un mensaje posterior al flush abre otra ventana y otra tarea"""
+    redis, clock = FakeRedis(), Clock()
+
+    with ExitStack() as stack:
+        schedule, handle = _patched(stack, redis, clock)
+        _coalesce_jobs([_job("hola", "wamid.1")])
+        clock.now += 2
+        flush_conversation("pn_1", "34600")
+
+        clock.now += 5
+        _coalesce_jobs([_job("¿sigue abierto?", "wamid.2")])
+        clock.now += 2
+        flush_conversation("pn_1", "34600")
+
+    assert schedule.call_count == 2
+    assert [c.kwargs["kwargs"]["text"] for c in handle.call_args_list] == ["hola", "¿sigue abierto?"]
+
+
+def test_max_wait_closes_a_window_that_never_goes_quiet():
+    """Test de que una conversación que no para de escribir se vacía al llegar a max_wait"""
+    redis, clock = FakeRedis(), Clock()
+    coalescer = ConversationCoalescer(window=2, max_wait=5)
+
+    with patch("src.core.coalescing.get_redis", return_value=redis), \
+            patch("src.core.coalescing.time.time", clock):
+        for i in range(6):
+            coalescer.push(_job(f"m{i}", f"wamid.{i}"))
+            clock.now += 1
+            if i < 4:
+                assert coalescer.remaining("pn_1", "34600") > 0
+
+        assert coalescer.remaining("pn_1", "34600") == 0
+        assert len(coalescer.drain("pn_1", "34600")) == 6
+        assert coalescer.remaining("pn_1", "34600") == 0
+
+
+def test_merge_keeps_last_message_metadata():
+    """Test de que el job combinado une los textos y conserva los datos del último mensaje"""
+    merged = merge_jobs([_job("a", "wamid.1"), _job("b", "wamid.2")])
+
+    assert merged == _job("a\nb", "wamid.2")
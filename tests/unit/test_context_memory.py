@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from src.core.context_memory import ContextMemory, history_cursor
+
+
+def _message(message_id, role, text):
+    part = SimpleNamespace(type="text", text=SimpleNamespace(value=text))
+    return SimpleNamespace(id=message_id, role=role, content=[part])
+
+
+def test_thread_below_budget_is_not_summarized():
+    """Test de que sin resumen previo solo se resume al superar el presupuesto"""
+    memory = ContextMemory(token_budget=1000, keep_messages=2)
+    openai = MagicMock()
+
+    with patch.object(memory, "get", return_value=None), patch.object(memory, "_openai", return_value=openai):
+        assert memory.compact_thread("thread_1", "pn_1", "34600", prompt_tokens=500) is False
+
+    openai.beta.threads.messages.list.assert_not_called()
+
+
+def test_thread_folds_messages_before_they_leave_the_window():
+    """Test de que se resumen los mensajes no resumidos salvo los últimos keep_messages"""
+    memory = ContextMemory(token_budget=1000, keep_messages=2)
+    openai = MagicMock()
+    # Del más reciente al más antiguo; msg_1 ya está en el resumen
+    openai.beta.threads.messages.list.return_value = [
+        _message("msg_5", "assistant", "d"),
+        _message("msg_4", "user", "c"),
+        _message("msg_3", "assistant", "b"),
+        _message("msg_2", "user", "a"),
+        _message("msg_1", "assistant", "ya resumido"),
+    ]
+
+    with patch.object(memory, "get", return_value=("resumen", "msg_1")), \
+            patch.object(memory, "_count_turn", return_value=4), \
+            patch.object(memory, "_reset_turns"), \
+            patch.object(memory, "_openai", return_value=openai), \
+            patch.object(memory, "_summarize_chunk", return_value="resumen nuevo") as summarize, \
+            patch.object(memory, "save") as save:
+        assert memory.compact_thread("thread_1", "pn_1", "34600") is True
+
+    summarize.assert_called_once_with("resumen", [("user", "a"), ("assistant", "b")])
+    save.assert_called_once_with("pn_1", "34600", "assistants", "resumen nuevo", "msg_3")
+
+
+def test_long_history_is_summarized_in_chunks():
+    """Test de que un historial largo se resume por tramos del presupuesto"""
+    memory = ContextMemory(token_budget=10, keep_messages=2)
+    turns = [("user", "x" * 12), ("assistant", "y" * 12), ("user", "z" * 12)]
+
+    with patch.object(memory, "_summarize_chunk", side_effect=lambda previous, chunk: previous + "+") as summarize:
+        assert memory.summarize(None, turns) == "++"
+
+    assert summarize.call_count == 2
+
+
+def test_summary_from_the_other_engine_is_ignored():
+    """Test de que tras cambiar de motor no se usa el cursor del otro (IDs msg_… en el historial local)"""
+    memory = ContextMemory(token_budget=1000, keep_messages=2)
+    session = MagicMock()
+
+    session.execute.return_value.first.return_value = ("resumen", "msg_3", "assistants")
+    assert memory.get("pn_1", "34600", "chat", session) is None
+    assert memory.get("pn_1", "34600", "assistants", session) == ("resumen", "msg_3")
+
+    # Resúmenes sin motor guardado: se deduce del formato del cursor
+    session.execute.return_value.first.return_value = ("resumen", "msg_3", None)
+    assert memory.get("pn_1", "34600", "chat", session) is None
+    session.execute.return_value.first.return_value = ("resumen", "42", None)
+    assert memory.get("pn_1", "34600", "chat", session) == ("resumen", "42")
+
+
+def test_history_cursor_fails_safe():
+    """Test de que un cursor ilegible equivale a no tener cursor"""
+    assert history_cursor("42") == 42
+    assert history_cursor(None) == 0
+    assert history_cursor("msg_abc") == 0
+
+
+def test_summarized_thread_is_not_listed_far_from_budget_and_window():
+    """Test de que con resumen previo no se lista el thread en cada mensaje"""
+    memory = ContextMemory(token_budget=1000, keep_messages=5)
+    openai = MagicMock()
+
+    with patch.object(memory, "get", return_value=("resumen", "msg_1")), \
+            patch.object(memory, "_count_turn", return_value=0), \
+            patch.object(memory, "_openai", return_value=openai):
+        assert memory.compact_thread("thread_1", "pn_1", "34600", prompt_tokens=300) is False
+        openai.beta.threads.messages.list.assert_not_called()
+
+        # Cerca del presupuesto sí se lista
+        openai.beta.threads.messages.list.return_value = []
+        memory.compact_thread("thread_1", "pn_1", "34600", prompt_tokens=900)
+        openai.beta.threads.messages.list.assert_called_once()
@@ -0,0 +1,126 @@
+from contextlib import ExitStack
+from unittest.mock import patch
+import pytest
+from redis.lock import Lock
+from src.core.conversation_lock import ConversationBusy, conversation_lease
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Redis en memoria con SET NX PX y el script de liberación de redis.lock.Lock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def _alive(self, name):
+        entry = self.data.get(name)
+        if entry and entry[1] is not None and entry[1] <= self.clock():
+            del self.data[name]
+            entry = None
+        return entry
+
+    def set(self, name, value, nx=False, px=None):
+        if nx and self._alive(name):
+            return None
+        self.data[name] = (value, self.clock() + px / 1000 if px else None)
+        return True
+
+    def get(self, name):
+        entry = self._alive(name)
+        return entry[0] if entry else None
+
+    def register_script(self, script):
+        return FakeScript(script)
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return _Lock(self, name, timeout=timeout, blocking_timeout=blocking_timeout, sleep=0.01)
+
+
+class FakeScript:
+    def __init__(self, script):
+        self.script = script
+
+    def __call__(self, keys, args, client):
+        # Liberación: solo borra la clave si el token sigue siendo el del dueño
+        if self.script == Lock.LUA_RELEASE_SCRIPT and client.get(keys[0]) == args[0]:
+            del client.data[keys[0]]
+            return 1
+        return 0
+
+
+class _Lock(Lock):
+    # Scripts propios: Lock los cachea a nivel de clase (se ejecutan sobre `client`)
+    lua_release = None
+    lua_extend = None
+    lua_reacquire = None
+
+
+KEY = "conv-lease:pn_1:34600"
+
+
+def _patched(stack, redis):
+    stack.enter_context(patch("src.core.conversation_lock.get_redis", return_value=redis))
+    stack.enter_context(patch("src.core.conversation_lock.settings.conversation_lease_seconds", 60))
+    stack.enter_context(patch("src.core.conversation_lock.settings.conversation_lease_wait_seconds", 0.05))
+
+
+def test_lease_is_held_while_processing_and_released_after():
+    """Test de que el lease existe mientras se procesa y se libera al terminar"""
+    redis = FakeRedis(Clock())
+
+    with ExitStack() as stack:
+        _patched(stack, redis)
+        with conversation_lease("pn_1", "34600"):
+            assert redis.get(KEY) is not None
+
+    assert redis.get(KEY) is None
+
+
+def test_second_task_of_the_same_conversation_is_busy():
+    """Test de contención: la misma conversación no se procesa en paralelo, otra sí"""
+    redis = FakeRedis(Clock())
+
+    with ExitStack() as stack:
+        _patched(stack, redis)
+        with conversation_lease("pn_1", "34600"):
+            with pytest.raises(ConversationBusy):
+                with conversation_lease("pn_1", "34600"):
+                    pass
+
+            with conversation_lease("pn_1", "34601"):
+                assert redis.get("conv-lease:pn_1:34601") is not None
+
+
+def test_expired_lease_is_taken_and_not_released_by_the_old_owner():
+    """Test de expiración: otro worker toma el lease y el dueño anterior no se lo quita"""
+    clock = Clock()
+    redis = FakeRedis(clock)
+
+    with ExitStack() as stack:
+        _patched(stack, redis)
+        with conversation_lease("pn_1", "34600"):
+            # El worker se queda colgado más que conversation_lease_seconds
+            clock.now += 61
+            stack.enter_context(conversation_lease("pn_1", "34600"))
+            new_owner_token = redis.get(KEY)
+        # Al salir, el primer worker intenta liberar un lease que ya no es suyo
+        assert redis.get(KEY) == new_owner_token
+
+    assert redis.get(KEY) is None
+
+
+def test_without_redis_processing_continues_without_lease():
+    """Test de que sin Redis se procesa igualmente (comportamiento anterior)"""
+    with patch("src.core.conversation_lock.get_redis", side_effect=ConnectionError("redis caído")):
+        with conversation_lease("pn_1", "34600"):
+            processed = True
+
+    assert processed
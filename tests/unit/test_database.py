@@ -0,0 +1,50 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.core.database import DatabaseManager
+
+
+def test_async_url_moves_libpq_ssl_params_to_connect_args():
+    """Test de que la URL de psycopg2 se traduce a asyncpg sin parámetros libpq"""
+    manager = DatabaseManager()
+
+    url, connect_args = manager._to_async_url(
+        "postgresql://user:pass@db:5432/bot?sslmode=require&sslcert=&sslkey=&sslrootcert="
+    )
+
+    assert url == "postgresql+asyncpg://user:pass@db:5432/bot"
+    assert connect_args["ssl"] == "require"
+
+
+def test_async_sessions_come_from_the_asyncpg_engine():
+    """Test de que el engine asíncrono usa asyncpg y entrega AsyncSession sin expirar al hacer commit"""
+    manager = DatabaseManager()
+    manager._initialized = True
+
+    assert manager._initialize_async("postgresql://user:pass@db:5432/bot?sslmode=disable") is True
+    try:
+        assert manager.async_engine.url.drivername == "postgresql+asyncpg"
+        session = manager.get_async_session()
+        assert isinstance(session, AsyncSession)
+        assert session.sync_session.expire_on_commit is False
+    finally:
+        asyncio.run(manager.close_async())
+
+
+def test_create_tables_does_not_migrate_on_startup(monkeypatch):
+    """Test de que el arranque solo crea tablas: las migraciones van en scripts/migrate.py"""
+    manager = DatabaseManager()
+    manager._initialized = True
+    manager.engine = MagicMock()
+    monkeypatch.delenv("DB_AUTO_MIGRATE", raising=False)
+
+    with patch("src.core.database.SQLModel.metadata.create_all"), \
+            patch.object(manager, "_add_missing_columns") as add_columns, \
+            patch.object(manager, "_add_missing_indexes") as add_indexes:
+        assert manager.create_tables() is True
+        add_columns.assert_not_called()
+        add_indexes.assert_not_called()
+
+        assert manager.migrate() is True
+        add_columns.assert_called_once_with()
+        add_indexes.assert_called_once_with()
@@ -0,0 +1,62 @@
+import json
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+from src.main import app
+
+
+class FakeAsyncSession:
+    """AsyncSession simulada: registra si se devolvió al pool"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    async def execute(self, *args, **kwargs):
+        raise RuntimeError("consulta fallida")
+
+
+STATUS_PAYLOAD = json.dumps({
+    "object": "whatsapp_business_account",
+    "entry": [{"id": "102290129340398", "changes": [{
+        "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "34600000000", "phone_number_id": "pn_1"},
+            "statuses": [{"id": "wamid.1", "status": "delivered", "timestamp": "1", "recipient_id": "34600"}]
+        },
+        "field": "messages"
+    }]}]
+})
+
+
+def test_routes_without_database_do_not_check_out_a_session():
+    """Test de que /health, /, la verificación y los estados no piden conexión al pool"""
+    checkout = MagicMock(side_effect=AssertionError("sesión creada sin necesidad"))
+    client = TestClient(app)
+
+    with patch("src.core.database.db_manager.get_async_session", checkout), \
+            patch("src.main.health_check", return_value=True), \
+            patch("src.api.webhook.settings.verify_token", "secreto"):
+        assert client.get("/").status_code == 200
+        assert client.get("/health").status_code == 200
+        verify = client.get("/webhook", params={"hub.mode": "subscribe", "hub.verify_token": "secreto", "hub.challenge": "42"})
+        assert verify.text == "42"
+        assert client.post("/webhook", content=STATUS_PAYLOAD).status_code == 200
+
+    checkout.assert_not_called()
+
+
+def test_session_is_closed_when_the_endpoint_fails():
+    """Test de que la sesión vuelve al pool aunque el endpoint lance una excepción"""
+    session = FakeAsyncSession()
+    client = TestClient(app, raise_server_exceptions=False)
+
+    with patch("src.core.database.db_manager.get_async_session", return_value=session):
+        response = client.get("/clients/1")
+
+    assert response.status_code == 500
+    assert session.closed is True
@@ -0,0 +1,30 @@
+import asyncio
+from src.core.dedup import MessageDeduplicator
+
+
+def test_second_delivery_is_duplicate():
+    """Test de que un reintento con el mismo wamid se descarta"""
+    dedup = MessageDeduplicator(ttl=60)
+
+    assert asyncio.run(dedup.is_duplicate("wamid.1")) is False
+    assert asyncio.run(dedup.is_duplicate("wamid.1")) is True
+    assert asyncio.run(dedup.is_duplicate("wamid.2")) is False
+
+
+def test_registry_is_bounded():
+    """Test de que el registro no crece por encima del máximo"""
+    dedup = MessageDeduplicator(ttl=60, max_entries=2)
+
+    for message_id in ["a", "b", "c"]:
+        asyncio.run(dedup.is_duplicate(message_id))
+
+    assert len(dedup._seen) == 2
+    assert asyncio.run(dedup.is_duplicate("a")) is False
+
+
+def test_messages_without_id_are_never_duplicates():
+    """Test de mensajes sin ID"""
+    dedup = MessageDeduplicator(ttl=60)
+
+    assert asyncio.run(dedup.is_duplicate(None)) is False
+    assert asyncio.run(dedup.is_duplicate(None)) is False
@@ -0,0 +1,112 @@
+import json
+from unittest.mock import patch
+from src.core.faq_matcher import FAQMatcher, FAQRegistry, normalize
+
+FAQS = [
+    {"q": "¿Cuál es el horario de atención?", "a": "De lunes a viernes de 9 a 18 h."},
+    {"q": "¿Hacen envíos a domicilio?", "a": "Sí, enviamos a toda la península."},
+    {"q": "¿Cómo puedo cancelar mi pedido?", "a": "Desde 'Mis pedidos' en la web."},
+    {"q": "¿Cuál es el precio del plan básico?", "a": "El plan básico cuesta 10 € al mes."},
+]
+
+
+def test_normalize_removes_accents_and_punctuation():
+    """Test de normalización de texto"""
+    assert normalize("¿Cuál es el HORARIO?") == "cual es el horario"
+
+
+def test_verbatim_and_near_verbatim_questions_match():
+    """Test de que las preguntas literales (con erratas menores) coinciden"""
+    matcher = FAQMatcher(FAQS)
+
+    faq, score = matcher.match("cual es el horario de atencion")
+    assert faq["a"] == FAQS[0]["a"]
+    assert score > 0.95
+
+    faq, score = matcher.match("Hacen envios a domicilio??")
+    assert faq["a"] == FAQS[1]["a"]
+    assert score > 0.9
+
+
+def test_unrelated_message_scores_low():
+    """Test de que un mensaje sin relación no supera el umbral"""
+    matcher = FAQMatcher(FAQS)
+
+    _, score = matcher.match("Quiero hablar con una persona sobre una factura")
+
+    assert score < 0.5
+
+
+def test_registry_reuses_index_when_faqs_do_not_change():
+    """Test de que el registro no reconstruye un índice con las mismas FAQs"""
+    registry = FAQRegistry(ttl=60)
+    raw = json.dumps(FAQS)
+
+    first = registry.register("pn_1", raw)
+    second = registry.register("pn_1", raw)
+
+    assert first is second
+    assert registry.get("pn_1") is first
+
+
+def test_top_k_returns_most_relevant_faqs_in_order():
+    """Test de recuperación de las FAQs más parecidas"""
+    matcher = FAQMatcher(FAQS)
+
+    relevant = matcher.top_k("¿a qué hora abren? ¿cuál es el horario?", k=2)
+
+    assert len(relevant) == 2
+    assert relevant[0][0] == FAQS[0]
+    assert relevant[0][1] >= relevant[1][1]
+
+
+def test_rebuild_reuses_unchanged_questions():
+    """Test de reconstrucción incremental al editar las FAQs"""
+    original = FAQMatcher(FAQS)
+    updated_faqs = FAQS[:2] + [{"q": "¿Aceptan pago con tarjeta?", "a": "Sí, todas las tarjetas."}]
+
+    updated = FAQMatcher(updated_faqs, previous=original)
+
+    assert updated.reused == 2
+    faq, score = updated.match("aceptan pago con tarjeta")
+    assert faq["a"] == "Sí, todas las tarjetas."
+    assert score > 0.95
+
+
+def test_near_miss_question_is_not_answered_locally():
+    """Test de que las palabras que no están en la FAQ bajan la similitud"""
+    matcher = FAQMatcher(FAQS)
+
+    faq, score = matcher.match("cual es el precio del plan premium")
+
+    assert faq == FAQS[3]
+    assert score < 0.85
+
+
+def test_negated_question_is_not_answered_with_affirmative_faq():
+    """Test de que una pregunta negada no recibe la respuesta de la FAQ afirmativa"""
+    registry = FAQRegistry(ttl=60)
+    registry.register("pn_1", json.dumps(FAQS))
+
+    with patch("src.core.faq_matcher.settings.faq_match_threshold", 0.85):
+        assert registry.answer("pn_1", "¿Hacen envíos a domicilio?") == FAQS[1]["a"]
+        assert registry.answer("pn_1", "no hacen envios a domicilio?") is None
+
+
+def test_retrieval_follows_the_client_mode_and_is_never_empty():
+    """Test de que los runs solo reciben FAQs si el assistant del cliente no las tiene, y siempre alguna"""
+    registry = FAQRegistry(ttl=60)
+    registry.register("pn_1", json.dumps(FAQS))
+    registry.register("pn_2", json.dumps(FAQS), retrieval=True)
+
+    # El flag global solo decide el modo de los clientes nuevos
+    with patch("src.core.faq_matcher.settings.faq_retrieval_enabled", True):
+        assert registry.instructions_for("pn_1", "¿hacen envíos?") is None
+
+    with patch("src.core.faq_matcher.settings.faq_retrieval_enabled", False), \
+            patch("src.core.faq_matcher.settings.faq_retrieval_top_k", 2), \
+            patch("src.core.faq_matcher.settings.faq_retrieval_min_score", 0.99):
+        instructions = registry.instructions_for("pn_2", "xyzw")
+
+    assert instructions is not None
+    assert instructions.count("P: ") == 2
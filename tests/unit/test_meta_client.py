@@ -0,0 +1,30 @@
+from unittest.mock import MagicMock, patch
+from src.core.meta_client import MetaClient
+
+
+def test_mark_read_sends_read_status_with_typing_indicator():
+    """Test del payload de confirmación de lectura con indicador de escritura"""
+    http = MagicMock()
+    http.post.return_value = MagicMock(status_code=200)
+
+    with patch("src.core.meta_client._get_sync_http", return_value=http):
+        MetaClient().mark_read_sync("pn_1", "wamid.1")
+
+    payload = http.post.call_args.kwargs["json"]
+    assert payload["status"] == "read"
+    assert payload["message_id"] == "wamid.1"
+    assert payload["typing_indicator"] == {"type": "text"}
+
+
+def test_background_read_receipt_swallows_errors():
+    """Test de que un fallo de la confirmación no llega al llamador"""
+    http = MagicMock()
+    http.post.return_value = MagicMock(status_code=500, text="error")
+
+    with patch("src.core.meta_client._get_sync_http", return_value=http), \
+         patch("src.core.meta_client._background") as background:
+        MetaClient().mark_read_in_background("pn_1", "wamid.1")
+        run = background.submit.call_args[0][0]
+        run()
+
+    assert http.post.call_count == 1
@@ -45,4 +45,53 @@ def test_create_assistant_error(openai_client):
     with pytest.raises(OpenAIError) as excinfo:
         openai_client.create_assistant(faqs)
     
-    assert "Error creando assistant" in str(excinfo.value) 
\ No newline at end of file
+    assert "Error creando assistant" in str(excinfo.value) 
+
+def _event(name, **data):
+    event = MagicMock()
+    event.event = name
+    event.data = MagicMock(**data)
+    return event
+
+
+def _message_event(text):
+    event = _event("thread.message.completed", role="assistant")
+    event.data.content = [MagicMock()]
+    event.data.content[0].text.value = text
+    return event
+
+
+def test_run_assistant_streaming_returns_completed_message(openai_client):
+    """Test de que el streaming entrega la respuesta sin sondear el run"""
+    openai_client.client.beta.threads.runs.create.return_value = MagicMock(
+        __iter__=lambda self: iter([
+            _event("thread.run.created", id="run_1"),
+            _message_event("Hola!"),
+            _event("thread.run.completed", status="completed"),
+        ])
+    )
+    replies = []
+
+    with patch("src.core.openai_client.settings.openai_streaming", True):
+        reply = openai_client.run_assistant("thread_1", "asst_1", on_reply=replies.append)
+
+    assert reply == "Hola!"
+    assert replies == ["Hola!"]
+    openai_client.client.beta.threads.runs.retrieve.assert_not_called()
+
+
+def test_run_assistant_falls_back_to_polling(openai_client):
+    """Test de respaldo por polling cuando no se puede abrir el stream"""
+    openai_client.client.beta.threads.runs.create.side_effect = [
+        Exception("stream no disponible"),
+        MagicMock(id="run_1", status="queued"),
+    ]
+    openai_client.client.beta.threads.runs.retrieve.return_value = MagicMock(status="completed")
+    message = MagicMock()
+    message.content[0].text.value = "Respuesta"
+    openai_client.client.beta.threads.messages.list.return_value = MagicMock(data=[message])
+
+    with patch("src.core.openai_client.settings.openai_streaming", True):
+        reply = openai_client.run_assistant("thread_1", "asst_1")
+
+    assert reply == "Respuesta"
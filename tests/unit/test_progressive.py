@@ -0,0 +1,44 @@
+from src.core.progressive import ProgressiveReply
+
+
+def _stream(reply, text, size=7):
+    for i in range(0, len(text), size):
+        reply.feed(text[i:i + size])
+
+
+def test_first_paragraph_is_sent_before_the_message_completes():
+    """Test de que un párrafo completo se envía mientras sigue el streaming"""
+    sent = []
+    reply = ProgressiveReply(sent.append, min_chars=40)
+    first = "**Horario**: abrimos de lunes a viernes de 9 a 18 h."
+    text = first + "\n\nLos sábados abrimos solo por la mañana, de 10 a 14 h."
+
+    _stream(reply, text[:len(first) + 10])
+    assert sent == ["*Horario*: abrimos de lunes a viernes de 9 a 18 h."]
+
+    formatted = reply.finish(text)
+    assert sent[-1] == "Los sábados abrimos solo por la mañana, de 10 a 14 h."
+    assert formatted.startswith("*Horario*")
+
+
+def test_small_chunks_and_open_formatting_wait():
+    """Test de que no se envían trozos pequeños ni con formato sin cerrar"""
+    sent = []
+    reply = ProgressiveReply(sent.append, min_chars=40)
+
+    _stream(reply, "Hola.\n\nSí.\n\n**Nota importante sobre")
+    assert sent == []
+
+    reply.finish("Hola.\n\nSí.\n\n**Nota importante sobre** pedidos.")
+    assert sent == ["Hola.\n\nSí.\n\n*Nota importante sobre* pedidos."]
+
+
+def test_resume_skips_already_delivered_text():
+    """Test de reanudación desde el offset guardado en el checkpoint"""
+    sent = []
+    text = "Primer párrafo ya enviado.\n\nSegundo párrafo pendiente."
+    reply = ProgressiveReply(sent.append, min_chars=10, offset=text.index("Segundo"))
+
+    reply.finish(text)
+
+    assert sent == ["Segundo párrafo pendiente."]
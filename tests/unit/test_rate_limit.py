@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+from src.core.rate_limit import TokenBucketLimiter, admit_message
+
+
+def test_bucket_rejects_after_capacity():
+    """Test de que el bucket rechaza al agotar su capacidad"""
+    limiter = TokenBucketLimiter()
+
+    results = [asyncio.run(limiter.allow("sender:pn_1:34600", 3)) for _ in range(4)]
+
+    assert results == [True, True, True, False]
+
+
+def test_buckets_are_independent():
+    """Test de que un remitente bloqueado no afecta a otro"""
+    limiter = TokenBucketLimiter()
+    asyncio.run(limiter.allow("sender:pn_1:34600", 1))
+
+    assert asyncio.run(limiter.allow("sender:pn_1:34600", 1)) is False
+    assert asyncio.run(limiter.allow("sender:pn_1:34601", 1)) is True
+
+
+def test_zero_limit_disables_control():
+    """Test de que un límite 0 desactiva el control"""
+    limiter = TokenBucketLimiter()
+
+    assert all(asyncio.run(limiter.allow("tenant:pn_1", 0)) for _ in range(100))
+
+
+def test_client_zero_limit_means_unlimited_not_default():
+    """Test de que un 0 por cliente desactiva el límite en vez de heredar el global"""
+    route = SimpleNamespace(phone_number_id="pn_1", rate_limit_per_minute=0, sender_rate_limit_per_minute=0)
+    inherited = SimpleNamespace(phone_number_id="pn_2", rate_limit_per_minute=None, sender_rate_limit_per_minute=None)
+
+    with patch("src.core.rate_limit.rate_limiter", TokenBucketLimiter()), \
+            patch("src.core.rate_limit.settings.sender_rate_limit_per_minute", 2):
+        assert all(asyncio.run(admit_message(route, "34600")) for _ in range(10))
+        assert [asyncio.run(admit_message(inherited, "34600")) for _ in range(3)] == [True, True, False]
@@ -0,0 +1,50 @@
+import httpx
+import openai
+from src.core.meta_client import MetaError
+from src.core.openai_client import OpenAIError
+from src.core.retry_policy import classify_error, backoff_delay, PERMANENT, RATE_LIMIT, TRANSIENT
+
+
+def test_classify_meta_errors_by_status():
+    """Test de clasificación por código HTTP de la Graph API"""
+    assert classify_error(MetaError("rate", 429)) == RATE_LIMIT
+    assert classify_error(MetaError("token", 401)) == PERMANENT
+    assert classify_error(MetaError("caído", 503)) == TRANSIENT
+    assert classify_error(MetaError("Timeout al enviar mensaje")) == TRANSIENT
+
+
+def test_classify_uses_cause_chain():
+    """Test de que un error envuelto se clasifica por su causa"""
+    try:
+        try:
+            raise MetaError("rate", 429)
+        except MetaError as e:
+            raise OpenAIError("envuelto") from e
+    except OpenAIError as wrapped:
+        assert classify_error(wrapped) == RATE_LIMIT
+
+
+def test_backoff_grows_and_is_capped():
+    """Test de backoff exponencial con jitter y tope"""
+    first = backoff_delay(TRANSIENT, 0)
+    assert 2.5 <= first <= 5
+    assert 10 <= backoff_delay(TRANSIENT, 2) <= 20
+    assert backoff_delay(RATE_LIMIT, 20) <= 300
+
+
+def _openai_error(cls, status, message):
+    response = httpx.Response(status, request=httpx.Request("POST", "https://api.openai.com/v1/threads/thread_1/messages"))
+    return cls(message, response=response, body=None)
+
+
+def test_active_run_conflicts_are_retried():
+    """Test de que un 400 por run activo se reintenta y una petición inválida no"""
+    active_run = _openai_error(
+        openai.BadRequestError, 400,
+        "Can't add messages to thread_1 while a run run_1 is active."
+    )
+    invalid = _openai_error(openai.BadRequestError, 400, "Invalid value for 'model'")
+
+    assert classify_error(active_run) == TRANSIENT
+    assert classify_error(_openai_error(openai.ConflictError, 409, "Conflict")) == TRANSIENT
+    assert classify_error(invalid) == PERMANENT
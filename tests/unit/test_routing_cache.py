@@ -0,0 +1,55 @@
+import asyncio
+from unittest.mock import MagicMock
+from src.core.models import Client
+from src.core.routing_cache import TenantRoutingCache
+
+
+def _session_returning(client):
+    """Sesión falsa cuyo execute devuelve siempre el cliente indicado"""
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = client
+    session = MagicMock()
+
+    async def execute(*args, **kwargs):
+        return result
+
+    session.execute = MagicMock(side_effect=execute)
+    return session
+
+
+def test_resolve_uses_cache_after_first_lookup():
+    """Test de que la segunda resolución no consulta la base de datos"""
+    cache = TenantRoutingCache(ttl=60)
+    client = Client(id=1, name="Demo", phone_number="+34123", phone_number_id="pn_1", assistant_id="asst_1")
+    session = _session_returning(client)
+
+    first = asyncio.run(cache.resolve("pn_1", session))
+    second = asyncio.run(cache.resolve("pn_1", session))
+
+    assert first.assistant_id == "asst_1"
+    assert second == first
+    assert session.execute.call_count == 1
+
+
+def test_invalidate_forces_new_lookup():
+    """Test de que invalidar una ruta vuelve a consultar la base de datos"""
+    cache = TenantRoutingCache(ttl=60)
+    client = Client(id=1, name="Demo", phone_number="+34123", phone_number_id="pn_1", assistant_id="asst_1")
+    session = _session_returning(client)
+
+    asyncio.run(cache.resolve("pn_1", session))
+    cache.invalidate("pn_1")
+    asyncio.run(cache.resolve("pn_1", session))
+
+    assert session.execute.call_count == 2
+
+
+def test_expired_entry_is_a_miss():
+    """Test de expiración por TTL"""
+    cache = TenantRoutingCache(ttl=-1)
+    cache.set("pn_1", None)
+
+    hit, route = cache.get("pn_1")
+
+    assert hit is False
+    assert route is None
@@ -0,0 +1,62 @@
+import json
+import time
+from unittest.mock import patch
+from src.core.run_latency import RunLatencyModel, merge_published
+
+
+def _trained_model():
+    model = RunLatencyModel(min_interval=0.25, max_interval=2.0)
+    for duration in [4.0, 5.0, 5.0, 6.0, 6.0, 6.0, 7.0, 7.0, 8.0, 9.0]:
+        model.observe("asst_1", duration)
+    return model
+
+
+def test_default_interval_without_history():
+    """Test de que sin historial se mantiene el intervalo clásico"""
+    model = RunLatencyModel()
+
+    assert model.next_interval("asst_nuevo", 0.0) == 0.5
+
+
+def test_sparse_early_and_dense_near_expected_completion():
+    """Test de sondeo escaso al principio y denso cerca del final esperado"""
+    model = _trained_model()
+
+    assert model.next_interval("asst_1", 0.5) == 2.0
+    assert model.next_interval("asst_1", 6.0) == 0.25
+
+
+def test_snapshot_exposes_histogram():
+    """Test de métricas del histograma"""
+    model = _trained_model()
+    model.count_poll("asst_1")
+
+    metrics = model.snapshot()["asst_1"]
+
+    assert metrics["runs"] == 10
+    assert metrics["polls"] == 1
+    assert sum(metrics["histogram"].values()) == 10
+
+
+def test_snapshot_is_logged_every_n_runs_after_window_fills():
+    """Test de que el log periódico no se dispara en cada run al llenarse la ventana"""
+    model = RunLatencyModel(window=5, log_every=100, publish_interval=3600)
+    model._published_at = float("inf")
+
+    with patch.object(model, "snapshot", return_value={}) as snapshot:
+        for _ in range(1000):
+            model.observe("asst_1", 5.0)
+
+    assert snapshot.call_count == 10
+
+
+def test_published_histograms_are_merged_per_assistant():
+    """Test de agregación de las métricas publicadas por varios workers"""
+    model = _trained_model()
+    payload = json.dumps({"updated_at": time.time(), "assistants": model.snapshot()})
+
+    merged = merge_published({b"worker-1:10": payload, b"worker-2:11": payload})
+
+    assert merged["assistants"]["asst_1"]["runs"] == 20
+    assert sum(merged["assistants"]["asst_1"]["histogram"].values()) == 20
+    assert set(merged["workers"]) == {"worker-1:10", "worker-2:11"}
@@ -0,0 +1,51 @@
+import pytest
+from src.core.spool import MessageSpool
+
+
+def test_drain_republishes_spooled_jobs(tmp_path):
+    """Test de que los jobs del spool se republican y el spool queda vacío"""
+    spool = MessageSpool(str(tmp_path / "spool" / "webhook.jsonl"))
+    spool.append([{"wa_id": "1", "text": "hola"}, {"wa_id": "2", "text": "precio"}])
+    published = []
+
+    count = spool.drain(published.extend)
+
+    assert count == 2
+    assert [job["wa_id"] for job in published] == ["1", "2"]
+    assert spool.has_pending() is False
+
+
+def test_failed_drain_keeps_unpublished_jobs(tmp_path):
+    """Test de que un fallo del broker no pierde mensajes"""
+    spool = MessageSpool(str(tmp_path / "webhook.jsonl"))
+    spool.append([{"wa_id": str(i)} for i in range(3)])
+
+    def publish(jobs):
+        raise ConnectionError("broker caído")
+
+    with pytest.raises(ConnectionError):
+        spool.drain(publish, batch_size=1)
+
+    published = []
+    spool.drain(published.extend)
+    assert [job["wa_id"] for job in published] == ["0", "1", "2"]
+
+
+def test_only_one_process_drains_at_a_time(tmp_path):
+    """Test de que un segundo drenador (otro proceso) no republica lo que ya se está drenando"""
+    path = str(tmp_path / "webhook.jsonl")
+    spool, other = MessageSpool(path), MessageSpool(path)
+    spool.append([{"wa_id": "1"}])
+    other_published = []
+
+    def publish(jobs):
+        # Mientras este drenado publica, el otro se salta la vuelta y las escrituras siguen
+        assert other.drain(other_published.extend) == 0
+        other.append([{"wa_id": "2"}])
+
+    assert spool.drain(publish) == 1
+    assert other_published == []
+
+    published = []
+    other.drain(published.extend)
+    assert [job["wa_id"] for job in published] == ["2"]
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from src.api.status_fastpath import StatusCallbackMiddleware, is_status_only
+
+
+# Forma real de Meta: cada change lleva "field": "messages", también los de estados
+STATUS_PAYLOAD = json.dumps({
+    "object": "whatsapp_business_account",
+    "entry": [{"id": "102290129340398", "changes": [{
+        "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "34600000000", "phone_number_id": "pn_1"},
+            "statuses": [{"id": "wamid.1", "status": "delivered", "timestamp": "1", "recipient_id": "34600"}]
+        },
+        "field": "messages"
+    }]}]
+}).encode()
+
+MESSAGE_PAYLOAD = json.dumps({
+    "entry": [{"changes": [{"value": {"messages": [{"id": "wamid.2", "type": "text", "text": {"body": "\"statuses\""}}]}}]}]
+}).encode()
+
+
+def _call(middleware, body):
+    """Ejecuta el middleware con un POST /webhook y devuelve los eventos enviados"""
+    scope = {"type": "http", "method": "POST", "path": "/webhook", "headers": []}
+    sent = []
+    received = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_detects_status_only_payloads():
+    """Test de detección a nivel de bytes"""
+    assert is_status_only(STATUS_PAYLOAD) is True
+    assert is_status_only(MESSAGE_PAYLOAD) is False
+    # Sin espacios (como lo serializa Meta) y con el texto citando la clave
+    assert is_status_only(json.dumps(json.loads(STATUS_PAYLOAD), separators=(",", ":")).encode()) is True
+    assert is_status_only(b'{"statuses":[],"messages":[{"text":{"body":"x"}}]}') is False
+
+
+def test_status_callback_is_acknowledged_without_app():
+    """Test de que los estados se responden sin llegar a la aplicación"""
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope)
+
+    sent = _call(StatusCallbackMiddleware(app), STATUS_PAYLOAD)
+
+    assert calls == []
+    assert sent[0]["status"] == 200
+
+
+def test_messages_are_forwarded_with_body():
+    """Test de que los mensajes llegan intactos a la aplicación"""
+    bodies = []
+
+    async def app(scope, receive, send):
+        bodies.append((await receive())["body"])
+
+    _call(StatusCallbackMiddleware(app), MESSAGE_PAYLOAD)
+
+    assert bodies == [MESSAGE_PAYLOAD]
@@ -0,0 +1,158 @@
+from unittest.mock import MagicMock, patch
+from src.tasks import _get_or_create_thread
+
+
+def _result(first=None, scalar=None):
+    result = MagicMock()
+    result.first.return_value = first
+    result.scalar.return_value = scalar
+    return result
+
+
+def test_existing_thread_is_resolved_in_one_query():
+    """Test de que un thread existente se obtiene con una sola consulta"""
+    session = MagicMock()
+    session.execute.return_value = _result(first=(1, None, "thread_abc"))
+
+    thread_id = _get_or_create_thread(session, "34600", "asst_1", "pn_1")
+
+    assert thread_id == "thread_abc"
+    assert session.execute.call_count == 1
+
+
+def test_concurrent_creation_reuses_winner_thread():
+    """Test de que si otro worker gana la inserción se reutiliza su thread"""
+    session = MagicMock()
+    session.execute.side_effect = [
+        _result(first=(1, None, None)),   # sin thread todavía
+        _result(scalar=None),             # ON CONFLICT DO NOTHING: perdimos la carrera
+        _result(scalar="thread_winner"),  # thread del otro worker
+    ]
+    openai_client = MagicMock()
+    openai_client.client.beta.threads.create.return_value = MagicMock(id="thread_loser")
+
+    with patch("src.tasks.get_openai_client", return_value=openai_client):
+        thread_id = _get_or_create_thread(session, "34600", "asst_1", "pn_1")
+
+    assert thread_id == "thread_winner"
+    openai_client.client.beta.threads.delete.assert_called_once_with("thread_loser")
+
+
+def test_retry_resumes_after_completed_run():
+    """Test de que un reintento con el run ya completado solo reenvía la respuesta"""
+    from src.core import checkpoints
+    from src.core.checkpoints import TaskCheckpoint
+    from src.tasks import _process_message_sync
+
+    checkpoint = TaskCheckpoint(None)
+    checkpoint.mark(checkpoints.MESSAGE_ADDED)
+    checkpoint.mark(checkpoints.RUN_ID, "run_1")
+    checkpoint.mark(checkpoints.REPLY, "Hola")
+    openai_client = MagicMock()
+    meta_client = MagicMock()
+
+    with patch("src.tasks.db_manager"), \
+         patch("src.tasks._get_thread_id", return_value="thread_abc"), \
+         patch("src.tasks.get_openai_client", return_value=openai_client), \
+         patch("src.tasks.MetaClient", return_value=meta_client), \
+         patch("src.tasks.thread_touch_buffer"):
+        result = _process_message_sync("asst_1", "pn_1", "34600", "hola", checkpoint)
+
+    assert result["response"] == "Hola"
+    openai_client.client.beta.threads.messages.create.assert_not_called()
+    openai_client.run_assistant.assert_not_called()
+    meta_client.send_messages_sync.assert_called_once()
+    assert meta_client.send_messages_sync.call_args[0][2] == ["Hola"]
+    assert checkpoint.done(checkpoints.REPLY_SENT)
+
+
+def test_failed_run_discards_run_and_progress_offset():
+    """Test de que tras un run fallido el reintento no recorta la respuesta nueva"""
+    import pytest
+    from src.core import checkpoints
+    from src.core.checkpoints import TaskCheckpoint
+    from src.core.openai_client import OpenAIError
+    from src.tasks import _process_message_sync
+
+    checkpoint = TaskCheckpoint(None)
+    checkpoint.mark(checkpoints.MESSAGE_ADDED)
+    checkpoint.mark(checkpoints.RUN_ID, "run_1")
+    checkpoint.mark(checkpoints.PROGRESS_OFFSET, 120)
+    openai_client = MagicMock()
+    openai_client.run_assistant.side_effect = OpenAIError("Run failed")
+
+    with patch("src.tasks.db_manager"), \
+         patch("src.tasks._get_thread_id", return_value="thread_abc"), \
+         patch("src.tasks.get_openai_client", return_value=openai_client), \
+         patch("src.tasks.MetaClient"), \
+         patch("src.tasks._run_options", return_value={}), \
+         pytest.raises(OpenAIError):
+        _process_message_sync("asst_1", "pn_1", "34600", "hola", checkpoint, progressive_delivery=True)
+
+    assert not checkpoint.done(checkpoints.RUN_ID)
+    assert not checkpoint.done(checkpoints.PROGRESS_OFFSET)
+
+
+def test_busy_requeue_does_not_repeat_the_read_receipt():
+    """Test de que reencolar por lease ocupado no vuelve a marcar como leído"""
+    from src.core.conversation_lock import ConversationBusy
+    from src.tasks import handle_message
+
+    job = {
+        "agent_id": "asst_1", "phone_number_id": "pn_1", "wa_id": "34600",
+        "text": "hola", "message_id": "wamid.1", "read_receipts": True
+    }
+    meta_client = MagicMock()
+
+    with patch("src.tasks.MetaClient", return_value=meta_client), \
+         patch("src.tasks.get_checkpoint"), \
+         patch("src.tasks.conversation_lease", side_effect=ConversationBusy("ocupada")), \
+         patch.object(handle_message, "apply_async") as requeue:
+        handle_message.apply(kwargs=job)
+        requeued = requeue.call_args.kwargs["kwargs"]
+        handle_message.apply(kwargs=requeued)
+
+    assert requeued["receipt_sent"] is True
+    meta_client.mark_read_in_background.assert_called_once_with("pn_1", "wamid.1")
+
+
+def test_context_is_compacted_after_releasing_the_lease():
+    """Test de que el resumen no se hace con el lease de la conversación tomado"""
+    from contextlib import contextmanager
+    from src.tasks import handle_message
+
+    lease = {"held": False}
+    compacted_while_held = []
+
+    @contextmanager
+    def fake_lease(phone_number_id, wa_id):
+        lease["held"] = True
+        yield
+        lease["held"] = False
+
+    response = {"status": "success", "response": "Hola", "thread_id": "thread_1", "prompt_tokens": 7000}
+
+    with patch("src.tasks.get_checkpoint"), \
+         patch("src.tasks.conversation_lease", fake_lease), \
+         patch("src.tasks._process_message_sync", return_value=response), \
+         patch("src.tasks._compact_thread_context", side_effect=lambda *a: compacted_while_held.append(lease["held"])) as compact:
+        handle_message.apply(kwargs={"agent_id": "asst_1", "phone_number_id": "pn_1", "wa_id": "34600", "text": "hola"})
+
+    compact.assert_called_once_with("thread_1", "pn_1", "34600", 7000)
+    assert compacted_while_held == [False]
+
+
+def test_several_messages_are_published_in_one_broker_message():
+    """Test de que un POST con varios mensajes hace una sola publicación al broker"""
+    from src.tasks import dispatch_messages, enqueue_messages, handle_message
+
+    jobs = [{"agent_id": "asst_1", "phone_number_id": "pn_1", "wa_id": str(i), "text": "hola"} for i in range(3)]
+
+    with patch("src.tasks.settings.worker_mode", "celery"), \
+         patch("src.tasks.settings.coalesce_window_seconds", 0), \
+         patch.object(dispatch_messages, "apply_async") as publish_batch, \
+         patch.object(handle_message, "apply_async") as publish_one:
+        enqueue_messages(jobs)
+
+    publish_batch.assert_called_once_with(args=(jobs,), retry=False)
+    publish_one.assert_not_called()
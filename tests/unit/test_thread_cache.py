@@ -0,0 +1,52 @@
+from unittest.mock import MagicMock, patch
+from src.core.thread_cache import ThreadCache
+
+
+def test_lru_evicts_least_recently_used():
+    """Test de que el LRU descarta la conversación menos usada"""
+    cache = ThreadCache(max_entries=2, use_redis=False)
+    cache.set("pn_1", "asst_1", "34600000001", "thread_a")
+    cache.set("pn_1", "asst_1", "34600000002", "thread_b")
+
+    cache.get("pn_1", "asst_1", "34600000001")
+    cache.set("pn_1", "asst_1", "34600000003", "thread_c")
+
+    assert cache.get("pn_1", "asst_1", "34600000001") == "thread_a"
+    assert cache.get("pn_1", "asst_1", "34600000002") is None
+    assert cache.get("pn_1", "asst_1", "34600000003") == "thread_c"
+
+
+def test_invalidate_local_by_phone_number_and_conversation():
+    """Test de invalidación de un número completo o de una sola conversación"""
+    cache = ThreadCache(max_entries=10, use_redis=False)
+    cache.set("pn_1", "asst_1", "34600000001", "thread_a")
+    cache.set("pn_1", "asst_1", "34600000002", "thread_b")
+    cache.set("pn_2", "asst_2", "34600000001", "thread_c")
+
+    cache.invalidate_local("pn_1", "34600000001")
+    assert cache.get("pn_1", "asst_1", "34600000001") is None
+    assert cache.get("pn_1", "asst_1", "34600000002") == "thread_b"
+
+    cache.invalidate_local("pn_1")
+    assert cache.get("pn_1", "asst_1", "34600000002") is None
+    assert cache.get("pn_2", "asst_2", "34600000001") == "thread_c"
+
+
+def test_redis_hash_expires_and_is_bounded():
+    """Test de que el hash compartido caduca y se vacía al superar el máximo de conversaciones"""
+    cache = ThreadCache(max_entries=10, redis_ttl=3600, redis_max_fields=2)
+    redis = MagicMock()
+    pipe = redis.pipeline.return_value
+
+    with patch("src.core.redis_client.get_redis", return_value=redis):
+        pipe.execute.return_value = [1, True, 2]
+        cache.set("pn_1", "asst_1", "34600000001", "thread_a")
+        pipe.expire.assert_called_with("thread_cache:pn_1", 3600)
+        redis.delete.assert_not_called()
+
+        pipe.execute.return_value = [1, True, 3]
+        cache.set("pn_1", "asst_1", "34600000002", "thread_b")
+        redis.delete.assert_called_once_with("thread_cache:pn_1")
+
+    # La copia local sigue sirviendo aunque se vacíe Redis
+    assert cache.get("pn_1", "asst_1", "34600000002") == "thread_b"
@@ -0,0 +1,39 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+from src.core.thread_touch import ThreadTouchBuffer
+
+
+def _session_factory():
+    session = MagicMock()
+    session.__enter__.return_value = session
+    return MagicMock(return_value=session), session
+
+
+def test_flush_writes_latest_timestamp_in_one_statement():
+    """Test de que varios toques se vuelcan en un único UPDATE"""
+    factory, session = _session_factory()
+    buffer = ThreadTouchBuffer(flush_interval=3600, max_batch=100, session_factory=factory)
+
+    buffer.touch("thread_a", datetime(2024, 1, 1, 10, 0))
+    buffer.touch("thread_a", datetime(2024, 1, 1, 10, 5))
+    buffer.touch("thread_b", datetime(2024, 1, 1, 10, 1))
+
+    assert buffer.flush() == 2
+    assert session.execute.call_count == 1
+    params = session.execute.call_args[0][1]
+    assert params["thread_id_0"] == "thread_a"
+    assert params["ts_0"] == datetime(2024, 1, 1, 10, 5)
+    assert buffer.pending() == 0
+
+
+def test_full_batch_flushes_immediately_and_failures_are_kept():
+    """Test de volcado al llenar el lote y de reintento si la BD falla"""
+    factory, session = _session_factory()
+    session.execute.side_effect = Exception("db caída")
+    buffer = ThreadTouchBuffer(flush_interval=3600, max_batch=2, session_factory=factory)
+
+    buffer.touch("thread_a")
+    buffer.touch("thread_b")
+
+    assert session.execute.call_count == 1
+    assert buffer.pending() == 2
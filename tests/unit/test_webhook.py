@@ -0,0 +1,35 @@
+from src.api.webhook import _extract_text_messages
+
+
+def _change(phone_number_id, messages):
+    return {"value": {"metadata": {"phone_number_id": phone_number_id}, "messages": messages}}
+
+
+def test_extract_reads_every_entry_and_change():
+    """Test de que se procesan todas las entries y changes del payload"""
+    data = {
+        "entry": [
+            {"changes": [
+                _change("pn_1", [{"id": "wamid.1", "from": "34600", "type": "text", "text": {"body": "hola"}}]),
+                _change("pn_2", [{"id": "wamid.2", "from": "34601", "type": "text", "text": {"body": "precio"}}]),
+            ]},
+            {"changes": [
+                _change("pn_1", [
+                    {"id": "wamid.3", "from": "34602", "type": "text", "text": {"body": "horario"}},
+                    {"id": "wamid.4", "from": "34602", "type": "image", "image": {}},
+                ]),
+            ]},
+        ]
+    }
+
+    messages = _extract_text_messages(data)
+
+    assert [m["message_id"] for m in messages] == ["wamid.1", "wamid.2", "wamid.3"]
+    assert messages[1]["phone_number_id"] == "pn_2"
+
+
+def test_extract_ignores_payload_without_messages():
+    """Test de payload sin mensajes"""
+    data = {"entry": [{"changes": [{"value": {"statuses": [{"status": "read"}]}}]}]}
+
+    assert _extract_text_messages(data) == []
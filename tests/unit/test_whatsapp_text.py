@@ -0,0 +1,40 @@
+from src.core.whatsapp_text import format_for_whatsapp, split_message
+
+
+def test_short_text_is_a_single_part():
+    """Test de que un texto corto no se divide"""
+    assert split_message("Hola *mundo*") == ["Hola *mundo*"]
+
+
+def test_long_text_splits_on_paragraphs_without_losing_content():
+    """Test de división por párrafos respetando el límite"""
+    paragraphs = [f"Párrafo {i}. " + "texto " * 60 for i in range(40)]
+    text = "\n\n".join(p.strip() for p in paragraphs)
+
+    parts = split_message(text, limit=1000)
+
+    assert len(parts) > 1
+    assert all(len(part) <= 1000 for part in parts)
+    assert all(part.startswith("Párrafo") for part in parts)
+    assert "\n\n".join(parts) == text
+
+
+def test_formatting_is_closed_and_reopened_across_parts():
+    """Test de que una negrita cortada se cierra y se reabre"""
+    text = "*" + "palabra " * 300 + "final*"
+
+    parts = split_message(text, limit=1000)
+
+    assert len(parts) > 1
+    assert all(part.startswith("*") and part.endswith("*") for part in parts)
+
+
+def test_format_no_longer_truncates():
+    """Test de que el formateo conserva respuestas largas completas"""
+    text = "**Hola**" + " palabra" * 1000
+
+    formatted = format_for_whatsapp(text)
+
+    assert formatted.startswith("*Hola*")
+    assert "truncado" not in formatted
+    assert len(formatted) > 4000